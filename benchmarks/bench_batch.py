@@ -0,0 +1,48 @@
+'''Times the batch T1 engine (DNMR.batch.run_grouped) on a synthetic temperature series, and checks the T1(T) it finds.
+
+The series is written twice: all temperatures in one file, and split over several files (each temperature's acquisitions
+spread over two of them), which the grouping has to put back together.
+
+Usage: python benchmarks/bench_batch.py [num_temperatures] [num_delays] [num_files] (default 30 16 4)
+'''
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+import DNMR.batch as batch
+from synthetic import write_t1_series, t1_of_temperature
+
+if __name__ == '__main__':
+    num_T = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    num_delays = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    num_files = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    temperatures = np.linspace(2.0, 60.0, num_T)
+    folder = tempfile.mkdtemp(prefix='dnmr_bench_batch_')
+    one = [ os.path.join(folder, 'series.hdf') ]
+    write_t1_series(one[0], temperatures, num_delays)
+    split = [ os.path.join(folder, f'part{i}.hdf') for i in range(num_files) ]
+    for i, fn in enumerate(split): # half of each temperature's delays in one part, the other half in the next
+        for j, T in enumerate(temperatures):
+            if(j % num_files == i):
+                write_t1_series(fn, [ T ], num_delays//2, seed=j, mode='a')
+            if(j % num_files == (i-1) % num_files):
+                write_t1_series(fn, [ T ], num_delays - num_delays//2, seed=1000+j, mode='a')
+
+    # the phase and echo time of synthetic.write_entry ('auto' can land 180° off on a curve that starts inverted)
+    params = dict(batch.default_parameters, phase=-np.degrees(0.3), peak_location=20.0, group=dict(batch.default_group, by='environment_temperature', tolerance=0.05))
+    params['fit'] = dict(params['fit'], model='1/2 Spin', fixed={ 'r': 1.0 })
+    print(f'{num_T} temperatures x {num_delays} delays, 1024 points per acquisition')
+    print(f'{"files":>6s} {"processes":>10s} {"groups":>7s} {"time (s)":>9s} {"s/group":>8s} {"median |ΔT1|/T1":>16s} {"within 3σ":>10s}')
+    for fns in [ one, split ]:
+        for workers in sorted(set([ 1, os.cpu_count() ])):
+            t0 = time.perf_counter()
+            results, means = batch.run_grouped(fns, params, workers)
+            t = time.perf_counter() - t0
+            T1 = np.array([ r.get('T1[μs]', np.nan) for r, c in results ])
+            errors = np.array([ r.get('T1 error[μs]', np.nan) for r, c in results ])
+            truth = t1_of_temperature(np.array(means))
+            print(f'{len(fns):6d} {workers:10d} {len(results):7d} {t:9.2f} {t/len(results):8.3f} {np.nanmedian(np.abs(T1 - truth)/truth):16.3g} '
+                  f'{np.sum(np.abs(T1 - truth) < 3*errors):5d}/{len(results)}')
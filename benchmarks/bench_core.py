@@ -0,0 +1,45 @@
+'''Times every stage of the processing in DNMR.core on synthetic data, without a display.
+
+Usage: python benchmarks/bench_core.py [num_acquisitions] [num_points] (default 500 1024)
+'''
+import sys
+import time
+
+import numpy as np
+
+import DNMR.core as core
+
+def synthetic_signal(n: int, npts: int, seed: int = 0):
+    '''(times, reals, imags, delays) of an inversion recovery series like synthetic.write_v100_file's, as arrays.'''
+    rng = np.random.default_rng(seed)
+    delays = np.exp(np.linspace(np.log(10), np.log(5e6), n))
+    t = np.arange(npts) * 0.2
+    amp = 1 - 2*np.exp(-delays/3e4)
+    sig = amp[:,None] * np.exp(-np.square((t[None,:] - 20.0)/8.0)) * np.exp(1j*0.3)
+    times = np.broadcast_to(t, (n, npts))
+    return times, np.real(sig) + rng.normal(scale=0.02, size=(n, npts)), np.imag(sig) + rng.normal(scale=0.02, size=(n, npts)), delays
+
+def timed(label, f, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = f(*args, **kwargs)
+    print(f'{label:32s} {time.perf_counter()-t0:8.4f} s')
+    return out
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    npts = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    times, reals, imags, delays = synthetic_signal(n, npts)
+    phases = np.zeros(n)
+    peaks = np.full(n, 20.0)
+    print(f'{n} acquisitions x {npts} points')
+
+    complexes = core.get_complexes(reals, imags)
+    for kind in core.filter_types:
+        timed(f'filter ({kind}, 12)', core.apply_filter, complexes, kind, 12)
+    timed('window (Half-Gaussian)', core.get_window, times, peaks, 'Half-Gaussian', 3.0)
+    t, complexes, window = timed('time_domain (Sinc + window)', core.time_domain, reals, imags, times, phases, peaks, 'Sinc', 12, 'Half-Gaussian', 3.0)
+    freq, fft = timed('fourier_transform', core.fourier_transform, t, complexes, peaks)
+    integrations = timed('integrate', core.integrate, freq, np.real(fft), -0.4, 0.4)
+    del_times, integrations, uncertainties = core.get_integrations(delays, integrations)
+    popt, sigmas, res = timed('fit_t1 (7/2 Spin)', core.fit_t1, del_times, integrations, uncertainties, '7/2 Spin', seed=0)
+    print(f'T1 = {popt[2]:.4g} ± {sigmas[2]:.2g} μs')
@@ -0,0 +1,61 @@
+'''Compares the throughput and peak memory of the processing pipeline in double and single precision (see DNMR.core.precision).
+
+Each precision runs in a fresh process, so that their peak resident set sizes (RSS) can be told apart.
+The signal is stored in single precision in both, as compact mode loads it.
+
+Usage: python benchmarks/bench_precision.py [num_acquisitions] [num_points] [repeats] (default 2000 4096 5)
+'''
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import DNMR.core as core
+from bench_core import synthetic_signal
+
+def get_peak_rss():
+    '''The peak resident set size of this process so far, in MB.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on Linux
+
+def run(precision: str, n: int, npts: int, repeats: int):
+    '''Times the pipeline from the raw signal to the integrals. Returns a dict of results.'''
+    times, reals, imags, delays = synthetic_signal(n, npts)
+    data = { 'times': np.array(times), 'reals': reals.astype(np.float32), 'imags': imags.astype(np.float32),
+             'size': n, 'phases': np.full(n, 17.0), 'peak_locations': np.full(n, 20.0) }
+    rss_before = get_peak_rss()
+    durations = []
+    for i in range(repeats):
+        data = dict(data) # a new object, so the pipeline loads it again
+        p = core.pipeline(precision).set_data(data)
+        p.filter.set(filter_type='Sinc', filter_size=12)
+        p.window.set(window_type='Half-Gaussian', window_size=3.0)
+        t0 = time.perf_counter()
+        integrals = p.integrate.get()
+        durations += [ time.perf_counter() - t0 ]
+        del p
+    return { 'precision': precision, 'seconds': float(np.median(durations)), 'rss_before': rss_before, 'rss_peak': get_peak_rss(),
+             'integrals': [ float(np.real(integrals[0])), float(np.real(integrals[-1])) ] }
+
+if __name__ == '__main__':
+    if(len(sys.argv) > 1 and sys.argv[1] == '--child'):
+        print(json.dumps(run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]))))
+        sys.exit(0)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    npts = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f'{n} acquisitions x {npts} points, Sinc filter + Half-Gaussian window -> integrals, median of {repeats}')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ os.path.dirname(os.path.abspath(__file__)) ] + sys.path))
+    results = {}
+    for precision in core.precisions.keys():
+        out = subprocess.run([ sys.executable, __file__, '--child', precision, str(n), str(npts), str(repeats) ], env=env, capture_output=True, text=True, check=True)
+        results[precision] = json.loads(out.stdout.strip().splitlines()[-1])
+    print(f'{"precision":10s} {"time (s)":>9s} {"acq/s":>9s} {"peak RSS (MB)":>14s} {"used (MB)":>10s}')
+    for precision, r in results.items():
+        print(f'{precision:10s} {r["seconds"]:9.4f} {n/r["seconds"]:9.0f} {r["rss_peak"]:14.0f} {r["rss_peak"] - r["rss_before"]:10.0f}')
+    d, s = results['double'], results['single']
+    print(f'single/double: {d["seconds"]/s["seconds"]:.2f}x the throughput, {(s["rss_peak"] - s["rss_before"])/(d["rss_peak"] - d["rss_before"]):.2f}x the memory used. '
+          f'Relative difference of the integrals: {abs(s["integrals"][0] - d["integrals"][0])/abs(d["integrals"][0]):.1e}')
@@ -0,0 +1,58 @@
+'''Times refreshing a version-100 file that is still being written, as the auto-refresh of the file selector does:
+read the new entries, append them to the data, and process the new acquisitions up to the integrals.
+
+Appending into growing buffers (fileops.extend_struct) and processing only the appended rows keeps the time per poll
+flat as the run grows; concatenating the data again and processing it all (as refreshes used to) grows with the run.
+Both give the same integrals.
+
+Usage: python benchmarks/bench_refresh.py [num_polls] [entries_per_poll] [num_points] (default 40 5 1024)
+'''
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+import DNMR.fileops as fileops
+import DNMR.core as core
+from synthetic import write_v100_file
+
+def poll(fn, data, last, p, append):
+    '''Reads the entries written since last, appends them to data, and integrates. Returns (data, last, integrals).'''
+    new, last = fileops.get_new_entries(fn, last)
+    data = fileops.extend_struct(data, new) if append else fileops.concatenate_structs([data, new])
+    p.set_data(data)
+    return data, last, p.integrate.get()
+
+if __name__ == '__main__':
+    num_polls = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    per_poll = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    npts = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+    folder = tempfile.mkdtemp(prefix='dnmr_bench_refresh_')
+    os.environ['DNMR_CACHE_DIR'] = os.path.join(folder, 'cache')
+    fns = { mode: os.path.join(folder, f'{mode}.hdf') for mode in [ 'append', 'concatenate' ] }
+    states = {}
+    for mode, fn in fns.items():
+        write_v100_file(fn, per_poll, npts)
+        data = fileops.get_data(fn)
+        p = core.pipeline().set_data(data)
+        p.filter.set(filter_type='Gaussian', filter_size=8)
+        p.window.set(window_type='Half-Gaussian', window_size=3.0)
+        p.integrate.get()
+        states[mode] = [ data, fileops.get_entry_numbers(fn)[-1], p, [] ]
+    print(f'{num_polls} polls of {per_poll} new entries ({npts} points), Gaussian filter + Half-Gaussian window -> integrals')
+    print(f'{"acquisitions":>12s} {"append (ms)":>12s} {"concatenate (ms)":>17s}')
+    for i in range(num_polls):
+        for mode, fn in fns.items():
+            write_v100_file(fn, per_poll, npts, seed=i+1, start_entry=per_poll*(i+1), mode='a')
+            data, last, p, times = states[mode]
+            t0 = time.perf_counter()
+            data, last, integrals = poll(fn, data, last, p, mode == 'append')
+            times += [ time.perf_counter() - t0 ]
+            states[mode][:2] = [ data, last ]
+        if(i % max(1, num_polls//8) == 0 or i == num_polls - 1):
+            print(f'{states["append"][0]["size"]:12d} {1e3*states["append"][3][-1]:12.1f} {1e3*states["concatenate"][3][-1]:17.1f}')
+    fresh = states['append'][2].with_data(states['append'][0]).integrate.get() # everything processed at once
+    a, c = states['append'][2].integrate.get(), states['concatenate'][2].integrate.get()
+    print(f'integrals the same as processing everything again: {np.array_equal(a, fresh)}, as concatenating: {np.array_equal(a, c)}')
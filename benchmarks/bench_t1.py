@@ -0,0 +1,72 @@
+'''Compares the T1 fit methods of DNMR.core.fit_t1 ('fast' and 'global') on synthetic recovery curves: time per fit and fit quality.
+Then times the global search on a short and a long noisy, stretched curve: one parameter vector per call (as it used to be)
+against whole populations per call, on 1 and on all cores.
+
+Usage: python benchmarks/bench_t1.py [num_curves_per_model] [num_points] [num_points_long] (default 10 20 2000)
+'''
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import scipy as sp
+
+import DNMR.core as core
+
+def synthetic_curves(model: str, num: int, npts: int, seed: int = 0):
+    '''Yields (true args, delays, integrals, uncertainties) of noisy recovery curves, normalised as the T1 tab does.'''
+    rng = np.random.default_rng(seed)
+    for i in range(num):
+        T1 = np.exp(rng.uniform(np.log(1e2), np.log(1e6)))
+        args = np.array([ rng.uniform(0.5, 2.0), rng.uniform(0.5, 1.0), T1, rng.uniform(0.7, 1.2) ])
+        delays = np.exp(np.linspace(np.log(T1/300), np.log(T1*30), npts))
+        integrals = core.fit_models[model](args, delays) + rng.normal(scale=0.01*args[0], size=npts)
+        yield args, *core.get_integrations(delays, integrals, normalize=True)
+
+def bench_global(npts: int, model: str = '7/2 Spin', seed: int = 0):
+    '''Times differential evolution on one curve, evaluating the cost per vector and per population.'''
+    rng = np.random.default_rng(seed)
+    args = np.array([ 1.0, 0.9, 1e4, 0.6 ])
+    delays = np.exp(np.linspace(np.log(1e1), np.log(1e6), npts))
+    d, y, u = core.get_integrations(delays, core.fit_models[model](args, delays) + rng.normal(scale=0.05, size=npts), normalize=True)
+    bounds = core.get_bounds(y, d)
+    fit_func = core.fit_models[model]
+    t0 = time.perf_counter()
+    res = sp.optimize.differential_evolution(lambda a: np.sum(np.square((fit_func(a, d) - y)/u)), bounds=bounds, seed=seed, popsize=20, tol=1e-3)
+    print(f'{npts} points, 5% noise, r = {args[3]}, differential evolution only (no polish by curve_fit)')
+    print(f'{"evaluation":30s} {"time (s)":>9s} {"cost":>12s} {"T1":>10s} {"r":>6s}')
+    print(f'{"per vector":30s} {time.perf_counter() - t0:9.3f} {res.fun:12.6g} {res.x[2]:10.4g} {res.x[3]:6.3f}')
+    for workers in [ 1, -1 ]:
+        pool = None if workers == 1 else concurrent.futures.ThreadPoolExecutor(os.cpu_count())
+        t0 = time.perf_counter()
+        res = sp.optimize.differential_evolution(lambda p: core.get_population_costs(model, p, d, y, u, pool, 1 if pool is None else os.cpu_count()),
+                                                 bounds=bounds, seed=seed, vectorized=True, updating='deferred', popsize=20, tol=1e-3) # as fit_t1
+        if not(pool is None):
+            pool.shutdown()
+        label = f'per population, {1 if pool is None else os.cpu_count()} thread(s)'
+        print(f'{label:30s} {time.perf_counter() - t0:9.3f} {res.fun:12.6g} {res.x[2]:10.4g} {res.x[3]:6.3f}')
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    npts = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    npts_long = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    print(f'{num} curves of {npts} points per model, 1% noise')
+    print(f'{"model":20s} {"method":7s} {"ms/fit":>9s} {"median cost":>12s} {"worse fits":>11s} {"median |ΔT1|/T1":>16s}')
+    for model in core.fit_models.keys():
+        curves = list(synthetic_curves(model, num, npts))
+        results = {}
+        for method in [ 'global', 'fast' ]:
+            t0 = time.perf_counter()
+            results[method] = [ core.fit_t1(d, y, u, model, seed=0, method=method) for args, d, y, u in curves ]
+            results[method + ' time'] = (time.perf_counter() - t0) / num
+        for method in [ 'global', 'fast' ]:
+            costs = np.array([ r[2].fun for r in results[method] ])
+            best = np.minimum(costs, [ r[2].fun for r in results['global' if method == 'fast' else 'fast'] ])
+            worse = np.sum(costs > best * (1 + 1e-4) + 1e-12) # than the other method, beyond the fit tolerance
+            T1_errors = [ abs(r[0][2] - args[2])/args[2] for r, (args, d, y, u) in zip(results[method], curves) ]
+            print(f'{model:20s} {method:7s} {1e3*results[method + " time"]:9.1f} {np.median(costs):12.4g} {worse:11d} {np.median(T1_errors):16.3g}')
+        print(f'{"":20s} speedup {results["global time"]/results["fast time"]:.0f}x')
+    for n in [ 30, npts_long ]:
+        print()
+        bench_global(n)
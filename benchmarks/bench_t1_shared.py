@@ -0,0 +1,73 @@
+'''Times DNMR.core.fit_t1_shared (one least squares problem with a block-sparse Jacobian) against the same joint fit
+solved densely, as the number of curves sharing the stretch exponent r grows.
+
+Usage: python benchmarks/bench_t1_shared.py [max_curves] [num_points] (default 300 20)
+'''
+import sys
+import time
+
+import numpy as np
+import scipy as sp
+
+import DNMR.core as core
+
+def synthetic_curves(num: int, npts: int, r: float = 0.7, model: str = '7/2 Spin', seed: int = 0):
+    '''num noisy recovery curves with their own gamma_0, s and T1, and a common r.'''
+    rng = np.random.default_rng(seed)
+    curves = []
+    for i in range(num):
+        T1 = np.exp(rng.uniform(np.log(1e2), np.log(1e5)))
+        args = np.array([ rng.uniform(0.5, 2.0), rng.uniform(0.5, 1.0), T1, r ])
+        delays = np.exp(np.linspace(np.log(T1/300), np.log(T1*30), npts))
+        curves += [ core.get_integrations(delays, core.fit_models[model](args, delays) + rng.normal(scale=0.01*args[0], size=npts), normalize=True) ]
+    return curves
+
+def fit_dense(curves, model: str, shared=[3]):
+    '''The joint fit of fit_t1_shared (same start, bounds and parameters), with a dense Jacobian, an exact trust region solve
+    and a dense inverse for the uncertainties. Returns the shared parameters and their uncertainties.'''
+    num = len(curves)
+    local = [ i for i in range(4) if not(i in shared) ]
+    S, L = len(shared), len(local)
+    starts = np.array([ core.fit_t1(*c, model=model)[0] for c in curves ])
+    bounds = np.array([ core.get_bounds(y, d) for d, y, u in curves ])
+    lower = np.concatenate([ np.min(bounds[:,shared,0], axis=0), bounds[:,local,0].ravel() ])
+    upper = np.concatenate([ np.max(bounds[:,shared,1], axis=0), bounds[:,local,1].ravel() ])
+    p0 = np.clip(np.concatenate([ np.median(starts[:,shared], axis=0), starts[:,local].ravel() ]), lower, upper)
+    def all_args(p):
+        args = np.empty((num, 4))
+        args[:,shared] = p[:S]
+        args[:,local] = np.reshape(p[S:], (num, L))
+        return args
+    def residuals(p):
+        args = all_args(p)
+        return np.concatenate([ (core.evaluate_model(model, args[c], d) - y)/u for c, (d, y, u) in enumerate(curves) ])
+    def jacobian(p):
+        args = all_args(p)
+        J = np.zeros((sum([ len(c[0]) for c in curves ]), S + L*num))
+        row = 0
+        for c, (d, y, u) in enumerate(curves):
+            Jc = core.evaluate_model(model, args[c], d, jacobian=True)[1] / u[:,None]
+            J[row:row+len(d),:S] = Jc[:,shared]
+            J[row:row+len(d),S+L*c:S+L*(c+1)] = Jc[:,local]
+            row += len(d)
+        return J
+    fit = sp.optimize.least_squares(residuals, p0, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac', tr_solver='exact')
+    J = jacobian(fit.x)
+    cov = np.linalg.pinv(J.T @ J) * np.sum(np.square(fit.fun)) / (J.shape[0] - J.shape[1])
+    return fit.x[:S], np.sqrt(np.diag(cov)[:S])
+
+if __name__ == '__main__':
+    max_curves = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    npts = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f'curves of {npts} points sharing r = 0.7, 1% noise. Times include the separate fits both start from')
+    print(f'{"curves":>7s} {"sparse (s)":>11s} {"ms/curve":>9s} {"dense (s)":>10s} {"ms/curve":>9s} {"r (sparse)":>18s} {"r (dense)":>18s}')
+    for num in [ n for n in [ 10, 30, 100, 300, 1000 ] if n <= max_curves ]:
+        curves = synthetic_curves(num, npts)
+        t0 = time.perf_counter()
+        popts, sigmas, res = core.fit_t1_shared(curves, '7/2 Spin', shared=[3])
+        t_sparse = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        r_dense, r_dense_sigma = fit_dense(curves, '7/2 Spin', shared=[3])
+        t_dense = time.perf_counter() - t0
+        print(f'{num:7d} {t_sparse:11.2f} {1e3*t_sparse/num:9.1f} {t_dense:10.2f} {1e3*t_dense/num:9.1f} '
+              f'{popts[0,3]:9.5f}±{sigmas[0,3]:.5f} {r_dense[0]:9.5f}±{r_dense_sigma[0]:.5f}')
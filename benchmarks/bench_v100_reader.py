@@ -0,0 +1,49 @@
+'''Compares read_hdf_v100 against read_hdf_v100_columnar on a synthetic version-100 file.
+
+Usage: python benchmarks/bench_v100_reader.py [num_entries] (default 5000)
+'''
+import sys
+import os
+import time
+import tempfile
+
+import numpy as np
+import h5py as hdf
+
+from synthetic import write_v100_file
+from DNMR.fileops_loaders.data_struct import data_struct
+from DNMR.fileops_loaders.v100 import read_hdf_v100
+from DNMR.fileops_loaders.v100_columnar import read_hdf_v100_columnar
+
+def assert_same(a, b, prefix=''):
+    assert list(a.keys()) == list(b.keys()), f'{prefix}: {list(a.keys())} != {list(b.keys())}'
+    for k in a.keys():
+        if(isinstance(a[k], data_struct)):
+            assert_same(a[k], b[k], prefix+k+'/')
+            continue
+        x = np.asarray(a[k])
+        y = np.asarray(b[k])
+        assert x.shape == y.shape and x.dtype == y.dtype, f'{prefix+k}: {x.shape}/{x.dtype} != {y.shape}/{y.dtype}'
+        assert np.array_equal(x, y), f'{prefix+k}: values differ'
+
+def time_reader(reader, fn):
+    with hdf.File(fn, 'r') as f:
+        t0 = time.perf_counter()
+        data = reader(f)
+        return time.perf_counter() - t0, data
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    fn = os.path.join(tempfile.gettempdir(), f'dnmr_bench_v100_{n}.hdf')
+    if not(os.path.exists(fn)):
+        print(f'Writing {n} entries to {fn}...')
+        write_v100_file(fn, n)
+
+    t_col, d_col = time_reader(read_hdf_v100_columnar, fn)
+    t_old, d_old = time_reader(read_hdf_v100, fn)
+    assert_same(d_old, d_col)
+
+    print(f'{n} entries')
+    print(f'read_hdf_v100:           {t_old:8.3f} s')
+    print(f'read_hdf_v100_columnar:  {t_col:8.3f} s')
+    print(f'speedup:                 {t_old/t_col:8.1f}x')
@@ -0,0 +1,60 @@
+'''Writes synthetic frappy/NICOS-style HDF files for the benchmarks in this folder.'''
+import numpy as np
+import h5py as hdf
+
+def write_v100_file(fn: str, num_entries: int = 5000, num_points: int = 1024, seed: int = 0, start_entry: int = 0, mode: str = 'w'):
+    '''Writes (or, with mode='a', extends) a version-100 file with num_entries entries of num_points points each.'''
+    rng = np.random.default_rng(seed)
+    delays = np.exp(np.linspace(np.log(10), np.log(5e6), max(num_entries, 2)))
+    with hdf.File(fn, mode) as f:
+        f.attrs['version'] = '100'
+        for n in range(start_entry, start_entry + num_entries):
+            write_entry(f, n, delays[n % len(delays)], 3e4, 1.8 + 1e-4*n, 7.0 + 1e-3*n, rng, num_points)
+
+def t1_of_temperature(T):
+    '''The T1 (μs) of the synthetic series at temperature T (K): Korringa-like, T1 T constant.'''
+    return 3e5 / T
+
+def write_t1_series(fn: str, temperatures, num_delays: int = 16, num_points: int = 1024, seed: int = 0, mode: str = 'w'):
+    '''Writes a version-100 file of one T1 recovery (num_delays entries) at each temperature, with T1 = t1_of_temperature.
+    The temperature readings wander by a few mK around each setpoint.'''
+    rng = np.random.default_rng(seed)
+    with hdf.File(fn, mode) as f:
+        f.attrs['version'] = '100'
+        n = len([ k for k in f.keys() if k.startswith('entry') ])
+        for T in temperatures:
+            T1 = t1_of_temperature(T)
+            for delay in np.exp(np.linspace(np.log(T1/100), np.log(T1*10), num_delays)):
+                write_entry(f, n, delay, T1, T + rng.normal(scale=2e-3), 7.0, rng, num_points)
+                n += 1
+
+def write_entry(f, n: int, delay: float, T1: float, temperature: float, field: float, rng, num_points: int = 1024):
+    '''Writes entry n: an inversion recovery echo after delay (μs), with noise.'''
+    t = np.arange(num_points) * 0.2
+    e = f.create_group(f'entry{n}')
+    d = e.create_group('data')
+    amp = 1 - 2*np.exp(-delay/T1)
+    sig = amp * np.exp(-np.square((t - 20.0)/8.0)) * np.exp(1j*0.3)
+    noise = rng.normal(scale=0.02, size=(2, num_points))
+    d['tnmr_reals'] = 16*(np.real(sig) + noise[0])
+    d['tnmr_imags'] = 16*(np.imag(sig) + noise[1])
+    d['tnmr_times'] = t
+    d['sample'] = np.array([b'synthetic'])
+    d['nucleus'] = np.array([b'27Al'])
+    p = d.create_group('tnmr_params')
+    p['acquisition_time'] = 204.8
+    p['num_scans'] = 16
+    p['actual_num_acqs'] = 16
+    p['obs_freq'] = 213.16
+    p['post_acquisition_time'] = 10.0
+    p['acq_phase_cycle'] = np.bytes_('0 2 0 2 1 3 1 3 2 0 2 0 3 1 3 1')
+    s = d.create_group('tnmr_sequence')
+    for k, (pw, ph, dt) in enumerate([(5, 40, delay), (2.5, 40, 50), (5, 40, 0.1)]):
+        g = s.create_group(str(k))
+        g['pulse_width'] = pw
+        g['pulse_height'] = ph
+        g['delay_time'] = dt
+        g['phase_cycle'] = np.bytes_('0 0 0 0')
+    env = e.create_group('environment')
+    env['se_mf'] = [field]
+    env['temperature'] = [temperature]
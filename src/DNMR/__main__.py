@@ -1,5 +1,9 @@
 
 import sys
+if(__name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'batch'): # python -m DNMR batch ...: before Qt is imported, so it runs headless
+    from DNMR.cli import main
+    main()
+
 import pathlib
 import traceback
 
@@ -16,6 +20,7 @@ from PyQt6.QtWidgets import *
 from PyQt6 import QtGui
 
 import DNMR.fileops as fileops
+import DNMR.core as core
 from DNMR.miniwidgets import *
 
 from DNMR.tab_phase_adj import *
@@ -40,11 +45,14 @@ class MainWindow(QWidget):
         data_widgets = {}
         self.fileselector = FileSelectionWidget()
         data_widgets['fileselector'] = self.fileselector
+        data_widgets['pipeline'] = core.pipeline()
         if(len(sys.argv) > 1): # passed arguments are files to load
             self.fileselector.load_files(sys.argv[1:])
         
         self.pushbutton_process = QPushButton('Reload')
         self.pushbutton_process.clicked.connect(self.update_all)
+        self.fileselector.worker_load.busy.connect(lambda busy: self.pushbutton_process.setEnabled(not(busy))) # nothing to reload until the files are read
+        self.pushbutton_process.setEnabled(not(self.fileselector.worker_load.is_busy())) # files passed as arguments may be being read already
         
         self.filedialog_export = QFileDialog()
         self.button_export = QPushButton('Export Data (CSV)')
@@ -67,7 +75,7 @@ class MainWindow(QWidget):
         self.tabwidget_tabs.addTab(self.tab_inv_laplace, 'Inverse Laplace')
         
         ### TAB FUNCTIONALITY
-        self.tabwidget_tabs.currentChanged.connect(lambda: self.tabwidget_tabs.currentWidget().update())
+        self.tabwidget_tabs.currentChanged.connect(lambda: self.tabwidget_tabs.currentWidget().show_tab())
 
         ### LAYOUT COMBINATION (Don't touch if you are just adding a tab!)
         layout = QVBoxLayout()
@@ -81,7 +89,10 @@ class MainWindow(QWidget):
 
     def export_selected(self):
         fn = self.filedialog_export.getSaveFileName()[0]
-        saved_dict = self.tabwidget_tabs.currentWidget().get_exported_data()
+        tab = self.tabwidget_tabs.currentWidget()
+        if(tab.stale):
+            tab.update_now()
+        saved_dict = tab.get_exported_data()
         print(saved_dict)
         df = pd.DataFrame(dict([ (k, pd.Series(v)) for k,v in saved_dict.items() ]))
         df.to_csv(path_or_buf=fn)
@@ -89,6 +100,8 @@ class MainWindow(QWidget):
         print(df)
 
     def update_all(self):
+        if(self.fileselector.refresh()): # new entries were appended, and the tabs have already been redrawn
+            return
         ct = self.tabwidget_tabs.count()
         for i in range(ct):
             self.tabwidget_tabs.widget(i).update()
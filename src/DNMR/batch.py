@@ -0,0 +1,302 @@
+import os
+import sys
+import glob
+import json
+import argparse
+import traceback
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+import DNMR.fileops as fileops
+import DNMR.core as core
+
+# Everything a parameter file can set, with the same defaults as the tabs. See the README for an example.
+default_parameters = {
+    'files': [],                                    # data files (or glob patterns), relative to the parameter file
+    'filter': None,                                 # { 'type': one of core.filter_types, 'size': int }
+    'window': None,                                 # { 'type': one of core.window_types, 'size': μs, 'position': μs }
+    'phase': 0.0,                                   # degrees, or 'auto' (as the Autophase button: also sets the peak location)
+    'peak_location': 0.0,                           # μs
+    'subsample': False,                             # start every acquisition exactly at the peak location, not the closest point
+    'zero_fill': 1,                                 # transform at (at least) this many times the number of points
+    'apodization': None,                            # { 'type': one of core.apodization_types, 'broadening': MHz }
+    'integration': { 'centre': 0.0, 'width': 0.8 }, # MHz
+    'noise': None,                                  # { 'left': MHz, 'right': MHz }, lists for several bands: a band without signal, to weigh the fit with the noise of the integrals
+    'fit': { 'model': '7/2 Spin', 'normalize': True, 'fixed': {}, 'exclude': [], 'method': 'fast' }, # fixed: { parameter: value }. exclude: indices of sorted points. method: see core.fit_t1
+    'seed': None,                                   # for reproducible fits
+    'lazy': False,
+    'compact': False,
+    'precision': None,                              # 'double' or 'single' (see core.precision). None: the DNMR_PRECISION environment variable, else double
+    'group': None,                                  # { 'by': key, e.g. 'environment_temperature', 'tolerance': in its units, 'min_acquisitions': int }. None: one fit per file
+}
+default_group = { 'by': 'environment_temperature', 'tolerance': 0.01, 'min_acquisitions': 4 }
+
+def load_parameters(fn: str):
+    '''Reads a JSON parameter file, filling in defaults. Relative file names are made relative to the parameter file.'''
+    with open(fn, 'r') as f:
+        given = json.load(f)
+    unknown = [ k for k in given.keys() if not(k in default_parameters) ]
+    if(len(unknown) > 0):
+        raise ValueError(f'Unknown keys in {fn}: {unknown}. Known: {list(default_parameters.keys())}')
+    params = json.loads(json.dumps(default_parameters)) # deep copy
+    for k, v in given.items():
+        if(isinstance(params[k], dict) and isinstance(v, dict)):
+            params[k].update(v)
+        else:
+            params[k] = v
+    if(isinstance(params['group'], str)):
+        params['group'] = { 'by': params['group'] }
+    if not(params['group'] is None):
+        params['group'] = dict(default_group, **params['group'])
+    base = os.path.dirname(os.path.abspath(fn))
+    params['files'] = [ os.path.join(base, i) for i in params['files'] ]
+    return params
+
+def expand_files(patterns):
+    '''Expands glob patterns, keeping the order given and dropping repeats.'''
+    fns = []
+    for p in patterns:
+        matches = sorted(glob.glob(p)) if glob.has_magic(p) else [ p ]
+        if(len(matches) == 0):
+            print(f'WARNING: {p} matches no files')
+        fns += [ m for m in matches if not(m in fns) ]
+    return fns
+
+def process_data(data, params):
+    '''Runs the phase -> Fourier transform -> integration -> T1 fit chain of the tabs on one data_struct.
+
+    Returns
+    -------
+        (row, curve). row is a dict of results (one line of the results table), curve a dict of the points fitted.
+    '''
+    n = data['size']
+    flt = params['filter']
+    win = params['window']
+    fit = params['fit']
+    p = core.pipeline(params['precision']).set_data(data)
+    p.filter.set(filter_type=None if flt is None else flt['type'], filter_size=12 if flt is None else flt.get('size', 12))
+    p.window.set(window_type=None if win is None else win['type'], window_size=3.0 if win is None else win.get('size', 3.0),
+                 window_position=0.0 if win is None else win.get('position', 0.0))
+    phases = np.zeros(n) if params['phase'] == 'auto' else np.full(n, float(params['phase']))
+    peak_locations = np.full(n, float(params['peak_location']))
+    p.set_peaks(phases, peak_locations)
+    apod = params['apodization']
+    p.set_transform(subsample=bool(params['subsample']), zero_fill=int(params['zero_fill']),
+                    apodization=None if apod is None else apod['type'], broadening=0.01 if apod is None else float(apod.get('broadening', 0.01)),
+                    workers=1) # one thread each: the files are spread over processes (pool_map) already
+    if(params['phase'] == 'auto'): # as the Autophase button, on the acquisition with the largest signal. Only the window and phase are redone.
+        complexes = p.phase.get()
+        index = core.locate_max(complexes)
+        phase, peak_t = core.autophase(p.load.get()[1][index], complexes[index], phases[index])
+        phases = np.full(n, phase)
+        peak_locations = np.full(n, peak_t)
+        p.set_peaks(phases, peak_locations)
+
+    left, right = core.get_pivots(params['integration']['centre'], params['integration']['width'])
+    noise = params['noise']
+    if(noise is None):
+        p.set_integration(left, right)
+    else:
+        p.set_integration(left, right, noise['left'], noise['right'])
+    p.points.set(normalize=fit['normalize'])
+    p.fit.set(model=fit['model'], fixed={ core.get_parameter_index(k): float(v) for k, v in fit['fixed'].items() }, excluded=fit['exclude'], seed=params['seed'], method=fit['method'])
+    popt, sigmas, res = p.fit.get()
+    del_times, integrations, uncertainties = p.points.get()
+
+    row = { 'acquisitions': n, 'phase [deg]': phases[0], 'peak location [μs]': peak_locations[0], 'model': fit['model'] }
+    for (label, name, units), x, s in zip(core.parameters, popt, sigmas):
+        row[f'{name}[{units}]'] = x
+        row[f'{name} error[{units}]'] = s
+    row['cost'] = res.fun
+    group_key = None if params['group'] is None else params['group']['by']
+    for k in data.keys(): # the conditions of the run, to plot T1 against
+        if(k.startswith('environment_') or k in ['ppms_mf', 'ppms_field', 'obs_freq', group_key]):
+            try:
+                row[f'{k}[{fileops.get_units(k)}]'] = np.mean(np.asarray(data[k], dtype=np.float64))
+            except:
+                continue
+    curve = { 'delays': del_times, 'integrals': integrations, 'excluded': [ i in fit['exclude'] for i in range(len(del_times)) ] }
+    if not(noise is None):
+        curve['uncertainties'] = uncertainties
+    return row, curve
+
+def run_file(fn: str, params):
+    '''Loads one file and processes it. Errors are reported in the row, so that one bad file doesn't stop the batch.'''
+    row = { 'file': fn }
+    try:
+        data = fileops.get_data(fn, lazy=params['lazy'], compact=params['compact'])
+        r, curve = process_data(data, params)
+        row.update(r)
+        return row, curve
+    except Exception as e:
+        traceback.print_exc()
+        row['error'] = f'{type(e).__name__}: {e}'
+        return row, None
+
+def get_group_values(data, key: str):
+    '''The reading of key (e.g. environment_temperature) at every acquisition of a data_struct, averaged if there are several per acquisition.'''
+    values = np.asarray(data[key], dtype=np.float64)
+    return np.reshape(values, (data['size'], -1)).mean(axis=1)
+
+def scan_file(fn: str, params):
+    '''Loads one file (lazily: only its readings are needed) and returns the group key's value at every acquisition.'''
+    data = fileops.get_data(fn, lazy=True, compact=params['compact'])
+    return get_group_values(data, params['group']['by'])
+
+def get_groups(fns, values, tolerance: float):
+    '''Sorts the acquisitions of all files by value and splits them wherever consecutive values are more than tolerance apart,
+    so that each group is one temperature (or field, ...) of the series, whichever files its acquisitions are in.
+
+    Parameters
+    ----------
+        fns: list of files.
+        values: list of arrays, the values of every acquisition of each file (see scan_file).
+
+    Returns
+    -------
+        List of groups, by increasing value. A group is { file: indices of its acquisitions in that file }.
+    '''
+    file_indices = np.concatenate([ np.full(len(v), i) for i, v in enumerate(values) ])
+    rows = np.concatenate([ np.arange(len(v)) for v in values ])
+    values = np.concatenate(values)
+    order = np.argsort(values, kind='stable')
+    breaks = np.nonzero(np.diff(values[order]) > tolerance)[0] + 1
+    groups = []
+    for g in np.split(order, breaks):
+        group = {}
+        for i in np.unique(file_indices[g]):
+            group[fns[i]] = np.sort(rows[g][file_indices[g] == i])
+        groups += [ group ]
+    return groups
+
+def run_group(group, params):
+    '''Fits the acquisitions of one group (see get_groups), as run_file does for a whole file.'''
+    row = { 'file': ';'.join(group.keys()) }
+    try:
+        n = sum([ len(rows) for rows in group.values() ])
+        if(n < params['group']['min_acquisitions']):
+            raise ValueError(f'only {n} acquisitions, fewer than min_acquisitions')
+        parts = [ fileops.take_rows(fileops.get_data(fn, lazy=params['lazy'], compact=params['compact']), rows) for fn, rows in group.items() ]
+        data = parts[0] if len(parts) == 1 else fileops.concatenate_structs(parts)
+        r, curve = process_data(data, params)
+        row.update(r)
+        return row, curve
+    except Exception as e:
+        traceback.print_exc()
+        row['error'] = f'{type(e).__name__}: {e}'
+        return row, None
+
+def pool_map(func, items, params, workers: int = 1, progress=None, labels=None):
+    '''Returns [ func(item, params) for item in items ], computed in a pool of worker processes if workers > 1.
+    progress(done, total, label) is called as each one finishes.'''
+    total = len(items)
+    labels = [ str(i) for i in items ] if labels is None else labels
+    results = [ None ] * total
+    if(workers <= 1 or total <= 1):
+        for i, item in enumerate(items):
+            results[i] = func(item, params)
+            if not(progress is None):
+                progress(i+1, total, labels[i])
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, total)) as pool:
+        futures = { pool.submit(func, item, params): i for i, item in enumerate(items) }
+        done = 0
+        for fut in concurrent.futures.as_completed(futures):
+            results[futures[fut]] = fut.result()
+            done += 1
+            if not(progress is None):
+                progress(done, total, labels[futures[fut]])
+    return results
+
+def run(fns, params, workers: int = 1, progress=None):
+    '''Runs run_file on every file, optionally in a pool of worker processes. Returns the (row, curve)s in the order of fns.'''
+    return pool_map(run_file, fns, params, workers, progress)
+
+def run_grouped(fns, params, workers: int = 1, progress=None):
+    '''Groups the acquisitions of all files by params['group'] (see get_groups) and fits every group, in a pool of worker processes.
+
+    Returns
+    -------
+        (results, means): the (row, curve)s, and the mean value of each group, by increasing value.
+    '''
+    values = pool_map(scan_file, fns, params, workers)
+    groups = get_groups(fns, values, float(params['group']['tolerance']))
+    means = []
+    labels = []
+    for g in groups:
+        v = np.concatenate([ values[fns.index(fn)][rows] for fn, rows in g.items() ])
+        means += [ np.mean(v) ]
+        labels += [ f'{params["group"]["by"]} = {means[-1]:.6g} ({len(v)} acquisitions)' ]
+    return pool_map(run_group, groups, params, workers, progress, labels), means
+
+def plot_results(rows, fn: str, x_key: str = None):
+    '''Saves a plot of T1 (with its uncertainty) against x_key (a column of the results table, e.g. environment_temperature[K]), or against the row number.'''
+    from matplotlib.figure import Figure # not pyplot, which would pick a GUI backend
+    table = pd.DataFrame([ r for r in rows if not('error' in r) ])
+    T1 = f'{core.parameters[2][1]}[{core.parameters[2][2]}]'
+    T1_error = f'{core.parameters[2][1]} error[{core.parameters[2][2]}]'
+    fig = Figure(figsize=(6, 4.5), layout='tight')
+    ax = fig.add_subplot()
+    if(len(table) > 0):
+        x = table[x_key] if not(x_key is None) and x_key in table.columns else np.arange(len(table))
+        ax.errorbar(x, table[T1], yerr=table[T1_error], fmt='o', capsize=3)
+        ax.set_yscale('log')
+    ax.set_xlabel('row' if x_key is None or not(x_key in table.columns) else x_key)
+    ax.set_ylabel('T₁ [μs]')
+    fig.savefig(fn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='dnmr batch', description='Filter, phase, Fourier transform, integrate and T1-fit data files without the GUI, and write a table of the results.')
+    parser.add_argument('parameters', help='JSON parameter file (see the README)')
+    parser.add_argument('files', nargs='*', help='data files or glob patterns, in addition to those in the parameter file')
+    parser.add_argument('-o', '--output', default='results.csv', help='results table (CSV, one line per file). Default results.csv')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of processes (default: one per CPU)')
+    parser.add_argument('--curves', default=None, help='directory to also write the delays and integrals of every file (or group) into')
+    parser.add_argument('--group-by', default=None, help='fit the acquisitions of all files grouped by this key (e.g. environment_temperature) rather than file by file')
+    parser.add_argument('--plot', default=None, help='image file to also plot T1 against the grouping key (or the --plot-x column) into')
+    parser.add_argument('--plot-x', default=None, help='column of the results table to plot T1 against (default: the grouping key)')
+    args = parser.parse_args(argv)
+
+    params = load_parameters(args.parameters)
+    if not(args.group_by is None):
+        params['group'] = dict(default_group if params['group'] is None else params['group'], by=args.group_by)
+    fns = expand_files(params['files'] + args.files)
+    if(len(fns) == 0):
+        parser.error('no data files given')
+
+    if(params['group'] is None):
+        print(f'Processing {len(fns)} files with {min(args.workers, len(fns))} processes')
+        results = run(fns, params, args.workers, progress=lambda done, total, fn: print(f'[{done}/{total}] {fn}'))
+        names = [ os.path.splitext(os.path.basename(fn))[0] for fn in fns ]
+    else:
+        key = params['group']['by']
+        print(f'Grouping the acquisitions of {len(fns)} files by {key} (tolerance {params["group"]["tolerance"]}) with {args.workers} processes')
+        results, means = run_grouped(fns, params, args.workers, progress=lambda done, total, label: print(f'[{done}/{total}] {label}'))
+        names = [ f'{key}={m:.6g}' for m in means ]
+
+    rows = [ r for r, c in results ]
+    pd.DataFrame(rows).to_csv(args.output, index=False)
+    print(f'Wrote {args.output}')
+    if not(args.curves is None):
+        os.makedirs(args.curves, exist_ok=True)
+        digits = len(str(len(results) - 1))
+        for i, (name, (r, c)) in enumerate(zip(names, results)):
+            if not(c is None): # numbered by row of the table, as files of the same name may be in different folders
+                pd.DataFrame(c).to_csv(os.path.join(args.curves, f'{i:0{digits}d}_{name}.csv'), index=False)
+    if not(args.plot is None):
+        x_key = args.plot_x
+        if(x_key is None and not(params['group'] is None)):
+            x_key = f'{params["group"]["by"]}[{fileops.get_units(params["group"]["by"])}]'
+        plot_results(rows, args.plot, x_key)
+        print(f'Wrote {args.plot}')
+    failed = [ r['file'] for r, c in results if 'error' in r ]
+    if(len(failed) > 0):
+        print(f'{len(failed)} {"files" if params["group"] is None else "groups"} failed: {failed}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import sys
+
+def main():
+    '''The dnmr command. "dnmr batch ..." processes files without Qt (see batch.py), so it runs on machines without a display.
+    Anything else starts the GUI, loading the arguments as files. Qt is only imported in that case.'''
+    if(len(sys.argv) > 1 and sys.argv[1] == 'batch'):
+        from DNMR.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    from DNMR.__main__ import start_app
+    start_app()
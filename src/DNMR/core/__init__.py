@@ -0,0 +1,8 @@
+'''The processing behind the tabs, without Qt: time-domain filtering and phasing, Fourier transforms, integration and T1 fits, and the cached graph (pipeline) the tabs run them through.'''
+from DNMR.core.precision import *
+from DNMR.core.filters import *
+from DNMR.core.phase import *
+from DNMR.core.fourier import *
+from DNMR.core.integrate import *
+from DNMR.core.t1 import *
+from DNMR.core.graph import node, pipeline
@@ -0,0 +1,99 @@
+import functools
+
+import numpy as np
+import scipy as sp
+import scipy.fft
+import scipy.ndimage
+
+# In the order the phase tab lists them.
+filter_types = [ 'Sinc', 'Gaussian', 'Half-Gaussian', 'Median' ]
+window_types = [ 'Half-Gaussian', 'Sinc', 'Gaussian', 'Box' ]
+
+def get_filter_kernel(kind: str, size: int, npts: int):
+    '''Returns the normalised convolution kernel of a time-domain filter (not Median, which isn't a convolution).
+
+    Parameters
+    ----------
+        kind: one of filter_types.
+        size: int, the filter size (half-width in points for the Gaussians).
+        npts: int, number of points in a row (sets the Sinc's length).
+    '''
+    if(kind == 'Gaussian'):
+        kernel = np.exp(-1/2 * np.square(np.linspace(-3, 3, size*2+1)))
+    elif(kind == 'Sinc'):
+        kernel = np.sinc(np.linspace(-npts/(2*size + 1), npts/(2*size + 1), npts))
+    elif(kind == 'Half-Gaussian'):
+        i_s = np.linspace(-3, 3, size*2+1)
+        kernel = np.where(i_s >= 0, np.exp(-1/2 * np.square(i_s)), 0)
+    else:
+        raise ValueError(f'Unknown filter type {kind}')
+    return kernel / np.sum(kernel)
+
+@functools.lru_cache(maxsize=32)
+def get_kernel_spectrum(kind: str, size: int, npts: int, dtype=np.complex128):
+    '''The FFT of a filter kernel, zero-padded for a linear (not circular) convolution with rows of npts points.
+    Cached, as the kernel only depends on these (and the type to return it in). The returned array is read-only.
+
+    Returns
+    -------
+        (spectrum, padded length, kernel length)
+    '''
+    kernel = get_filter_kernel(kind, size, npts)
+    nfft = sp.fft.next_fast_len(npts + kernel.shape[0] - 1)
+    spectrum = sp.fft.fft(kernel, nfft).astype(dtype)
+    spectrum.flags.writeable = False
+    return spectrum, nfft, kernel.shape[0]
+
+def convolve_rows(complexes, kind: str, size: int):
+    '''np.convolve(row, kernel, mode='same') for every row at once, by FFT. O(N log N) per row, rather than O(N x kernel length).'''
+    npts = complexes.shape[1]
+    spectrum, nfft, nkernel = get_kernel_spectrum(kind, size, npts, complexes.dtype.type)
+    full = sp.fft.ifft(sp.fft.fft(complexes, nfft, axis=1) * spectrum[None,:], axis=1)
+    start = (nkernel - 1)//2 # where mode='same' starts in the full convolution
+    return full[:,start:start+npts]
+
+def apply_filter(complexes, kind: str, size: int):
+    '''Smooths every row of the 2D array complexes along the time axis. Returns a new array, of the same precision.
+
+    Parameters
+    ----------
+        complexes: (acquisitions, points) complex array.
+        kind: one of filter_types.
+        size: int, the filter size.
+    '''
+    complexes = np.asarray(complexes)
+    if not(complexes.dtype in (np.complex64, np.complex128)):
+        complexes = complexes.astype(np.complex128)
+    if(kind == 'Median'):
+        # one pass over the whole array, with a footprint one row high
+        return sp.ndimage.median_filter(np.real(complexes), mode='wrap', size=(1, size)) + 1j * sp.ndimage.median_filter(np.imag(complexes), mode='wrap', size=(1, size))
+    return np.ascontiguousarray(convolve_rows(complexes, kind, size))
+
+def get_window(times, peak_locations, kind: str, width: float, position: float = 0.0, dtype=np.float64):
+    '''Returns the multiplicative window for every row, positioned relative to each row's peak.
+
+    Parameters
+    ----------
+        times: (acquisitions, points) array, in μs.
+        peak_locations: array with one time (μs) per acquisition.
+        kind: one of window_types.
+        width: float, the window's width (μs).
+        position: float, offset of the window from the peak (μs).
+        dtype: the type to return it in (float32 for single precision data).
+
+    Returns
+    -------
+        (acquisitions, points) float array.
+    '''
+    dt = times - np.asarray(peak_locations)[:,None] - position
+    if(kind == 'Gaussian'):
+        window = np.exp(-1/2 * np.square(dt / width))
+    elif(kind == 'Sinc'):
+        window = np.sinc(dt / width)
+    elif(kind == 'Half-Gaussian'):
+        window = np.where(dt >= 0, np.exp(-1/2 * np.square(dt/width)), 0)
+    elif(kind == 'Box'):
+        window = np.where((dt >= 0) * (dt <= width), 1, 0)
+    else:
+        raise ValueError(f'Unknown window type {kind}')
+    return window.astype(dtype, copy=False)
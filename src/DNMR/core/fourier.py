@@ -0,0 +1,100 @@
+import numpy as np
+import scipy as sp
+import scipy.fft
+
+from DNMR.core.precision import get_real_dtype
+
+apodization_types = [ 'Exponential', 'Gaussian' ]
+
+def get_peak_indices(times, peak_locations):
+    '''The index of the point closest to its peak location, for every row of times.'''
+    return np.argmin(np.abs(np.asarray(peak_locations)[:,None] - times), axis=1)
+
+def shift_to_peaks(times, complexes, peak_locations):
+    '''Rolls every row of complexes so that it starts at the point closest to its peak location, in one gather.'''
+    npts = complexes.shape[1]
+    time_index = get_peak_indices(times, peak_locations)
+    return np.take_along_axis(complexes, (np.arange(npts)[None,:] + time_index[:,None]) % npts, axis=1)
+
+def get_subsample_shifts(times, peak_locations):
+    '''How far (in points, a fraction within ±0.5 unless the peak is off the end) every peak location lies after the point shift_to_peaks starts its row at.'''
+    time_index = get_peak_indices(times, peak_locations)
+    start_times = np.take_along_axis(times, time_index[:,None], axis=1)[:,0]
+    return (np.asarray(peak_locations) - start_times) / (times[:,1] - times[:,0])
+
+def fourier_transform(times, complexes, peak_locations, index=0, subsample=False, zero_fill=1, apodization=None, broadening=0.01):
+    '''The Fourier transform tab's processing: transforms every acquisition, starting from its peak.
+
+    Parameters
+    ----------
+        times: (acquisitions, points) array, in μs.
+        complexes: (acquisitions, points) array, the phased signal.
+        peak_locations: one time (μs) per acquisition.
+        index: int, the acquisition whose time spacing sets the frequency axis.
+        subsample: bool, start every row exactly at its peak location rather than at the closest point,
+            by a linear phase ramp on its spectrum.
+        zero_fill: int, pad every row with zeros to at least this many times its length (see get_transform_length).
+        apodization: None, or one of apodization_types, applied from the peak on.
+        broadening: float, the line broadening of the apodization (MHz).
+
+    Returns
+    -------
+        (frequencies in MHz, (acquisitions, points) complex spectra), both fftshifted.
+    '''
+    s_complexes = shift_to_peaks(times, complexes, peak_locations)
+    shifts = get_subsample_shifts(times, peak_locations) if subsample else None
+    npts = get_transform_length(s_complexes.shape[1], zero_fill)
+    window = None if apodization is None else get_apodization(times, apodization, broadening, get_real_dtype(complexes))
+    return get_frequencies(npts, times[index][1] - times[index][0]), get_spectra(s_complexes, shifts, npts, window)
+
+def get_transform_length(npts: int, zero_fill: int = 1):
+    '''The length rows of npts points are transformed at: npts, or zero-filled to a length at least zero_fill times longer that scipy.fft is fast at.'''
+    if(zero_fill <= 1):
+        return npts
+    return sp.fft.next_fast_len(npts * int(zero_fill))
+
+def get_apodization(times, kind: str, broadening: float, dtype=np.float64):
+    '''The apodization of every aligned row: a decay from its first point (the peak) on.
+
+    Parameters
+    ----------
+        times: (acquisitions, points) array, in μs. Only the spacing of each row is used.
+        kind: one of apodization_types. Exponential broadens lines into Lorentzians of FWHM broadening,
+            Gaussian into Gaussians of FWHM broadening.
+        broadening: float, MHz.
+        dtype: the type to return it in.
+
+    Returns
+    -------
+        (acquisitions, points) float array.
+    '''
+    t = np.arange(times.shape[1])[None,:] * (times[:,1] - times[:,0])[:,None]
+    if(kind == 'Exponential'):
+        return np.exp(-np.pi * broadening * t).astype(dtype)
+    elif(kind == 'Gaussian'):
+        return np.exp(-np.square(np.pi * broadening * t) / (4*np.log(2))).astype(dtype)
+    raise ValueError(f'Unknown apodization type {kind}')
+
+def get_spectra(s_complexes, shifts=None, npts=None, apodization=None, workers=-1):
+    '''The fftshifted Fourier transform of every row, in one multithreaded scipy.fft call. Single precision rows are transformed in single precision.
+
+    Parameters
+    ----------
+        s_complexes: (acquisitions, points) array.
+        shifts: optional, one shift (in points, may be fractional) per row. Each spectrum is then that of its row
+            advanced by the shift (y[n] = x[n + shift]), by multiplying it by a linear phase ramp.
+        npts: optional, the length to transform at (rows are zero-filled to it). See get_transform_length.
+        apodization: optional array to multiply the rows by first (see get_apodization).
+        workers: threads to transform with, -1 for all cores.
+    '''
+    s_complexes = s_complexes.astype(np.complex64 if s_complexes.dtype in (np.complex64, np.float32) else np.complex128, copy=False)
+    if not(apodization is None):
+        s_complexes = s_complexes * apodization
+    fft = sp.fft.fft(s_complexes, n=npts, axis=1, workers=workers)
+    if not(shifts is None):
+        fft *= np.exp(2j*np.pi * sp.fft.fftfreq(fft.shape[1])[None,:] * np.asarray(shifts, dtype=np.float64)[:,None]).astype(fft.dtype)
+    return sp.fft.fftshift(fft, axes=1)
+
+def get_frequencies(npts: int, timespacing: float):
+    '''The fftshifted frequencies (MHz) of a spectrum of npts points taken timespacing (μs) apart.'''
+    return np.fft.fftshift(np.fft.fftfreq(npts, d=timespacing))
@@ -0,0 +1,431 @@
+import threading
+
+import numpy as np
+
+from DNMR.core.phase import get_complexes, apply_phases
+from DNMR.core.filters import apply_filter, get_window
+from DNMR.core.fourier import shift_to_peaks, get_subsample_shifts, get_transform_length, get_apodization, get_spectra, get_frequencies
+from DNMR.core.integrate import get_cumulative_sums, integrate_windows, get_noise
+from DNMR.core.precision import get_default_precision, get_real_dtype
+from DNMR.core.t1 import get_delay_times, get_integrations, fit_t1
+
+# The parameters set_data sets from the data, per node. with_data copies all the others.
+_data_parameters = { 'load': ['data'], 'window': ['peak_locations'], 'phase': ['phases'], 'align': ['peak_locations'], 'fft': ['peak_locations'], 'freq': ['index'] }
+
+def _freeze(v):
+    '''A copy of a parameter to compare later ones against. Sequences are copied, as the tabs edit theirs (phases, peak locations) in place.'''
+    if(isinstance(v, (np.ndarray, list, tuple))):
+        return np.array(v)
+    if(isinstance(v, dict)):
+        return { k: _freeze(i) for k, i in v.items() }
+    return v
+
+def _same(a, b):
+    if(isinstance(a, np.ndarray) or isinstance(b, np.ndarray)):
+        if not(isinstance(a, (np.ndarray, list, tuple)) and isinstance(b, (np.ndarray, list, tuple))):
+            return False
+        a, b = np.asarray(a), np.asarray(b)
+        return a.shape == b.shape and np.array_equal(a, b)
+    if(isinstance(a, dict) and isinstance(b, dict)):
+        return a.keys() == b.keys() and all([ _same(a[k], b[k]) for k in a.keys() ])
+    if(isinstance(a, (bool, int, float, str, np.number)) or a is None):
+        return type(a) == type(b) and a == b
+    return a is b # data_structs and other objects: the same object
+
+class node():
+    '''One stage of a processing graph. Its output is cached, and only recomputed when it is dirty: when one of its
+    parameters was set to a different value, one of its inputs was recomputed, or it was invalidated.
+
+    Nodes given a row_func are row-wise: row i of their output only depends on row i of their row-wise inputs and
+    entry i of their row_params. When only some rows changed (one acquisition's phase, say), only those are
+    recomputed, and written into the cached output in place; nodes downstream are told which rows changed.
+    Rows past the end of the output (acquisitions appended to the data, see set_rows) are added to it, in amortised
+    constant time per row.
+
+    Parameters
+    ----------
+        name: str.
+        func: func(*input values, **params), computing the output. Must not modify its inputs, as they are cached too.
+        inputs: list of the nodes whose outputs func takes, in order.
+        cutoff: bool, compare every new output with the last one, and leave the nodes downstream clean if it is the same.
+            For cheap nodes whose parameters often change without changing the output.
+        row_func: optional func(rows, *input values, **params), computing the given rows (an index array) of the output.
+            The output (or each array of a tuple output) must be a new array with acquisitions along axis 0. Entries wrapped
+            in whole replace the cached ones instead (e.g. a view of the data, which can't be written into).
+        row_params: names of the parameters holding one entry per acquisition.
+        params: the initial parameters.
+
+    get() may run on a worker thread while set() is called on another: a computation that a set() overtook
+    leaves the node dirty, so the next get() computes it again with the new parameters.
+    '''
+    history_length = 64 # versions whose changed rows are remembered
+
+    def __init__(self, name, func, inputs=[], cutoff=False, row_func=None, row_params=(), **params):
+        self.name = name
+        self.func = func
+        self.row_func = row_func
+        self.row_params = tuple(row_params)
+        self.cutoff = cutoff
+        self.inputs = list(inputs)
+        self.params = { k: _freeze(v) for k, v in params.items() }
+        self.version = 0 # bumped every time the output changes
+        self.runs = 0
+        self.rows_computed = None # by the last run, None for all
+        self.dirty = True
+        self._dirty_rows = None # rows to recompute while dirty, or None for all
+        self._changed_rows = {} # { version: rows changed by it, or None for all }
+        self._changes = 0 # counts set()s and invalidate()s
+        self._input_versions = None
+        self._value = None
+        self._buffers = [] # arrays the output has grown into (see _grow)
+        self._lock = threading.RLock() # one computation at a time
+
+    def set(self, **params):
+        '''Sets parameters. Only ones that differ from the current values make the node dirty.'''
+        for k, v in params.items():
+            if not(k in self.params) or not(_same(self.params[k], v)):
+                rows = self._get_changed_entries(k, v)
+                self.params[k] = _freeze(v)
+                self._mark_dirty(rows)
+        return self
+
+    def set_rows(self, rows, **params):
+        '''Sets parameters that only change the given rows of the output (e.g. data with acquisitions appended), so that
+        only those rows are recomputed here and in the row-wise nodes downstream.'''
+        for k, v in params.items():
+            self.params[k] = _freeze(v)
+        self._mark_dirty(set(rows))
+        return self
+
+    def _mark_dirty(self, rows):
+        self._changes += 1
+        if(rows is None or (self.dirty and self._dirty_rows is None)):
+            self._dirty_rows = None
+        elif(self.dirty):
+            self._dirty_rows = self._dirty_rows | rows
+        else:
+            self._dirty_rows = rows
+        self.dirty = True
+
+    def _get_changed_entries(self, k, v):
+        '''The entries of row parameter k that v changes, or None if that can't be told (or k isn't one).
+        Entries past the end of the old value (acquisitions appended) count as changed.'''
+        old = self.params[k] if k in self.params else None
+        if not(k in self.row_params) or not(isinstance(old, np.ndarray)) or v is None:
+            return None
+        v = np.asarray(v)
+        if not(old.ndim == 1 and v.ndim == 1 and v.shape[0] >= old.shape[0]):
+            return None
+        return set(np.nonzero(old != v[:old.shape[0]])[0].tolist()) | set(range(old.shape[0], v.shape[0]))
+
+    def invalidate(self):
+        self._changes += 1
+        self._dirty_rows = None
+        self.dirty = True
+
+    def get_changed_rows(self, since):
+        '''The rows that changed between version since and now, or None if all may have.'''
+        rows = set()
+        for v in range(since + 1, self.version + 1):
+            if not(v in self._changed_rows) or self._changed_rows[v] is None:
+                return None
+            rows |= self._changed_rows[v]
+        return rows
+
+    def get(self):
+        '''Returns the output, recomputing this node (and any stale nodes upstream) first if needed.'''
+        with self._lock:
+            values = [ i.get() for i in self.inputs ]
+            versions = [ i.version for i in self.inputs ]
+            if(self.dirty or versions != self._input_versions):
+                changes = self._changes
+                rows = self._get_rows_to_compute(versions)
+                params = dict(self.params)
+                if(rows is None):
+                    value = self.func(*values, **params)
+                    if not(self.cutoff and self.runs > 0 and _same(value, self._value)):
+                        self._value = value
+                        self._buffers = []
+                        self._bump_version(None)
+                    self.rows_computed = None
+                elif(len(rows) > 0):
+                    indices = np.array(sorted(rows), dtype=int)
+                    self._value = self._write_rows(self._value, indices, self.row_func(indices, *values, **params))
+                    self._bump_version(rows)
+                    self.rows_computed = len(rows)
+                self._input_versions = versions
+                self.dirty = not(changes == self._changes)
+                self.runs += 1
+            return self._value
+
+    def _get_rows_to_compute(self, versions):
+        '''The rows that need recomputing, or None for all of them.'''
+        if(self.row_func is None or self.runs == 0 or self._input_versions is None):
+            return None
+        rows = set()
+        if(self.dirty):
+            if(self._dirty_rows is None):
+                return None
+            rows |= self._dirty_rows
+        for i in range(len(self.inputs)):
+            if not(versions[i] == self._input_versions[i]):
+                changed = self.inputs[i].get_changed_rows(self._input_versions[i])
+                if(changed is None):
+                    return None
+                rows |= changed
+        return rows
+
+    def _bump_version(self, rows):
+        self.version += 1
+        self._changed_rows[self.version] = None if rows is None else set(rows)
+        self._changed_rows.pop(self.version - self.history_length, None)
+
+    def _write_rows(self, out, rows, new):
+        '''Writes new into the given rows of out, an array or a tuple of arrays (or None), and returns it.
+        Arrays are grown first if rows go past their end; entries of new wrapped in whole replace those of out.'''
+        if(isinstance(new, whole)):
+            return new.value
+        if(isinstance(out, tuple)):
+            return tuple([ self._write_rows(o, rows, n) for o, n in zip(out, new) ])
+        if(out is None):
+            return None
+        if(rows[-1] >= out.shape[0]):
+            out = self._grow(out, rows[-1] + 1)
+        out[rows] = new
+        return out
+
+    def _grow(self, a, n):
+        '''a with room for n rows (the new ones uninitialised). a is copied into a buffer with a quarter more rows than needed,
+        which later appends fill without copying, so appending takes amortised constant time per row.'''
+        if(any([ a.base is b for b in self._buffers ]) and a.base.shape[0] >= n and a.strides == a.base.strides and a.shape[1:] == a.base.shape[1:]
+           and a.__array_interface__['data'][0] == a.base.__array_interface__['data'][0]): # a is the start of a buffer of ours
+            return a.base[:n]
+        buf = np.empty((n + n//4,) + a.shape[1:], dtype=a.dtype)
+        buf[:a.shape[0]] = a
+        self._buffers = [ b for b in self._buffers if not(a.base is b) ] + [ buf ]
+        return buf[:n]
+
+    def __repr__(self):
+        return f'node({self.name}, version={self.version}, runs={self.runs}, {"dirty" if self.dirty else "clean"})'
+
+class whole():
+    '''Wraps an entry of a row_func's output that replaces the node's cached one, rather than being written into its rows.'''
+    def __init__(self, value):
+        self.value = value
+
+def _load(data=None, precision='double'):
+    complexes = get_complexes(data['reals'], data['imags'], precision)
+    return data, data['times'][:,:complexes.shape[1]], complexes
+
+def _load_rows(rows, data=None, precision='double'):
+    read = slice(rows[0], rows[-1] + 1) if(rows[-1] - rows[0] + 1 == len(rows)) else rows # appended rows are a range: lazy data reads it in one go
+    complexes = get_complexes(data['reals'][read], data['imags'][read], precision)
+    return whole(data), whole(data['times'][:,:complexes.shape[1]]), complexes
+
+def _filter(loaded, filter_type=None, filter_size=12):
+    if(filter_type is None):
+        return loaded[2]
+    return apply_filter(loaded[2], filter_type, filter_size)
+
+def _filter_rows(rows, loaded, filter_type=None, filter_size=12):
+    if(filter_type is None):
+        return whole(loaded[2])
+    return apply_filter(loaded[2][rows], filter_type, filter_size)
+
+def _window(loaded, filtered, window_type=None, window_size=3.0, window_position=0.0, peak_locations=None):
+    if(window_type is None):
+        return filtered, None
+    window = get_window(loaded[1], peak_locations, window_type, window_size, window_position, get_real_dtype(filtered))
+    return filtered * window, window
+
+def _window_rows(rows, loaded, filtered, window_type=None, window_size=3.0, window_position=0.0, peak_locations=None):
+    if(window_type is None):
+        return whole(filtered), None
+    window = get_window(loaded[1][rows], np.asarray(peak_locations)[rows], window_type, window_size, window_position, get_real_dtype(filtered))
+    return filtered[rows] * window, window
+
+def _phase(windowed, phases=None):
+    return apply_phases(np.array(windowed[0]), phases)
+
+def _phase_rows(rows, windowed, phases=None):
+    return apply_phases(windowed[0][rows], np.asarray(phases)[rows])
+
+def _align(loaded, phased, peak_locations=None):
+    return shift_to_peaks(loaded[1], phased, peak_locations)
+
+def _align_rows(rows, loaded, phased, peak_locations=None):
+    return shift_to_peaks(loaded[1][rows], phased[rows], np.asarray(peak_locations)[rows])
+
+def _spectra(loaded, aligned, subsample=False, peak_locations=None, zero_fill=1, apodization=None, broadening=0.01, workers=-1):
+    return _spectra_rows(slice(None), loaded, aligned, subsample, peak_locations, zero_fill, apodization, broadening, workers)
+
+def _spectra_rows(rows, loaded, aligned, subsample=False, peak_locations=None, zero_fill=1, apodization=None, broadening=0.01, workers=-1):
+    times = loaded[1][rows]
+    shifts = get_subsample_shifts(times, np.asarray(peak_locations)[rows]) if subsample else None
+    window = None if apodization is None else get_apodization(times, apodization, broadening, get_real_dtype(aligned))
+    return get_spectra(aligned[rows], shifts, get_transform_length(aligned.shape[1], zero_fill), window, workers=workers)
+
+def _frequencies(loaded, index=0, zero_fill=1):
+    times = loaded[1]
+    return get_frequencies(get_transform_length(loaded[2].shape[1], zero_fill), times[index][1] - times[index][0])
+
+def _cumulative(fft):
+    return get_cumulative_sums(fft)
+
+def _cumulative_rows(rows, fft):
+    return get_cumulative_sums(fft[rows])
+
+def _integrate(freq, cumulative, left=-0.4, right=0.4):
+    return integrate_windows(freq, cumulative, left, right)
+
+def _integrate_rows(rows, freq, cumulative, left=-0.4, right=0.4):
+    return integrate_windows(freq, cumulative[rows], left, right)
+
+def _points(loaded, integrals, noise, normalize=True):
+    return get_integrations(get_delay_times(loaded[0]), np.real(integrals), normalize, noise)
+
+def _fit(points, model='7/2 Spin', fixed={}, excluded=[], seed=None, method='fast', workers=1):
+    return fit_t1(points[0], points[1], points[2], model, { int(k): float(v) for k, v in fixed.items() }, list(excluded), seed, method=method, workers=workers)
+
+class pipeline():
+    '''The processing behind the tabs as a graph of cached nodes:
+
+        load -> filter -> window -> phase -> align -> fft -> cumulative -> integrate -> points -> fit
+                                                            freq ---------^
+
+    Set parameters on the nodes (e.g. p.integrate.set(left=-0.2, right=0.2)), then get() the output you need.
+    Only the nodes downstream of a changed parameter are recomputed, so changing the integration region
+    doesn't filter or transform anything again (nor sum the spectra: integrals come from their running sums).
+    window to integrate are row-wise: changing one acquisition's phase or peak location only recomputes that
+    acquisition's row of each.
+
+    Outputs
+    -------
+        load: (data_struct, times, complexes). Parameter data: the data_struct (compared by identity, so set a new one to reload).
+            precision: what the signal is processed in up to the spectra, 'double' or 'single' (see core.precision; integrals and fits are always double).
+        filter: complexes. filter_type (None for none), filter_size.
+        window: (complexes, window or None). window_type (None for none), window_size, window_position, peak_locations.
+        phase: complexes. phases (degrees, one per acquisition).
+        align: complexes, each row starting at its peak. peak_locations.
+        fft: fftshifted spectra. subsample, zero_fill, apodization, broadening: see core.fourier_transform; set them with set_transform. peak_locations.
+            workers: threads to transform with (-1 for all cores; 1 where processes already share the cores, as in batch).
+        freq: frequencies (MHz). index: the acquisition whose time spacing sets them. zero_fill.
+        cumulative: the running sums of the spectra (see core.get_cumulative_sums).
+        integrate: one complex integral per acquisition. left, right: the pivots (MHz).
+        noise: the noise of every integral, or None: the RMS noise of its spectrum in a band without signal (see core.get_noise), times
+            get_noise_gain. left, right: as integrate's. noise_left, noise_right: the band (MHz), or None not to measure it. Set them with set_integration.
+        points: (delay times, integrals, uncertainties), sorted by delay. normalize. The uncertainties are the noise, if measured.
+        fit: (popt, sigmas, res) of core.fit_t1. model, fixed ({ parameter index: value }), excluded, seed, method, workers.
+    '''
+    noise_calibration_rows = 256 # acquisitions of white noise get_noise_gain processes
+
+    def __init__(self, precision=None):
+        self.load = node('load', _load, row_func=_load_rows, data=None, precision=get_default_precision() if precision is None else precision)
+        self.filter = node('filter', _filter, [self.load], row_func=_filter_rows, filter_type=None, filter_size=12)
+        self.window = node('window', _window, [self.load, self.filter], row_func=_window_rows, row_params=['peak_locations'],
+                           window_type=None, window_size=3.0, window_position=0.0, peak_locations=None)
+        self.phase = node('phase', _phase, [self.window], row_func=_phase_rows, row_params=['phases'], phases=None)
+        self.align = node('align', _align, [self.load, self.phase], row_func=_align_rows, row_params=['peak_locations'], peak_locations=None)
+        self.fft = node('fft', _spectra, [self.load, self.align], row_func=_spectra_rows, row_params=['peak_locations'],
+                        subsample=False, peak_locations=None, zero_fill=1, apodization=None, broadening=0.01, workers=-1)
+        self.freq = node('freq', _frequencies, [self.load], cutoff=True, index=0, zero_fill=1)
+        self.cumulative = node('cumulative', _cumulative, [self.fft], row_func=_cumulative_rows)
+        self.integrate = node('integrate', _integrate, [self.freq, self.cumulative], row_func=_integrate_rows, left=-0.4, right=0.4)
+        self._noise_calibration = None # (settings, pipeline of white noise) of get_noise_gain
+        self.noise = node('noise', self._noise, [self.freq, self.fft], row_func=self._noise_rows, left=-0.4, right=0.4, noise_left=None, noise_right=None)
+        self.points = node('points', _points, [self.load, self.integrate, self.noise], normalize=True)
+        self.fit = node('fit', _fit, [self.points], model='7/2 Spin', fixed={}, excluded=[], seed=None, method='fast', workers=1)
+        self.nodes = [ self.load, self.filter, self.window, self.phase, self.align, self.fft, self.freq, self.cumulative, self.integrate, self.noise, self.points, self.fit ]
+
+    def set_data(self, data, index=0):
+        '''Sets the data_struct to process, and the acquisition on screen. Phases and peak locations stored in the data_struct (by the phase tab) are used, otherwise 0.
+        If data is the one processed now with acquisitions appended (see data_struct.extends), only those are processed.'''
+        old = self.load.params['data']
+        extended = getattr(data, 'extends', None)
+        while not(extended is None or data is old or extended() is None or extended() is old): # appended to more than once since
+            extended = getattr(extended(), 'extends', None)
+        if(not(old is None or data is old or extended is None) and extended() is old):
+            self.load.set_rows(range(old['size'], data['size']), data=data)
+        else:
+            self.load.set(data=data)
+        self.freq.set(index=index)
+        n = data['size']
+        phases = data['phases'] if 'phases' in data.keys() else np.zeros(n)
+        peak_locations = data['peak_locations'] if 'peak_locations' in data.keys() else np.zeros(n)
+        self.set_peaks(phases, peak_locations)
+        return self
+
+    def with_data(self, data, index=0):
+        '''A new pipeline with the settings of this one (filter, window, transform, integration, fit, ...), processing other data (another channel, say).'''
+        p = pipeline(self.load.params['precision'])
+        for mine, theirs in zip(self.nodes, p.nodes):
+            theirs.set(**{ k: v for k, v in mine.params.items() if not(k in _data_parameters.get(mine.name, [])) })
+        return p.set_data(data, index)
+
+    def set_peaks(self, phases, peak_locations):
+        self.window.set(peak_locations=peak_locations)
+        self.phase.set(phases=phases)
+        self.align.set(peak_locations=peak_locations)
+        self.fft.set(peak_locations=peak_locations)
+        return self
+
+    def set_integration(self, left=-0.4, right=0.4, noise_left=None, noise_right=None):
+        '''Sets the integration region (MHz), and the band without signal the noise of the integrals is measured in (None not to).'''
+        self.integrate.set(left=left, right=right)
+        self.noise.set(left=left, right=right, noise_left=noise_left, noise_right=noise_right)
+        return self
+
+    def _noise(self, freq, fft, left=-0.4, right=0.4, noise_left=None, noise_right=None):
+        return self._noise_rows(slice(None), freq, fft, left, right, noise_left, noise_right)
+
+    def _noise_rows(self, rows, freq, fft, left=-0.4, right=0.4, noise_left=None, noise_right=None):
+        if(noise_left is None):
+            return None
+        return get_noise(freq, fft[rows], noise_left, noise_right) * self.get_noise_gain(left, right, noise_left, noise_right)
+
+    def get_noise_gain(self, left, right, noise_left, noise_right):
+        '''The ratio of the noise of an integral (left to right, MHz) to the RMS noise of the spectrum in the band noise_left to noise_right.
+        Neighbouring points of a spectrum are correlated (by zero-filling, filters, windows and apodization), so an integral over K
+        points is not sqrt(K) times as noisy as one point. The ratio is measured instead: noise_calibration_rows acquisitions of white
+        noise are processed with the current settings, as the acquisition on screen is (its times, phase and peak location).
+        That pipeline is kept, and only run again when a setting upstream of integrate changes: other regions and bands are
+        taken from its cached spectra and running sums.'''
+        data, times, complexes = self.load.get()
+        index = self.freq.params['index']
+        phases, peak_locations = self.phase.params['phases'], self.align.params['peak_locations']
+        phase = 0.0 if phases is None else float(np.asarray(phases)[index])
+        peak_location = 0.0 if peak_locations is None else float(np.asarray(peak_locations)[index])
+        settings = [ _freeze(times[index]), phase, peak_location ]
+        settings += [ _freeze({ k: v for k, v in n.params.items() if not(k in _data_parameters.get(n.name, [])) }) for n in self.nodes[:self.nodes.index(self.integrate)] ]
+        if(not(self._noise_calibration is None) and all([ _same(a, b) for a, b in zip(settings, self._noise_calibration[0]) ])):
+            p = self._noise_calibration[1]
+        else:
+            n = self.noise_calibration_rows
+            rng = np.random.default_rng(0)
+            noise = { 'reals': rng.normal(size=(n, complexes.shape[1])), 'imags': rng.normal(size=(n, complexes.shape[1])),
+                      'times': np.broadcast_to(times[index], (n, times.shape[1])), 'size': n,
+                      'phases': np.full(n, phase), 'peak_locations': np.full(n, peak_location) }
+            p = self.with_data(noise)
+            self._noise_calibration = (settings, p)
+        integrals = np.real(p.integrate_windows(left, right))
+        return np.std(integrals) / np.sqrt(np.mean(np.square(get_noise(p.freq.get(), p.fft.get(), noise_left, noise_right))))
+
+    def integrate_windows(self, left, right):
+        '''Integrals over several regions at once (e.g. one per peak of a spectrum): an (acquisitions, regions) array for arrays of pivots (MHz).'''
+        return integrate_windows(self.freq.get(), self.cumulative.get(), left, right)
+
+    def set_precision(self, precision):
+        '''Processes in 'double' or 'single' precision from now on (see core.precision).'''
+        self.load.set(precision=precision)
+        return self
+
+    def set_transform(self, subsample=False, zero_fill=1, apodization=None, broadening=0.01, workers=-1):
+        '''Sets how the fft node transforms (see core.fourier_transform), and the freq node to match.
+        workers: threads each transform uses, -1 for all cores.'''
+        self.fft.set(subsample=subsample, zero_fill=zero_fill, apodization=apodization, broadening=broadening, workers=workers)
+        self.freq.set(zero_fill=zero_fill)
+        return self
+
+    def invalidate(self):
+        for n in self.nodes:
+            n.invalidate()
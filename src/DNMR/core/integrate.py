@@ -0,0 +1,62 @@
+import numpy as np
+
+def get_pivots(centre: float, width: float):
+    '''The (left, right) edges of an integration region.'''
+    return centre - width/2.0, centre + width/2.0
+
+def get_integration_indices(freq, left, right):
+    '''The (start, end) indices of freq closest to the pivots, in increasing order. end is exclusive.
+    freq must be increasing (as fftshifted frequencies are). left and right may be arrays of pivots, giving arrays of indices.'''
+    start_index = get_closest_index(freq, left)
+    end_index = get_closest_index(freq, right)
+    return np.minimum(start_index, end_index), np.maximum(start_index, end_index)
+
+def get_closest_index(freq, f):
+    '''The index of the point of the increasing array freq closest to f (the first, on a tie), by bisection.'''
+    i = np.clip(np.searchsorted(freq, f), 1, len(freq) - 1)
+    return np.where(np.abs(f - freq[i-1]) <= np.abs(freq[i] - f), i-1, i)
+
+def integrate(freq, fft, left, right):
+    '''Sums every spectrum (a row of fft) between the pivots. Returns one value per row.
+    Real and imaginary parts are summed separately, so the real part of the integral is exactly the integral of the real part.'''
+    start_index, end_index = get_integration_indices(freq, left, right)
+    if(np.iscomplexobj(fft)):
+        return np.sum(np.real(fft[:,start_index:end_index]), axis=1) + 1j*np.sum(np.imag(fft[:,start_index:end_index]), axis=1)
+    return np.sum(fft[:,start_index:end_index], axis=1)
+
+def get_cumulative_sums(fft):
+    '''The running sums of every spectrum along frequency, starting from 0: (acquisitions, points + 1).
+    Any integral is then the difference of two of its columns (see integrate_windows).
+    They are summed in double precision even for single precision spectra, as a narrow region's integral is the small difference of two large sums.'''
+    cumulative = np.zeros((fft.shape[0], fft.shape[1] + 1), dtype=np.complex128 if np.iscomplexobj(fft) else np.float64)
+    np.cumsum(fft, axis=1, dtype=cumulative.dtype, out=cumulative[:,1:])
+    return cumulative
+
+def integrate_windows(freq, cumulative, left, right):
+    '''integrate from the running sums of get_cumulative_sums: O(acquisitions) per region, whatever its width.
+
+    Parameters
+    ----------
+        freq: the frequencies of the spectra (MHz), increasing.
+        cumulative: the output of get_cumulative_sums.
+        left, right: floats, or arrays of the pivots (MHz) of several regions (e.g. one per peak).
+
+    Returns
+    -------
+        one integral per acquisition, or an (acquisitions, regions) array for arrays of pivots.
+    '''
+    start_index, end_index = get_integration_indices(freq, left, right)
+    return cumulative[:,end_index] - cumulative[:,start_index]
+
+def get_noise(freq, fft, left, right):
+    '''The RMS noise of the real part of every spectrum (a row of fft) in a band without signal (left to right, MHz), for all rows at once.
+    left and right may be arrays of the edges of several bands (e.g. one on each side of the line), which are pooled.
+    The mean of each band is taken off first, so that a baseline offset doesn't count as noise.'''
+    starts, ends = get_integration_indices(freq, np.atleast_1d(left), np.atleast_1d(right))
+    if(np.any(ends - starts < 2)):
+        raise ValueError(f'The noise band ({left} to {right} MHz) is less than 2 points wide')
+    squares = 0.0
+    for s, e in zip(starts, ends):
+        band = np.real(fft[:,s:e]).astype(np.float64)
+        squares = squares + np.sum(np.square(band - np.mean(band, axis=1, keepdims=True)), axis=1)
+    return np.sqrt(squares / (np.sum(ends - starts) - len(starts)))
@@ -0,0 +1,76 @@
+import numpy as np
+
+from DNMR.core.filters import apply_filter, get_window
+from DNMR.core.precision import get_dtypes, get_real_dtype
+
+def get_complexes(reals, imags, precision: str = None):
+    '''Returns reals + 1j*imags, in the given precision (see precision.py; by default the default precision). Lazy arrays are read here.'''
+    real_dtype, complex_dtype = get_dtypes(precision)
+    complexes = np.empty(np.shape(reals), dtype=complex_dtype)
+    complexes.real = np.asarray(reals, dtype=real_dtype)
+    complexes.imag = np.asarray(imags, dtype=real_dtype)
+    return complexes
+
+def apply_phases(complexes, phases):
+    '''Rotates every row of complexes by its phase (degrees), in place. Returns complexes.'''
+    complexes *= np.exp(1j*np.asarray(phases, dtype=np.float64) * np.pi/180.0).astype(complexes.dtype)[:,None]
+    return complexes
+
+def time_domain(reals, imags, times, phases, peak_locations, filter_type=None, filter_size=12, window_type=None, window_size=3.0, window_position=0.0, precision=None):
+    '''The phase tab's processing: filter, window, then phase every acquisition.
+
+    Parameters
+    ----------
+        reals, imags: (acquisitions, points) arrays (or lazy_rows).
+        times: (acquisitions, points) array, in μs. Cut to the number of points of reals.
+        phases: one phase (degrees) per acquisition.
+        peak_locations: one time (μs) per acquisition, which the window is positioned relative to.
+        filter_type: None for no filter, else one of filters.filter_types.
+        filter_size: int.
+        window_type: None for no window, else one of filters.window_types.
+        window_size, window_position: floats, in μs.
+        precision: None (the default), or one of precision.precisions.
+
+    Returns
+    -------
+        (times, complexes, window). window is the (acquisitions, points) window applied, or None.
+    '''
+    complexes = get_complexes(reals, imags, precision)
+    times = times[:,:complexes.shape[1]]
+    if not(filter_type is None):
+        complexes = apply_filter(complexes, filter_type, filter_size)
+    window = None
+    if not(window_type is None):
+        window = get_window(times, peak_locations, window_type, window_size, window_position, get_real_dtype(complexes))
+        complexes *= window
+    apply_phases(complexes, phases)
+    return times, complexes, window
+
+def peak_values(times, complexes, peak_locations):
+    '''The value of every row of complexes at the point closest to its peak location.'''
+    time_index = np.argmin(np.abs(np.asarray(peak_locations)[:,None] - times), axis=1)
+    return np.take_along_axis(complexes, time_index[:,None], axis=1)[:,0]
+
+def locate_max(complexes):
+    '''The index of the acquisition with the largest magnitude point.'''
+    return int(np.unravel_index(np.argmax(np.abs(complexes)), complexes.shape)[0])
+
+def autophase(times, complexes, current_phase):
+    '''Finds the phase that makes the largest point of one acquisition real and positive.
+
+    Parameters
+    ----------
+        times, complexes: 1D arrays, one (already phased) acquisition.
+        current_phase: float, the phase (degrees) complexes was phased with.
+
+    Returns
+    -------
+        (new phase in degrees within ±180, time of the largest point in μs)
+    '''
+    peak_i = np.argmax(np.abs(complexes))
+    peak_c = complexes[peak_i]
+    angle_degrees = np.arctan2(np.imag(peak_c), np.real(peak_c)) * 180.0/np.pi
+    new_phase_degrees = current_phase - angle_degrees
+    new_phase_degrees += (np.abs(new_phase_degrees - 180.0)//360)*360.0
+    new_phase_degrees -= (np.abs(new_phase_degrees + 180.0)//360)*360.0
+    return new_phase_degrees, times[peak_i]
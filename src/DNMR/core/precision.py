@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+# The (real, complex) types signal data is processed in. Fits are always done in double precision.
+precisions = {
+    'double': (np.float64, np.complex128),
+    'single': (np.float32, np.complex64), # half the memory and bandwidth; plenty for ~16 bit data
+}
+_default_precision = os.environ.get('DNMR_PRECISION', 'double')
+
+def set_default_precision(precision: str):
+    '''Sets the precision of pipelines made from now on (and of get_complexes when none is given). One of precisions.'''
+    global _default_precision
+    if not(precision in precisions):
+        raise ValueError(f'Unknown precision {precision}. Known: {list(precisions.keys())}')
+    _default_precision = precision
+
+def get_default_precision():
+    '''The precision set by set_default_precision, or the DNMR_PRECISION environment variable ('double' if neither).'''
+    return _default_precision
+
+def get_dtypes(precision: str = None):
+    '''The (real, complex) numpy types of a precision, by default the default precision.'''
+    if(precision is None):
+        precision = _default_precision
+    if not(precision in precisions):
+        raise ValueError(f'Unknown precision {precision}. Known: {list(precisions.keys())}')
+    return precisions[precision]
+
+def get_real_dtype(a):
+    '''The real type matching an array: float32 for complex64 data, float64 otherwise.'''
+    return np.float32 if np.asarray(a).dtype in (np.complex64, np.float32) else np.float64
@@ -0,0 +1,398 @@
+import os
+import concurrent.futures
+
+import numpy as np
+import scipy as sp
+
+def _broadcast(args, x):
+    '''The parameters and delay times of a model, shaped so that a (4, population) matrix of parameter vectors
+    gives a (population, len(x)) array, one row per vector. A single vector is left as it is.'''
+    if(np.ndim(args[0]) > 0):
+        return [ np.asarray(a, dtype=np.float64)[:,None] for a in args ], np.asarray(x, dtype=np.float64)[None,:]
+    return args, x
+
+def spin_7_2(args, x):
+    (gamma_0, s, T1, r), x = _broadcast(args, x) # s: inversion. T1: relaxation time (actual fit variable, really). r: stretched exponent (ideally 1)
+    #y = y0 (1-(1+s) ((1/84)*Exp[-(t/T1)^r]+(3/44)*Exp[-(6 t/T1)^r]+(75/364)*Exp[-(15 t/T1)^r]+(1225/1716)*Exp[-(28 t/T1)^r]))
+    return gamma_0 * (1-(1+s)*(
+                                (1/84)*     np.exp(-np.pow(x/T1,    r)) +
+                                (3/44)*     np.exp(-np.pow(6*x/T1,  r)) +
+                                (75/364)*   np.exp(-np.pow(15*x/T1, r)) +
+                                (1225/1716)*np.exp(-np.pow(28*x/T1, r))
+                             ))
+
+def spin_7_2_sat_1(args, t):
+    (gamma_0, s, T1, r), t = _broadcast(args, t)
+    return gamma_0 * (1 - (1+s) * (1/84*np.exp(-np.pow(t/T1, r)) +
+                                   1/84*np.exp(-np.pow(3*t/T1, r)) +
+                                   2/66*np.exp(-np.pow(6*t/T1, r)) +
+                                   18/154*np.exp(-np.pow(10*t/T1, r)) +
+                                   1/1092*np.exp(-np.pow(15*t/T1, r)) +
+                                   49/132*np.exp(-np.pow(21*t/T1, r)) +
+                                   392/858*np.exp(-np.pow(28*t/T1, r))))
+
+def spin_1_2(args, t):
+    (gamma_0, s, T1, r), t = _broadcast(args, t)
+    return gamma_0 * (1 - (1+s) * np.exp(-np.pow(t/T1, r)))
+
+# Fit model name (as in the T1 tab) -> fit function f(args, delay times). args is one (gamma_0, s, T1, r), or a (4, population) matrix of them.
+fit_models = {
+    '7/2 Spin': spin_7_2,
+    '7/2 Spin (Sat. 1)': spin_7_2_sat_1,
+    '1/2 Spin': spin_1_2,
+}
+
+# The same models as (rate multiples q, weights a) of y = gamma_0 (1 - (1+s) sum(a exp(-(q t/T1)^r))), for evaluate_model.
+model_terms = {
+    '7/2 Spin': (np.array([1.0, 6.0, 15.0, 28.0]), np.array([1/84, 3/44, 75/364, 1225/1716])),
+    '7/2 Spin (Sat. 1)': (np.array([1.0, 3.0, 6.0, 10.0, 15.0, 21.0, 28.0]), np.array([1/84, 1/84, 2/66, 18/154, 1/1092, 49/132, 392/858])),
+    '1/2 Spin': (np.array([1.0]), np.array([1.0])),
+}
+
+# (display name, plain name, units) of the parameters every model takes, in order.
+parameters = [ ('γ₀', 'gamma_0', ''), ('s', 's', ''), ('T₁', 'T1', 'μs'), ('r', 'r', '') ]
+
+def get_parameter_index(name):
+    '''The index of a parameter, by its display or plain name.'''
+    for i, p in enumerate(parameters):
+        if(name in p[:2]):
+            return i
+    raise KeyError(f'Unknown fit parameter {name}. Known: {[ p[1] for p in parameters ]}')
+
+def get_delay_times(data):
+    '''The delay time (μs) of every acquisition of a data_struct.'''
+    try:
+        return data.sequence['0'].delay_time
+    except:
+        return data.sequence['0'].relaxation_time # Legacy, as I didn't know what this was when I wrote it. Surprise, surprise
+
+def get_integrations(del_times, integrations, normalize=True, uncertainties=None):
+    '''Sorts the integrals of an acquisition series by delay time, normalising them to their maximum if asked.
+    uncertainties are the noise of every integral (the noise node of core.pipeline measures them), normalised with them. Without them all points weigh the same.
+
+    Returns
+    -------
+        (del_times, integrations, uncertainties), sorted by delay time.
+    '''
+    integrations = np.array(integrations)
+    if(uncertainties is None):
+        uncertainties = 1e-6*np.ones_like(integrations) # no noise measured: equal weights
+    else:
+        uncertainties = np.array(uncertainties, dtype=np.float64)
+        if(normalize):
+            uncertainties /= np.abs(np.max(integrations))
+    if(normalize):
+        integrations /= np.max(integrations)
+    sort_indices = np.argsort(del_times)
+    return np.asarray(del_times)[sort_indices], integrations[sort_indices], uncertainties[sort_indices]
+
+def get_bounds(integrations, del_times, fixed={}):
+    '''Bounds of the parameters, with fixed ({ index: value }) ones pinned to their value.'''
+    bounds = [ [0, np.max(np.abs(integrations))*10], [-1, 10], [np.min(del_times)/10, np.max(del_times)*10], [0.99*0, 1.01*10] ]
+    for i, fv in fixed.items():
+        bounds[i] = [ fv, fv ]
+    return bounds
+
+def evaluate_model(model, args, x, jacobian=False):
+    '''A model of fit_models from its terms (model_terms), with its derivatives by the parameters if asked.
+    The exponentials are computed once, for both.
+
+    Parameters
+    ----------
+        model: str, a key of model_terms.
+        args: (gamma_0, s, T1, r).
+        x: array of delay times (μs).
+        jacobian: bool.
+
+    Returns
+    -------
+        y, or (y, (len(x), 4) array of dy/dargs).
+    '''
+    gamma_0, s, T1, r = args
+    rates, weights = model_terms[model]
+    qx = rates[None,:] * np.asarray(x, dtype=np.float64)[:,None] / T1 # (points, terms)
+    u = np.power(qx, r)
+    e = weights[None,:] * np.exp(-u)
+    S = np.sum(e, axis=1)
+    y = gamma_0 * (1 - (1+s)*S)
+    if not(jacobian):
+        return y
+    eu = e * u
+    with np.errstate(divide='ignore'):
+        log_qx = np.where(qx > 0, np.log(np.where(qx > 0, qx, 1.0)), 0.0) # u*log(qx) -> 0 as qx -> 0
+    J = np.empty((y.shape[0], 4))
+    J[:,0] = 1 - (1+s)*S
+    J[:,1] = -gamma_0 * S
+    J[:,2] = -gamma_0 * (1+s) * r/T1 * np.sum(eu, axis=1)
+    J[:,3] = gamma_0 * (1+s) * np.sum(eu * log_qx, axis=1)
+    return y, J
+
+def get_initial_estimates(del_times, integrations, weights, model, bounds, num=3, grid=64):
+    '''Cheap starting points for a fit: for every T1 on a log-spaced grid (at the fixed or unit r), gamma_0 and s
+    follow from a linear least squares fit (the model is linear in gamma_0 and gamma_0*(1+s)). Returns the best
+    num local minima of the cost along the grid, best first, as (gamma_0, s, T1, r) arrays.'''
+    bounds = np.asarray(bounds, dtype=np.float64)
+    fixed = bounds[:,0] == bounds[:,1]
+    r = bounds[3,0] if fixed[3] else 1.0
+    T1s = np.array([ bounds[2,0] ]) if fixed[2] else np.exp(np.linspace(np.log(max(bounds[2,0], 1e-12)), np.log(bounds[2,1]), grid))
+    x = np.asarray(del_times, dtype=np.float64)
+    y = np.asarray(integrations, dtype=np.float64)
+    candidates = []
+    for T1 in T1s:
+        S = 1 - evaluate_model(model, (1.0, 0.0, T1, r), x) # gamma_0 = 1 and s = 0 leave 1 - S
+        if(fixed[0] and fixed[1]):
+            gamma_0, s = bounds[0,0], bounds[1,0]
+        elif(fixed[0]): # y - gamma_0 = -gamma_0 (1+s) S
+            gamma_0 = bounds[0,0]
+            s = -np.sum(weights**2 * (y - gamma_0) * S) / max(gamma_0 * np.sum(weights**2 * S**2), 1e-300) - 1
+        elif(fixed[1]): # y = gamma_0 (1 - (1+s) S)
+            s = bounds[1,0]
+            h = 1 - (1+s)*S
+            gamma_0 = np.sum(weights**2 * y * h) / max(np.sum(weights**2 * h**2), 1e-300)
+        else: # y = A + B S
+            A = np.stack([ np.ones_like(S), S ], axis=1) * weights[:,None]
+            (c0, c1), *_ = np.linalg.lstsq(A, y * weights, rcond=None)
+            gamma_0 = c0
+            s = -c1/c0 - 1 if not(c0 == 0) else 0.0
+        args = np.clip([ gamma_0, s, T1, r ], bounds[:,0], bounds[:,1])
+        cost = np.sum(np.square(weights * (evaluate_model(model, args, x) - y)))
+        candidates += [ (cost, args) ]
+    costs = np.array([ c[0] for c in candidates ])
+    minima = [ i for i in range(len(costs)) if (i == 0 or costs[i] <= costs[i-1]) and (i == len(costs)-1 or costs[i] <= costs[i+1]) ]
+    minima = sorted(minima, key=lambda i: costs[i])[:num]
+    return [ candidates[i][1] for i in minima ]
+
+def _get_covariance(J, residuals, num_free):
+    '''curve_fit's covariance (absolute_sigma=False) from the weighted Jacobian of the free parameters and the weighted residuals.'''
+    _, sv, VT = np.linalg.svd(J, full_matrices=False)
+    threshold = np.finfo(float).eps * max(J.shape) * sv[0] if sv.shape[0] > 0 else 0
+    keep = sv > threshold
+    pcov = (VT[keep].T / sv[keep]**2) @ VT[keep]
+    dof = J.shape[0] - num_free
+    if(dof > 0):
+        return pcov * np.sum(np.square(residuals)) / dof
+    return np.full_like(pcov, np.inf)
+
+def fit_t1(del_times, integrations, uncertainties, model='7/2 Spin', fixed={}, excluded=[], seed=None, callback=None, method='fast', workers=1):
+    '''Fits a T1 recovery curve.
+
+    method 'fast' starts bounded least squares (with the models' analytic Jacobians) from the best few
+    get_initial_estimates, and only falls back on the global search if none of them converges.
+    method 'global' finds a global minimum by differential evolution, refined (and given uncertainties) by curve_fit.
+    It evaluates the cost of each whole population at once, split over workers threads.
+
+    Parameters
+    ----------
+        del_times, integrations, uncertainties: arrays, one value per acquisition.
+        model: str, a key of fit_models.
+        fixed: { parameter index: value } of parameters to hold fixed.
+        excluded: indices of points to leave out.
+        seed: optional, for a reproducible differential evolution.
+        callback: optional func(fraction done), called as the fit goes on. An exception raised in it stops the fit.
+        method: 'fast' or 'global'.
+        workers: threads the global search evaluates populations on; -1 for one per core.
+
+    Returns
+    -------
+        (popt, sigmas, res). res is an OptimizeResult; res.fun is the cost the global search minimises.
+    '''
+    if(method == 'fast'):
+        result = _fit_t1_fast(del_times, integrations, uncertainties, model, fixed, excluded, callback)
+        if not(result is None):
+            return result
+        print('T1 fit: no start converged, falling back on the global search')
+    elif not(method == 'global'):
+        raise ValueError(f'Unknown fit method {method}')
+    return _fit_t1_global(del_times, integrations, uncertainties, model, fixed, excluded, seed, callback, workers)
+
+def _get_included(del_times, integrations, uncertainties, excluded):
+    included = np.array([ not(i in excluded) for i in range(len(del_times)) ], dtype=bool)
+    return np.asarray(del_times)[included], np.asarray(integrations)[included], np.asarray(uncertainties)[included]
+
+def _fit_t1_fast(del_times, integrations, uncertainties, model, fixed, excluded, callback):
+    '''Multi-start least squares. Returns fit_t1's result, or None if no start converged.'''
+    x, y, errs = _get_included(del_times, integrations, uncertainties, excluded)
+    bounds = np.array(get_bounds(integrations, del_times, fixed), dtype=np.float64)
+    free = [ i for i in range(4) if not(i in fixed) ]
+    weights = 1/np.maximum(errs, np.finfo(float).tiny) # as curve_fit's sigma
+
+    def full_args(p):
+        args = bounds[:,0].copy() # fixed ones are pinned there
+        args[free] = p
+        return args
+    def residuals(p):
+        return weights * (evaluate_model(model, full_args(p), x) - y)
+    def jacobian(p):
+        return weights[:,None] * evaluate_model(model, full_args(p), x, jacobian=True)[1][:,free]
+
+    def cost(popt): # as the global search's
+        return np.sum(np.square(weights * (evaluate_model(model, popt, x) - y)))
+
+    if(len(free) == 0):
+        popt = bounds[:,0].copy()
+        return popt, np.zeros(4), sp.optimize.OptimizeResult(x=popt, fun=cost(popt), success=True, nfev=0, method='none')
+    starts = get_initial_estimates(x, y, weights, model, bounds)
+    best = None
+    for i, start in enumerate(starts):
+        if not(callback is None):
+            callback(i/len(starts))
+        try:
+            res = sp.optimize.least_squares(residuals, start[free], jac=jacobian, bounds=(bounds[free,0], bounds[free,1]), method='trf', x_scale='jac')
+        except ValueError: # e.g. a start outside degenerate bounds
+            continue
+        if(res.success and np.isfinite(res.cost) and (best is None or res.cost < best.cost)):
+            best = res
+    if(best is None):
+        return None
+    popt = full_args(best.x)
+    sigmas = np.zeros(4)
+    sigmas[free] = np.sqrt(np.diag(_get_covariance(best.jac, best.fun, len(free))))
+    if not(callback is None):
+        callback(1.0)
+    res = sp.optimize.OptimizeResult(x=popt, fun=cost(popt), success=True, nfev=best.nfev, njev=best.njev, starts=len(starts), message=best.message, method='least_squares')
+    return popt, sigmas, res
+
+def fit_t1_shared(curves, model='7/2 Spin', shared=[], fixed={}, excluded=None, callback=None):
+    '''Fits several T1 recovery curves together (e.g. one per channel, or per spectral line), with the parameters
+    in shared common to all of them and the rest fitted to each curve.
+
+    This is one bounded least squares problem. Each curve's residuals only depend on the shared parameters and its
+    own, so its Jacobian is block sparse, and both the solve (lsmr) and the uncertainties (by the Schur complement
+    of the shared block) take time linear in the number of curves. Each curve is first fitted on its own (as
+    fit_t1's fast method does), and the shared parameters start at the median of those fits.
+
+    Parameters
+    ----------
+        curves: list of (del_times, integrations, uncertainties), one per curve.
+        model: str, a key of fit_models.
+        shared: indices of the parameters common to all curves.
+        fixed: { parameter index: value } of parameters to hold fixed, in all curves.
+        excluded: optional list of the indices of points to leave out, one list per curve.
+        callback: optional func(fraction done). An exception raised in it stops the fit.
+
+    Returns
+    -------
+        (popts, sigmas, res). popts and sigmas are (curves, 4) arrays. res is an OptimizeResult; res.fun is the sum of the curves' fit_t1 costs.
+    '''
+    num = len(curves)
+    excluded = [ [] for c in curves ] if excluded is None else excluded
+    shared_free = [ i for i in sorted(set(shared)) if not(i in fixed) ]
+    local_free = [ i for i in range(4) if not(i in shared_free) and not(i in fixed) ]
+    S, L = len(shared_free), len(local_free)
+    xs, ys, weights, bounds = [], [], [], []
+    for (del_times, integrations, uncertainties), ex in zip(curves, excluded):
+        x, y, e = _get_included(del_times, integrations, uncertainties, ex)
+        xs += [ np.asarray(x, dtype=np.float64) ]
+        ys += [ np.asarray(y, dtype=np.float64) ]
+        weights += [ 1/np.maximum(e, np.finfo(float).tiny) ]
+        bounds += [ np.array(get_bounds(integrations, del_times, fixed), dtype=np.float64) ]
+    bounds = np.array(bounds) # (curves, 4, 2)
+    shared_bounds = np.stack([ np.min(bounds[:,:,0], axis=0), np.max(bounds[:,:,1], axis=0) ], axis=1)
+
+    # starting points: each curve on its own
+    starts = np.empty((num, 4))
+    for c in range(num):
+        if not(callback is None):
+            callback(0.5*c/num)
+        result = _fit_t1_fast(curves[c][0], curves[c][1], curves[c][2], model, fixed, excluded[c], None)
+        starts[c] = result[0] if not(result is None) else get_initial_estimates(xs[c], ys[c], weights[c], model, bounds[c], num=1)[0]
+    p0 = np.concatenate([ np.median(starts[:,shared_free], axis=0), starts[:,local_free].ravel() ])
+    lower = np.concatenate([ shared_bounds[shared_free,0], bounds[:,local_free,0].ravel() ])
+    upper = np.concatenate([ shared_bounds[shared_free,1], bounds[:,local_free,1].ravel() ])
+    p0 = np.clip(p0, lower, upper)
+
+    def all_args(p):
+        args = bounds[:,:,0].copy() # fixed ones are pinned there
+        args[:,shared_free] = p[:S]
+        args[:,local_free] = np.reshape(p[S:], (num, L))
+        return args
+    def residuals(p):
+        if not(callback is None):
+            callback(0.5) # lets the fit be cancelled
+        args = all_args(p)
+        return np.concatenate([ weights[c] * (evaluate_model(model, args[c], xs[c]) - ys[c]) for c in range(num) ])
+    # every row of the Jacobian has S + L entries: the shared columns, then its curve's local ones
+    sizes = np.array([ len(x) for x in xs ])
+    curve_of_row = np.repeat(np.arange(num), sizes)
+    indices = np.concatenate([ np.broadcast_to(np.arange(S), (len(curve_of_row), S)), S + L*curve_of_row[:,None] + np.arange(L)[None,:] ], axis=1).ravel()
+    indptr = np.arange(len(curve_of_row)+1) * (S + L)
+    def get_blocks(p):
+        args = all_args(p)
+        return [ weights[c][:,None] * evaluate_model(model, args[c], xs[c], jacobian=True)[1] for c in range(num) ]
+    def jacobian(p):
+        data = np.concatenate([ J[:,shared_free + local_free] for J in get_blocks(p) ], axis=0).ravel()
+        return sp.sparse.csr_matrix((data, indices, indptr), shape=(len(curve_of_row), S + L*num))
+
+    popts = starts.copy()
+    sigmas = np.zeros((num, 4))
+    res = sp.optimize.OptimizeResult(success=True, nfev=0, njev=0, message='nothing to fit', method='none')
+    if(S + L > 0):
+        fit = sp.optimize.least_squares(residuals, p0, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac', tr_solver='lsmr')
+        popts = all_args(fit.x)
+        res = sp.optimize.OptimizeResult(success=fit.success, nfev=fit.nfev, njev=fit.njev, message=fit.message, method='least_squares')
+        # covariance: invert J^T J blockwise. Shared block A, coupling blocks B (S x L) and local blocks D (L x L) per curve.
+        blocks = [ J[:,shared_free + local_free] for J in get_blocks(fit.x) ]
+        A = np.zeros((S, S))
+        Bs, D_invs = [], []
+        schur = np.zeros((S, S))
+        for J in blocks:
+            Js, Jl = J[:,:S], J[:,S:]
+            A += Js.T @ Js
+            Bs += [ Js.T @ Jl ]
+            D_invs += [ np.linalg.pinv(Jl.T @ Jl) ]
+            schur += Bs[-1] @ D_invs[-1] @ Bs[-1].T
+        cov_shared = np.linalg.pinv(A - schur) if S > 0 else np.zeros((0, 0))
+        dof = len(curve_of_row) - (S + L*num)
+        scale = np.sum(np.square(fit.fun)) / dof if dof > 0 else np.inf
+        for c in range(num):
+            cov_local = D_invs[c] + D_invs[c] @ Bs[c].T @ cov_shared @ Bs[c] @ D_invs[c]
+            sigmas[c,shared_free] = np.sqrt(np.maximum(np.diag(cov_shared), 0) * scale)
+            sigmas[c,local_free] = np.sqrt(np.maximum(np.diag(cov_local), 0) * scale)
+    res.x = popts
+    res.fun = sum([ np.sum(np.square(weights[c] * (evaluate_model(model, popts[c], xs[c]) - ys[c]))) for c in range(num) ])
+    res.shared = shared_free
+    if not(callback is None):
+        callback(1.0)
+    return popts, sigmas, res
+
+def get_population_costs(model, population, x, y, yerr, pool=None, workers=1):
+    '''The global search's cost of each column of a (4, population) parameter matrix, evaluated in one go
+    (in workers chunks on pool's threads, if given; numpy lets go of the GIL while it works).'''
+    fit_func = fit_models[model]
+    weights = 1/np.maximum(yerr, np.finfo(float).tiny) # as curve_fit's sigma
+    def costs(columns):
+        return np.sum(np.square(weights * (fit_func(columns, x) - y)), axis=-1) # more points is more fits
+    if(pool is None or population.shape[1] < 2*workers):
+        return costs(population)
+    chunks = np.array_split(population, workers, axis=1)
+    return np.concatenate(list(pool.map(costs, chunks)))
+
+def _fit_t1_global(del_times, integrations, uncertainties, model, fixed, excluded, seed, callback, workers=1):
+    '''Differential evolution, polished by curve_fit.'''
+    fit_func = fit_models[model]
+    included_xvals, included_yvals, included_errs = _get_included(del_times, integrations, uncertainties, excluded)
+    bounds = get_bounds(integrations, del_times, fixed)
+    num_workers = (os.cpu_count() or 1) if workers == -1 else max(int(workers), 1)
+
+    # global minimum
+    done = [0.0]
+    def de_callback(xk, convergence):
+        done[0] = max(done[0], 0.9 * min(convergence, 1.0)) # convergence reaches 1 when differential evolution stops
+        callback(done[0])
+    pool = concurrent.futures.ThreadPoolExecutor(num_workers) if num_workers > 1 else None
+    try:
+        res = sp.optimize.differential_evolution(lambda population: get_population_costs(model, population, included_xvals, included_yvals, included_errs, pool, num_workers),
+                                                 bounds=bounds, seed=seed, vectorized=True, updating='deferred', popsize=20, tol=1e-3, # deferred updating needs the larger, tighter search to find the minima immediate updating did
+                                                 callback=None if callback is None else de_callback)
+    finally:
+        if not(pool is None):
+            pool.shutdown()
+    # get uncertainties on the fit, as I am too lazy to do the full analysis when scipy will do it for me
+    picky_scipy_bounds = np.array(bounds).T
+    picky_scipy_bounds[0,:] -= 1e-9
+    if not(callback is None):
+        callback(0.9)
+    popt, pcov = sp.optimize.curve_fit(lambda xs, *args: fit_func(args, xs), included_xvals, included_yvals, p0=res.x, bounds=picky_scipy_bounds, sigma=included_errs, absolute_sigma=False)
+    if not(callback is None):
+        callback(1.0)
+    return popt, np.sqrt(np.diag(pcov)), res
@@ -5,82 +5,142 @@ import numpy as np
 import h5py as hdf
 import traceback
 import re
+import concurrent.futures
 
 from DNMR.fileops_loaders.data_struct import *
 from DNMR.fileops_loaders.alpha import *
 from DNMR.fileops_loaders.v100 import *
+from DNMR.fileops_loaders.v100_columnar import read_hdf_v100_columnar, get_sorted_entries
+from DNMR.fileops_loaders.lazy import lazy_rows, share_rows, release_rows
+from DNMR.fileops_loaders.schema import apply_schema, get_units
+import DNMR.fileops_loaders.cache as filecache
+from DNMR.fileops_loaders.tnt import read_tnt
+import DNMR.fileops_loaders.registry as registry
 
 def get_tnt_data(fn: str):
-    import pytnt as tnt  # Requires numpy.dual fix.
-    '''Retrieves the same data as the below function, but from a .tnt file'''
-    f = tnt.TNTfile(fn)
-    print('WARNING: TNT file loading is not without it\'s concerns. If you don\'t know what you\'re doing, don\'t do this!')
-    input('WARNING: Mandatory input so the user is forced to read the above. Type anything to continue: ')
-    
-    complexes = np.swapaxes(f.DATA, 0, 1)[:,:,0,0]
-    times = np.broadcast_to(f.fid_times()[None,:], complexes.shape)
-    reals = np.real(complexes)
-    imags = np.imag(complexes)
-    
-    data = data_struct()
-    
-    data['size'] = reals.shape[0]
-    
-    data['reals'] = reals
-    data['imags'] = imags
-    data['times'] = times*1e6
-    #tnt_delay_table = [5_000_000, 2_600_000, 1_350_000, 700_000, 360_000, 190_000, 98000, 51000, 26000, 13600, 7100, 3700, 1900, 988, 512, 266, 138, 72, 37, 19, 10, 1]
-    tnt_delay_table = [ 10, 19, 37, 72, 138, 266, 512, 988, 1900, 3700, 7100, 13600, 26000, 51000, 98000, 190_000, 360_000, 700_000, 1_350_000, 2_600_000, 5_000_000]
-    data['sequence'] = data_struct({'0': data_struct({'relaxation_time': np.array(tnt_delay_table)})})
-    data['params'] = data_struct({'post_acquisition_time': np.array([500])})
-    #data['relaxation_times'] = np.array([5_000_000, 2_600_000, 1_350_000, 700_000, 360_000, 190_000, 98000, 51000, 26000, 13600, 7100, 3700, 1900, 988, 512, 266, 138, 72, 37, 19, 10, 1])
-    #tmp = np.copy(data['relaxation_times'])
-    #for i in range(len(tmp)):
-    #    data['relaxation_times'][-i-1] = tmp[i]
-    
-    # TODO
-    magf = re.search('.*?(?P<magfield>\\d+([.]\\d+)?)Oe.*?', fn)
-    freq = re.search('.*?(?P<freq>\\d+([.]\\d+)?)MHz.*?', fn)
-    if(magf):
-        data['ppms_mf'] = np.broadcast_to(np.array([float(magf['magfield'])]), (data['size'],))
-    if(freq):
-        data['obs_freq'] = np.broadcast_to(np.array([float(freq['freq'])]), (data['size'],))
-    
-    return data
+    '''Retrieves the same data as the below function, but from a .tnt file. See fileops_loaders/tnt.py.'''
+    return read_tnt(fn)
 
-def get_data(fn: str):
+def get_data(fn: str, use_cache: bool = True, lazy: bool = False, compact: bool = False):
     '''Retrieves all the data from an HDF file and stores it in a nice format.
 
     Parameters
     ----------
         fn: str, the filename of the data. Include file extension.
+        use_cache: bool, whether to look for (and store) the parsed file in the on-disk cache (see fileops_loaders/cache.py).
+        lazy: bool, if True, reals and imags of version-100 files are lazy_rows (see fileops_loaders/lazy.py), which read acquisitions from the file only when they are used.
+        compact: bool, if True, signal data (reals, imags) is stored as float32 rather than float64. See fileops_loaders/schema.py for the types of all known keys.
 
     Returns
     -------
         a dictionary, in the form { 'reals': [2d numpy array, 1st dimension is acquisition index, 2nd dimension is datapoint index],
                                     'imags': [same as reals],
-                                    'times': [same as reals],  
+                                    'times': [same as reals. If all rows are the same, a read-only np.broadcast_to of that one row],
                                     ... (other keys auto-filled!)
                                   }
     '''
-    
-    if(fn[-4:]=='.tnt'):
-        return get_tnt_data(fn)
+    if(use_cache):
+        data = filecache.load(fn, lazy, compact)
+        if not(data is None):
+            print(f'Loaded {fn} from the cache')
+            return data
+
+    data = read_file(fn, lazy, compact)
+
+    if(use_cache):
+        try:
+            filecache.store(fn, data, lazy, compact)
+        except:
+            print('Could not cache the parsed file:')
+            traceback.print_exc()
+    return data
+
+def read_file(fn: str, lazy: bool = False, compact: bool = False):
+    '''Parses fn with the appropriate loader, converts known keys to their declared types, and stores times as one shared row if it can. See get_data.'''
+    data = apply_schema(registry.read(fn, lazy=lazy, compact=compact), compact)
+    if('times' in data.keys()):
+        data['times'] = share_rows(data['times'])
+    return data
+
+def get_data_many(fns, workers: int = 1, progress=None, lazy: bool = False, compact: bool = False):
+    '''Runs get_data on every file in fns, optionally in a pool of worker processes.
+
+    Parameters
+    ----------
+        fns: list of filenames.
+        workers: number of processes to parse with. 1 (or fewer) parses in this process, one file after the other.
+            Files whose loader lacks the 'parallel' capability (see fileops_loaders/registry.py) are always parsed in this process,
+            while the pool parses the others.
+        progress: optional callable, progress(done, total), called every time a file has been parsed.
+        lazy: bool, see get_data.
+        compact: bool, see get_data.
+
+    Returns
+    -------
+        a list of data_structs, in the same order as fns. Raises the first exception any of the files raised.
+    '''
+    total = len(fns)
+    results = [ None ] * total
+    serial = list(range(total)) if (workers <= 1 or total <= 1) else [ i for i, fn in enumerate(fns) if not(registry.is_parallel(fn, lazy)) ]
+    parallel = [ i for i in range(total) if not(i in serial) ]
+    if(len(parallel) == 0):
+        for done, i in enumerate(serial):
+            results[i] = get_data(fns[i], lazy=lazy, compact=compact)
+            if not(progress is None):
+                progress(done+1, total)
+        return results
 
-    with hdf.File(fn, 'r') as file:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(parallel))) as pool:
+        futures = { pool.submit(get_data, fns[i], lazy=lazy, compact=compact): i for i in parallel }
+        done = 0
         try:
-            version_string = file.attrs['version']
-        except: # no version string. Must be an alpha-version file.
-            return read_hdf_valpha(file)
-        
-        print(f'Loading file with version string {version_string}')
-        
-        # else, use appropriate reader
-        if(version_string in ['100']):
-            return read_hdf_v100(file)
-        else:
-            return read_hdf_valpha(file)
+            for i in serial: # while the pool parses the rest
+                results[i] = get_data(fns[i], lazy=lazy, compact=compact)
+                done += 1
+                if not(progress is None):
+                    progress(done, total)
+            for fut in concurrent.futures.as_completed(futures):
+                results[futures[fut]] = fut.result()
+                done += 1
+                if not(progress is None):
+                    progress(done, total)
+        except:
+            for fut in futures:
+                fut.cancel()
+            raise
+    return results
 
+def get_entry_numbers(fn: str):
+    '''Returns the sorted entry numbers in fn, or None if no loader can read it incrementally (TNT, alpha, other versions).'''
+    if not(registry.is_hdf(fn)):
+        return None
+    # The file may still be open for writing by frappy/NICOS, so don't insist on the HDF5 file lock.
+    with hdf.File(fn, 'r', locking=False) as file:
+        l = registry.get_incremental(fn, file)
+        if(l is None):
+            return None
+        return l.get_entry_numbers(file)
 
+def get_new_entries(fn: str, last_entry, lazy: bool = False, compact: bool = False):
+    '''Reads only the entries of fn numbered above last_entry.
 
+    Parameters
+    ----------
+        fn: str, the filename of a file some loader can read incrementally (version 100).
+        last_entry: int, the highest entry number already read.
+        lazy: bool, see get_data.
+        compact: bool, see get_data.
 
+    Returns
+    -------
+        (data, last_entry): a data_struct of the new entries (None if there are none) and the highest entry number now read.
+        If the newest entry can't be read yet (it is probably still being written), it is left for the next call.
+    '''
+    with hdf.File(fn, 'r', locking=False) as file:
+        l = registry.get_incremental(fn, file)
+        if(l is None):
+            return None, last_entry
+        data, last_entry = l.read_new(file, last_entry, lazy=lazy, compact=compact)
+    if not(data is None) and 'times' in data.keys():
+        data['times'] = share_rows(data['times'])
+    return data, last_entry
@@ -3,9 +3,12 @@ import h5py as hdf
 import traceback
 import re
 
-from DNMR.fileops_loaders.data_struct import data_struct, hdf_to_dict
+from DNMR.fileops_loaders.data_struct import data_struct, hdf_to_dict, concatenate_structs
+from DNMR.fileops_loaders.schema import to_array, apply_schema
+from DNMR.fileops_loaders.registry import loader, register
 
-def read_hdf_valpha(file):
+def read_hdf_valpha(file, compact=False):
+    '''Reads a file without a version string (point/entry groups). compact stores signal data in single precision (see schema.py).'''
     toplevel = file.keys()
     points = []
     point_indices = []
@@ -47,25 +50,14 @@ def read_hdf_valpha(file):
             data[key][index] = val
     
     for key, val in data.items():
+        if(key == 'size'):
+            continue
         # check if we can turn it into a dict, then numpy array
         try:
-            ds = data_struct(hdf_to_dict(val[0]))
-            for i in range(1, len(val)):
-                ds += data_struct(hdf_to_dict(val[i]))
-            data[key] = ds
+            data[key] = apply_schema(concatenate_structs([ data_struct(hdf_to_dict(v)) for v in val ]), compact, key+'/')
         except:
             try:
-                arr = np.array(val)
-                try:
-                    arr_f = arr.astype(float)
-                    arr_i = arr.astype(int)
-                    if(arr_i == arr_f):
-                        arr = arr_i
-                    else:
-                        arr = arr_f
-                except:
-                    pass
-                data[key] = arr
+                data[key] = to_array(key, val, compact) # known keys get their declared type, others keep the stored one
             except:
                 pass
     if(data['times'].shape != data['reals'].shape):
@@ -75,4 +67,16 @@ def read_hdf_valpha(file):
         else:
             data['times'] = data['params']['acquisition_time'] * np.array([ i/l for i in range(0, l) ])[None,:] # really legacy
 
-    return data
\ No newline at end of file
+    return data
+
+class alpha_loader(loader):
+    '''Files without a version string, and the fallback for any version nothing else reads.'''
+    name = 'alpha'
+    priority = 0
+    fallback = True
+    capabilities = { 'compact', 'parallel' }
+
+    def read(self, fn, file, lazy=False, compact=False):
+        return read_hdf_valpha(file, compact)
+
+register(alpha_loader())
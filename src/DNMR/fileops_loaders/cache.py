@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import argparse
+
+import numpy as np
+
+from DNMR.fileops_loaders.data_struct import data_struct
+from DNMR.fileops_loaders.lazy import is_shared
+
+# Bump this whenever a loader changes what it returns, so that stale cache entries are never used.
+LOADER_VERSION = 4
+
+DEFAULT_BUDGET = 4 * 1024**3 # bytes
+MMAP_THRESHOLD = 64 * 1024 # bytes. Smaller arrays are just read.
+
+def get_cache_dir():
+    '''The cache lives in $DNMR_CACHE_DIR, or $XDG_CACHE_HOME/DNMR (~/.cache/DNMR by default).'''
+    if('DNMR_CACHE_DIR' in os.environ):
+        return os.environ['DNMR_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'DNMR')
+
+def get_budget():
+    '''Maximum size of the cache in bytes. Set with $DNMR_CACHE_SIZE (in bytes).'''
+    try:
+        return int(os.environ['DNMR_CACHE_SIZE'])
+    except:
+        return DEFAULT_BUDGET
+
+def cache_key(fn: str, lazy: bool = False, compact: bool = False):
+    '''Identifies a parsed file by absolute path, size, modification time and loader version. Any of them changing is a miss.
+    Lazy parses (which only reference the rows in the file) and compact ones are kept separately from full ones.'''
+    path = os.path.abspath(fn)
+    st = os.stat(path)
+    ident = f'{path}|{st.st_size}|{st.st_mtime_ns}|{LOADER_VERSION}' + ('|lazy' if lazy else '') + ('|compact' if compact else '')
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest(), { 'source': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'loader_version': LOADER_VERSION, 'lazy': lazy, 'compact': compact }
+
+def _write_node(val, d, counter):
+    '''Writes one value of a data_struct into entry directory d. Returns its manifest description.'''
+    if(isinstance(val, data_struct)):
+        return { 'type': 'struct', 'items': [ [k, _write_node(v, d, counter)] for k, v in val.items() ] }
+    counter[0] += 1
+    if(is_shared(val) and val.dtype != object): # one row broadcast over all of them (times): store the row once
+        fn = f'{counter[0]}.npy'
+        np.save(os.path.join(d, fn), np.array(val[0]), allow_pickle=False)
+        return { 'type': 'shared', 'file': fn, 'shape': list(val.shape) }
+    if(isinstance(val, np.ndarray) and val.dtype != object):
+        fn = f'{counter[0]}.npy'
+        if not(val.dtype.metadata is None or val.dtype.names): # h5py tags its string dtypes; npy can't store that
+            val = val.view(np.dtype(val.dtype.str))
+        np.save(os.path.join(d, fn), val, allow_pickle=False)
+        return { 'type': 'array', 'file': fn, 'mmap': bool(val.ndim > 0 and val.nbytes >= MMAP_THRESHOLD) }
+    if(isinstance(val, (bool, int, float, str)) or val is None):
+        return { 'type': 'value', 'value': val }
+    fn = f'{counter[0]}.pkl'
+    with open(os.path.join(d, fn), 'wb') as f:
+        pickle.dump(val, f)
+    return { 'type': 'pickle', 'file': fn }
+
+def _read_node(node, d):
+    if(node['type'] == 'struct'):
+        ds = data_struct()
+        for k, v in node['items']:
+            ds[k] = _read_node(v, d)
+        return ds
+    if(node['type'] == 'value'):
+        return node['value']
+    if(node['type'] == 'pickle'):
+        with open(os.path.join(d, node['file']), 'rb') as f:
+            return pickle.load(f)
+    if(node['type'] == 'shared'):
+        return np.broadcast_to(np.load(os.path.join(d, node['file']), allow_pickle=False), tuple(node['shape']))
+    # copy-on-write, so that code which edits arrays in place still works and the cache is never touched
+    return np.load(os.path.join(d, node['file']), mmap_mode=('c' if node['mmap'] else None), allow_pickle=False)
+
+def load(fn: str, lazy: bool = False, compact: bool = False):
+    '''Returns the cached data_struct for fn, or None if there is none for the file as it is now.'''
+    try:
+        key, ident = cache_key(fn, lazy, compact)
+        d = os.path.join(get_cache_dir(), key)
+        manifest_fn = os.path.join(d, 'manifest.json')
+        with open(manifest_fn, 'r') as f:
+            manifest = json.load(f)
+        for k, v in ident.items():
+            if(manifest[k] != v):
+                return None
+        data = _read_node(manifest['tree'], d)
+        os.utime(manifest_fn) # most recently used
+        return data
+    except:
+        return None
+
+def store(fn: str, data, lazy: bool = False, compact: bool = False):
+    '''Writes data (parsed from fn) into the cache, then evicts the least recently used entries if over budget.'''
+    key, ident = cache_key(fn, lazy, compact)
+    root = get_cache_dir()
+    os.makedirs(root, exist_ok=True)
+    d = os.path.join(root, key)
+    tmp = f'{d}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        manifest = dict(ident)
+        manifest['tree'] = _write_node(data, tmp, [0])
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        shutil.rmtree(d, ignore_errors=True)
+        os.replace(tmp, d)
+    except:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    evict(get_budget(), keep=key)
+
+def _entry_size(d):
+    return sum([ os.path.getsize(os.path.join(d, i)) for i in os.listdir(d) ])
+
+def list_entries():
+    '''Returns (key, source file, size in bytes, last used) for every entry, least recently used first.'''
+    root = get_cache_dir()
+    entries = []
+    if not(os.path.isdir(root)):
+        return entries
+    for key in os.listdir(root):
+        d = os.path.join(root, key)
+        manifest_fn = os.path.join(d, 'manifest.json')
+        try:
+            with open(manifest_fn, 'r') as f:
+                source = json.load(f)['source']
+            entries += [ (key, source, _entry_size(d), os.path.getmtime(manifest_fn)) ]
+        except:
+            continue # half-written, or not ours
+    entries.sort(key=lambda e: e[3])
+    return entries
+
+def evict(budget: int, keep=None):
+    '''Removes least recently used entries until the cache is at most budget bytes. The entry keep is never removed.'''
+    entries = list_entries()
+    total = sum([ e[2] for e in entries ])
+    for key, source, size, used in entries:
+        if(total <= budget):
+            break
+        if(key == keep):
+            continue
+        shutil.rmtree(os.path.join(get_cache_dir(), key), ignore_errors=True)
+        total -= size
+
+def _is_temporary(name: str):
+    '''Whether name is that of an entry store was writing (<key>.tmp-<pid>), left behind if it was killed.'''
+    key, sep, pid = name.partition('.tmp-')
+    return len(sep) > 0 and len(key) == 40 and all([ c in '0123456789abcdef' for c in key ]) and pid.isdigit()
+
+def clear():
+    '''Removes every cache entry, and entries left half-written. Nothing else in the cache directory is touched, as it may be shared.'''
+    root = get_cache_dir()
+    for key, source, size, used in list_entries():
+        shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+    if(os.path.isdir(root)):
+        for name in os.listdir(root):
+            if(_is_temporary(name) and os.path.isdir(os.path.join(root, name))):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='dnmr-cache', description='Manage the cache of parsed data files.')
+    parser.add_argument('command', choices=['info', 'clear', 'evict'], help='info: list entries. clear: remove every entry. evict: shrink to the size budget.')
+    parser.add_argument('--budget', type=int, default=None, help='size budget in bytes for evict (default $DNMR_CACHE_SIZE, or 4 GiB)')
+    args = parser.parse_args(argv)
+
+    if(args.command == 'clear'):
+        clear()
+        print(f'Cleared {get_cache_dir()}')
+    elif(args.command == 'evict'):
+        evict(get_budget() if args.budget is None else args.budget)
+    entries = list_entries()
+    if(args.command == 'info'):
+        for key, source, size, used in entries:
+            print(f'{time.strftime("%Y-%m-%d %H:%M", time.localtime(used))} {size/1024**2:10.1f} MiB  {source}')
+    print(f'{len(entries)} entries, {sum([ e[2] for e in entries ])/1024**2:.1f} MiB in {get_cache_dir()}')
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,9 @@ import numpy as np
 import h5py as hdf
 import traceback
 import re
+import weakref
+
+from DNMR.fileops_loaders.lazy import lazy_rows, is_shared
 
 def hdf_to_dict(g): # takes group, gives dict
     def t(n, g, d):
@@ -21,6 +24,25 @@ def hdf_to_dict(g): # takes group, gives dict
     
     return d
     
+def promote(val):
+    '''Turns val into an array of at least one dimension, the way data_struct.__add__ does before appending.'''
+    val = np.array(val)
+    if(val.ndim == 0):
+        val = np.array([val])
+    return val
+
+def append_values(val, setval):
+    '''Appends setval to val along the first axis. This is what data_struct.__add__ does to every (non-struct) key.'''
+    try:
+        a = promote(val)
+        b = promote(setval)
+        while(a.ndim < b.ndim):
+            a = a[None,:]
+        return np.append(a, b, axis=0) # if numpy
+    except:
+        val += setval # they're lists if not.
+        return val
+
 class data_struct():
     data = None
     
@@ -54,24 +76,15 @@ class data_struct():
             if(key == 'size'):
                 self.data['size'] += r[key]
                 continue
-            val = self.data[key]
             if(isinstance(self.data[key], data_struct)):
                 self.data[key] = self.data[key] + r[key]
             else:
-                try:
-                    val = np.array(val)
-                    setval = np.array(r[key])
-                    if(val.ndim == 0):
-                        val = np.array([val])
-                    if(setval.ndim == 0):
-                        setval = np.array([setval])
-                    while(val.ndim < setval.ndim):
-                        val = val[None,:]
-                    self.data[key] = np.append(val, setval, axis=0) # if numpy
-                except:
-                    self.data[key] += r[key] # they're lists if not.
+                self.data[key] = append_values(self.data[key], r[key])
         return self
         
+    def __getstate__(self): # extends and row_buffers (see extend_struct) only mean something in this process
+        return { 'data': self.data }
+
     def __repr__(self):
         s = '(DATA_STRUCT) {\n'
         for key, val in self.data.items():
@@ -81,4 +94,137 @@ class data_struct():
             else:
                 s += f'\t{key}: {val.__repr__()}\n'
         s += '}\n'
-        return s
\ No newline at end of file
+        return s
+
+class data_struct_builder():
+    '''Collects data_structs (one per file, or one per entry) and concatenates them all at once in build().
+
+    The result is the same as chaining data_struct.__add__ over the chunks in order, but every leaf is copied once
+    with a single np.concatenate, rather than once per chunk.
+    '''
+    def __init__(self):
+        self.chunks = {} # key -> list of values, in the order they were appended
+
+    def append(self, ds):
+        for key in list(ds.keys()):
+            if(key in self.chunks):
+                self.chunks[key] += [ ds[key] ]
+            else:
+                self.chunks[key] = [ ds[key] ]
+        return self
+
+    def __iadd__(self, ds):
+        return self.append(ds)
+
+    def __len__(self):
+        return len(self.chunks.get('size', []))
+
+    def build(self):
+        out = data_struct()
+        for key, vals in self.chunks.items():
+            if(key == 'size'):
+                out['size'] = sum(vals)
+            elif(len(vals) == 1): # only one chunk had this key; __add__ would have just taken it
+                out[key] = vals[0]
+            elif(isinstance(vals[0], data_struct)):
+                out[key] = concatenate_structs(vals)
+            else:
+                out[key] = concatenate_values(vals)
+        return out
+
+def concatenate_values(vals):
+    '''Concatenates a list of values along the first axis, like folding append_values over them, in one copy.
+    Lazy arrays stay lazy, and rows broadcast from one shared axis (times) stay broadcast if every chunk shares the same axis.'''
+    if(any([ isinstance(v, lazy_rows) for v in vals ])):
+        return lazy_rows.concatenate(vals)
+    if(all([ is_shared(v) for v in vals ]) and all([ np.array_equal(v[0], vals[0][0]) for v in vals[1:] ])):
+        return np.broadcast_to(vals[0][:1], (sum([ v.shape[0] for v in vals ]),) + vals[0].shape[1:])
+    try:
+        arrs = [ promote(v) for v in vals ]
+        if(all([ a.ndim == arrs[0].ndim for a in arrs ])):
+            return np.concatenate(arrs, axis=0)
+    except:
+        pass
+    # mixed dimensions, ragged shapes or non-arrays: do exactly what __add__ would have done, one at a time.
+    val = vals[0]
+    for v in vals[1:]:
+        val = append_values(val, v)
+    return val
+
+def take_rows(ds, rows, size=None):
+    '''A data_struct of just the acquisitions at rows (e.g. those at one temperature), in that order.
+    Values with one entry per acquisition are indexed (lazy ones read only those rows); everything else is kept as it is.'''
+    rows = np.asarray(rows, dtype=np.int64)
+    top = size is None
+    if(top):
+        size = ds['size']
+    out = data_struct()
+    for key in list(ds.keys()):
+        v = ds[key]
+        if(key == 'size'):
+            out['size'] = len(rows) if top else v
+        elif(isinstance(v, data_struct)):
+            out[key] = take_rows(v, rows, size)
+        elif(is_shared(v)): # one row broadcast over all acquisitions (the times): keep it that way
+            out[key] = np.broadcast_to(v[:1], (len(rows),) + v.shape[1:])
+        elif(isinstance(v, (np.ndarray, lazy_rows)) and v.ndim > 0 and v.shape[0] == size):
+            out[key] = v[rows]
+        elif(isinstance(v, list) and len(v) == size):
+            out[key] = [ v[i] for i in rows ]
+        else:
+            out[key] = v
+    return out
+
+def concatenate_structs(structs):
+    '''Concatenates a list of data_structs in order. Same as structs[0] + structs[1] + ..., without modifying structs[0].'''
+    builder = data_struct_builder()
+    for ds in structs:
+        builder.append(ds)
+    return builder.build()
+
+def extend_struct(ds, new):
+    '''ds with the acquisitions of new appended, the same as concatenate_structs([ds, new]), for files still being written.
+
+    Arrays with a row per acquisition are appended into buffers with room to grow (a quarter more rows than needed),
+    so the rows of ds are only copied when a buffer is full: appending takes amortised constant time per acquisition,
+    not time proportional to all of them. Only extend the latest result, as it shares its buffers with ds.
+    The result's extends is a weak reference to ds, so that a pipeline processing ds only processes the new rows.
+    '''
+    buffers = getattr(ds, 'row_buffers', None)
+    out = _extend(ds, new, {} if buffers is None else buffers, ds['size'], new['size'], ())
+    out.extends = weakref.ref(ds)
+    return out
+
+def _extend(ds, new, buffers, size, new_size, path):
+    out = data_struct()
+    for key in list(ds.keys()) + [ k for k in new.keys() if not(k in ds.keys()) ]:
+        if not(key in new.keys()):
+            out[key] = ds[key]
+            continue
+        if not(key in ds.keys()):
+            out[key] = new[key]
+            continue
+        a, b = ds[key], new[key]
+        if(key == 'size'):
+            out['size'] = a + b
+        elif(isinstance(a, data_struct)):
+            out[key] = _extend(a, b, buffers, size, new_size, path + (key,))
+        elif(isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.ndim > 0 and not(is_shared(a)) and a.shape[0] == size
+             and b.ndim == a.ndim and b.shape[0] == new_size and b.shape[1:] == a.shape[1:] and np.result_type(a, b) == a.dtype):
+            out[key] = _append_rows(a, b, buffers, path + (key,))
+        else:
+            out[key] = concatenate_values([a, b])
+    out.row_buffers = buffers
+    return out
+
+def _append_rows(a, b, buffers, path):
+    '''a and b concatenated, written into buffers[path] if a is the start of it and there's room.'''
+    n = a.shape[0] + b.shape[0]
+    buf = buffers.get(path)
+    if(buf is None or not(a.base is buf) or buf.shape[0] < n or not(a.strides == buf.strides)
+       or not(a.__array_interface__['data'][0] == buf.__array_interface__['data'][0])):
+        buf = np.empty((n + n//4,) + a.shape[1:], dtype=a.dtype)
+        buf[:a.shape[0]] = a
+        buffers[path] = buf
+    buf[a.shape[0]:n] = b
+    return buf[:n]
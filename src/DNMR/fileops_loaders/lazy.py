@@ -0,0 +1,212 @@
+import os
+
+import numpy as np
+import h5py as hdf
+
+class array_rows():
+    '''Row source backed by an array that is already in memory (or memory-mapped, e.g. from the cache).'''
+    def __init__(self, arr):
+        self.arr = arr
+        self.n = arr.shape[0]
+        self.row_shape = arr.shape[1:]
+        self.dtype = arr.dtype
+
+    def read(self, start, stop):
+        return np.asarray(self.arr[start:stop])
+
+class hdf_rows():
+    '''Row source that reads one dataset of every entry of a version-100 file, when asked for it.
+
+    Parameters
+    ----------
+        fn: str, the HDF file.
+        entries: list of entry group names, one per row.
+        path: str, the dataset's path inside an entry (e.g. data/tnmr_reals).
+        row_shape: tuple, the dataset's shape.
+        dtype: the dtype rows are returned in.
+        scale: optional array with one value per row. Rows are divided by it (read_hdf_v100's normalisation by actual_num_acqs).
+    '''
+    def __init__(self, fn, entries, path, row_shape, dtype, scale=None):
+        self.fn = os.path.abspath(fn)
+        self.entries = list(entries)
+        self.path = path
+        self.n = len(self.entries)
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+
+    def read(self, start, stop):
+        out = np.empty((stop-start,) + self.row_shape, dtype=self.dtype)
+        with hdf.File(self.fn, 'r', locking=False) as f:
+            for j, e in enumerate(self.entries[start:stop]):
+                f[e + '/' + self.path].read_direct(out[j])
+        if not(self.scale is None):
+            out /= np.reshape(self.scale[start:stop], (-1,) + (1,)*len(self.row_shape))
+        return out
+
+class file_rows():
+    '''Row source for a raw (rows, points) array stored at offset in a binary file (e.g. the data block of a .tnt file).
+    Pickles as a reference to the file, not as the data.
+
+    Parameters
+    ----------
+        fn: str, the file.
+        offset: int, where the array starts, in bytes.
+        file_dtype: dtype of the array in the file.
+        shape: (rows, points).
+        part: optional, 'real' or 'imag' for one half of a complex array.
+        dtype: the dtype rows are returned in.
+    '''
+    def __init__(self, fn, offset, file_dtype, shape, part=None, dtype=None):
+        self.fn = os.path.abspath(fn)
+        self.offset = offset
+        self.file_dtype = np.dtype(file_dtype)
+        self.shape = tuple(shape)
+        self.part = part
+        self.n = self.shape[0]
+        self.row_shape = self.shape[1:]
+        self.dtype = np.dtype(dtype) if not(dtype is None) else (np.zeros(0, self.file_dtype).real.dtype if part else self.file_dtype)
+
+    def read(self, start, stop):
+        mm = np.memmap(self.fn, dtype=self.file_dtype, mode='r', offset=self.offset, shape=self.shape)
+        rows = mm[start:stop]
+        if(self.part == 'real'):
+            rows = rows.real
+        elif(self.part == 'imag'):
+            rows = rows.imag
+        return np.array(rows, dtype=self.dtype)
+
+class lazy_rows():
+    '''A read-only 2D (acquisition x point) array whose rows are only read when they are used.
+
+    Indexing with rows first (data.reals[i], data.reals[a:b], data.reals[[i, j], :]) reads just those rows.
+    Anything that needs the whole array (np.asarray, astype, numpy functions) reads all of it once and keeps it
+    until release() is called. Made of segments, so that concatenating lazy arrays stays lazy.
+    '''
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.offsets = np.cumsum([0] + [ s.n for s in self.segments ])
+        self.row_shape = self.segments[0].row_shape
+        self.dtype = np.result_type(*[ s.dtype for s in self.segments ])
+        self.cached = None
+
+    @property
+    def shape(self):
+        return (int(self.offsets[-1]),) + tuple(self.row_shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self, start, stop):
+        '''Returns rows start to stop (exclusive) as an array.'''
+        if not(self.cached is None):
+            return self.cached[start:stop]
+        pieces = []
+        for s, a, b in zip(self.segments, self.offsets[:-1], self.offsets[1:]):
+            lo = max(start, a)
+            hi = min(stop, b)
+            if(lo < hi):
+                pieces += [ s.read(lo-a, hi-a).astype(self.dtype, copy=False) ]
+        if(len(pieces) == 0):
+            return np.empty((0,) + tuple(self.row_shape), dtype=self.dtype)
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=0)
+
+    def take(self, indices):
+        '''Returns the rows at indices, reading each contiguous run in one go.'''
+        indices = np.asarray(indices, dtype=np.int64)
+        if(indices.shape[0] == 0):
+            return self.rows(0, 0)
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        breaks = np.nonzero(np.diff(sorted_indices) != 1)[0] + 1
+        runs = np.split(sorted_indices, breaks)
+        read = np.concatenate([ self.rows(r[0], r[-1]+1) for r in runs ], axis=0)
+        out = np.empty_like(read)
+        out[order] = read
+        return out
+
+    def __getitem__(self, key):
+        if not(isinstance(key, tuple)):
+            key = (key,)
+        rkey, rest = key[0], key[1:]
+        n = self.shape[0]
+        if(isinstance(rkey, (int, np.integer))):
+            r = int(rkey) + (n if rkey < 0 else 0)
+            if(r < 0 or r >= n):
+                raise IndexError(f'index {rkey} is out of bounds for axis 0 with size {n}')
+            return self.rows(r, r+1)[0][rest]
+        if(isinstance(rkey, slice) and rkey.step in [None, 1]):
+            start, stop, step = rkey.indices(n)
+            out = self.rows(start, max(start, stop))
+        else:
+            out = self.take(np.arange(n)[rkey])
+        return out[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        if(self.cached is None):
+            self.cached = self.rows(0, self.shape[0])
+        return self.cached if dtype is None else self.cached.astype(dtype)
+
+    def astype(self, dtype, copy=True):
+        return np.asarray(self).astype(dtype, copy=copy)
+
+    def release(self):
+        '''Drops the fully-read copy, if there is one.'''
+        self.cached = None
+
+    def __getstate__(self): # pickled into the cache and between processes as references to the rows only
+        state = dict(self.__dict__)
+        state['cached'] = None
+        return state
+
+    def __repr__(self):
+        return f'lazy_rows(shape={self.shape}, dtype={self.dtype}, segments={len(self.segments)}, {"in memory" if not(self.cached is None) else "on disk"})'
+
+    @staticmethod
+    def concatenate(vals):
+        '''Concatenates lazy_rows and arrays along the first axis, without reading anything.'''
+        segments = []
+        for v in vals:
+            if(isinstance(v, lazy_rows)):
+                segments += v.segments
+            else:
+                segments += [ array_rows(np.asarray(v)) ]
+        return lazy_rows(segments)
+
+def is_shared(arr):
+    '''True if arr is one row broadcast along the first axis (see share_rows).'''
+    return isinstance(arr, np.ndarray) and arr.ndim >= 1 and arr.shape[0] > 0 and arr.strides[0] == 0
+
+def shared_axis(arr):
+    '''If every row of the 2D array arr is the same, returns that row, otherwise None.'''
+    if not(isinstance(arr, np.ndarray)) or arr.ndim != 2 or arr.shape[0] == 0:
+        return None
+    if(is_shared(arr)):
+        return arr[0]
+    if(np.all(arr == arr[0][None,:])):
+        return np.array(arr[0])
+    return None
+
+def share_rows(arr):
+    '''Returns arr as a read-only broadcast of a single row if all its rows are equal (the times axis, usually), else arr itself.'''
+    axis = shared_axis(arr)
+    if(axis is None):
+        return arr
+    return np.broadcast_to(axis[None,:], arr.shape)
+
+def release_rows(ds):
+    '''Calls release() on every lazy array in a data_struct, so that only the rows actually in use stay in memory.'''
+    for k in list(ds.keys()):
+        v = ds[k]
+        if(isinstance(v, lazy_rows)):
+            v.release()
+        elif(hasattr(v, 'keys') and not(isinstance(v, dict))):
+            release_rows(v)
@@ -0,0 +1,129 @@
+import os
+
+import h5py as hdf
+
+class loader():
+    '''Base class of a file format reader. Subclass it, fill in the class attributes and read(), then register() an instance.
+
+    Attributes
+    ----------
+        name: str, shown when loading.
+        extensions: list of file extensions (with the dot) handled, or None for any.
+        hdf: bool, whether the format is HDF. If so, sniff() and read() get the file already opened (once, for all loaders).
+        versions: list of 'version' attributes of the HDF file handled (None in the list: no version attribute), or None for any.
+        priority: int. Of the loaders that accept a file, higher ones are tried first, so faster loaders should have higher priorities.
+        fallback: bool, only used for files no other loader accepts.
+        capabilities: set of strings.
+            'lazy': read(lazy=True) returns lazy_rows for the signals.
+            'compact': read(compact=True) stores signals in single precision itself (otherwise the schema converts them afterwards).
+            'incremental': get_entry_numbers() and read_new() read just the entries added since the last read.
+            'parallel': safe to run in a worker process (no prompts, no shared state).
+    '''
+    name = ''
+    extensions = None
+    hdf = True
+    versions = None
+    priority = 0
+    fallback = False
+    capabilities = set()
+
+    def accepts(self, fn, file, version):
+        if not(self.extensions is None) and not(os.path.splitext(fn)[1].lower() in self.extensions):
+            return False
+        if(self.hdf and not(self.versions is None) and not(version in self.versions)):
+            return False
+        return self.sniff(fn, file)
+
+    def sniff(self, fn, file):
+        '''A cheap check (no data read) that this loader can read the file. file is the open h5py File for HDF loaders, else None.'''
+        return True
+
+    def read(self, fn, file, lazy=False, compact=False):
+        '''Returns the data_struct of the whole file.'''
+        raise NotImplementedError
+
+    def get_entry_numbers(self, file):
+        '''incremental loaders: the sorted numbers of the entries in the file.'''
+        raise NotImplementedError
+
+    def read_new(self, file, last_entry, lazy=False, compact=False):
+        '''incremental loaders: (data, last_entry) for the entries numbered above last_entry. See fileops.get_new_entries.'''
+        raise NotImplementedError
+
+loaders = []
+
+def register(l):
+    '''Adds a loader. Registering one with the name of an existing loader replaces it.'''
+    global loaders
+    loaders = [ i for i in loaders if i.name != l.name ] + [ l ]
+    return l
+
+def get_version(file):
+    try:
+        return file.attrs['version']
+    except: # no version string. Must be an alpha-version file.
+        return None
+
+def get_loaders(fn, file=None, need=()):
+    '''Returns the loaders that accept fn, best first: those with all capabilities in need, then by priority.'''
+    version = None if file is None else get_version(file)
+    accepted = []
+    for l in loaders:
+        if(l.hdf != (not(file is None))):
+            continue
+        try:
+            if(l.accepts(fn, file, version)):
+                accepted += [ l ]
+        except:
+            continue
+    if(any([ not(l.fallback) for l in accepted ])):
+        accepted = [ l for l in accepted if not(l.fallback) ]
+    return sorted(accepted, key=lambda l: (all([ c in l.capabilities for c in need ]), l.priority), reverse=True)
+
+def is_hdf(fn):
+    '''Whether fn should be opened as an HDF file, i.e. no non-HDF loader claims its extension.'''
+    ext = os.path.splitext(fn)[1].lower()
+    return not(any([ not(l.hdf) and not(l.extensions is None) and ext in l.extensions for l in loaders ]))
+
+def read(fn, lazy=False, compact=False):
+    '''Reads fn with the best loader that accepts it. If a loader fails, the next one is tried (with the file still open).'''
+    need = ('lazy',) if lazy else ()
+    if not(is_hdf(fn)):
+        return _read_with(get_loaders(fn, None, need), fn, None, lazy, compact)
+    with hdf.File(fn, 'r') as file:
+        version = get_version(file)
+        if not(version is None):
+            print(f'Loading file with version string {version}')
+        return _read_with(get_loaders(fn, file, need), fn, file, lazy, compact)
+
+def is_parallel(fn, lazy=False):
+    '''Whether the loader read would use for fn has the 'parallel' capability, i.e. fn can be parsed in a worker process.
+    False if fn can't be opened (it is then read in-process, which raises the error).'''
+    need = ('lazy',) if lazy else ()
+    try:
+        if not(is_hdf(fn)):
+            candidates = get_loaders(fn, None, need)
+        else:
+            with hdf.File(fn, 'r', locking=False) as file:
+                candidates = get_loaders(fn, file, need)
+    except:
+        return False
+    return len(candidates) > 0 and 'parallel' in candidates[0].capabilities
+
+def _read_with(candidates, fn, file, lazy, compact):
+    if(len(candidates) == 0):
+        raise ValueError(f'No loader accepts {fn}')
+    for i, l in enumerate(candidates):
+        try:
+            return l.read(fn, file, lazy=lazy, compact=compact)
+        except:
+            if(i == len(candidates)-1):
+                raise
+            print(f'Could not read {fn} with the {l.name} loader. Falling back to the {candidates[i+1].name} loader.')
+
+def get_incremental(fn, file):
+    '''The best incremental loader for an open file, or None.'''
+    for l in get_loaders(fn, file, ('incremental',)):
+        if('incremental' in l.capabilities):
+            return l
+    return None
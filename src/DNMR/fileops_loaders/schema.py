@@ -0,0 +1,117 @@
+import fnmatch
+
+import numpy as np
+
+from DNMR.fileops_loaders.lazy import lazy_rows, is_shared
+
+# Bump this (and cache.LOADER_VERSION) whenever a field below changes.
+SCHEMA_VERSION = 1
+
+class field():
+    '''A key whose type is known, so loaders convert it once instead of guessing.
+
+    Parameters
+    ----------
+        dtype: the type it is stored with. np.bytes_ means "byte strings, as long as they need to be".
+        units: str, for display only.
+        per: 'entry' (one value per acquisition) or 'point' (a row of datapoints per acquisition).
+        signal: bool, whether it is signal data, which compact mode stores in single precision.
+    '''
+    def __init__(self, dtype, units='', per='entry', signal=False):
+        self.dtype = np.dtype(dtype)
+        self.units = units
+        self.per = per
+        self.signal = signal
+
+    def get_dtype(self, compact=False):
+        if(self.signal and compact):
+            return np.dtype(np.complex64) if self.dtype.kind == 'c' else np.dtype(np.float32)
+        return self.dtype
+
+# Keys as paths into the data_struct. * matches any one name (pulse index, environment device).
+fields = {
+    'reals':                        field(np.float64, 'a.u.', 'point', signal=True),
+    'imags':                        field(np.float64, 'a.u.', 'point', signal=True),
+    'times':                        field(np.float64, 'μs', 'point'),
+    'sample':                       field(np.bytes_),
+    'nucleus':                      field(np.bytes_),
+    'obs_freq':                     field(np.float64, 'MHz'),
+    'ppms_mf':                      field(np.float64, 'Oe'),
+    'ppms_field':                   field(np.float64, 'Oe'),
+    'environment_*':                field(np.float64),
+    'params/acquisition_time':      field(np.float64, 'μs'),
+    'params/pre_acquisition_time':  field(np.float64, 'μs'),
+    'params/post_acquisition_time': field(np.float64, 'ms'),
+    'params/ringdown_time':         field(np.float64, 'μs'),
+    'params/obs_freq':              field(np.float64, 'MHz'),
+    'params/num_scans':             field(np.int64),
+    'params/actual_num_acqs':       field(np.int64),
+    'params/acq_phase_cycle':       field(np.bytes_),
+    'sequence/*/pulse_width':       field(np.float64, 'μs'),
+    'sequence/*/pulse_height':      field(np.float64, '%'),
+    'sequence/*/delay_time':        field(np.float64, 'μs'),
+    'sequence/*/relaxation_time':   field(np.float64, 'μs'), # legacy name of delay_time
+    'sequence/*/phase_cycle':       field(np.bytes_),
+}
+
+def get_field(key):
+    '''Returns the field for a key path (e.g. 'params/obs_freq'), or None if it isn't in the schema.'''
+    if(key in fields):
+        return fields[key]
+    for pattern, f in fields.items():
+        if('*' in pattern and fnmatch.fnmatchcase(key, pattern) and pattern.count('/') == key.count('/')):
+            return f
+    return None
+
+def get_units(key):
+    f = get_field(key)
+    return '' if f is None else f.units
+
+def get_dtype(key, compact=False):
+    '''The dtype key is stored with, or None if it isn't in the schema (or is a string, whose length depends on the file).'''
+    f = get_field(key)
+    if(f is None or f.dtype.itemsize == 0):
+        return None
+    return f.get_dtype(compact)
+
+def infer_array(val):
+    '''The generic path, for keys that aren't in the schema: keep whatever type the file stored.'''
+    return np.array(val)
+
+def to_array(key, val, compact=False):
+    '''Converts the values read for key (a list with one value per entry, or an array) into an array of the declared type, in one conversion.'''
+    f = get_field(key)
+    if(f is None or f.dtype.itemsize == 0): # strings: scalar ones come back as str, so leave them be
+        return infer_array(val)
+    try:
+        return np.asarray(val, dtype=f.get_dtype(compact))
+    except:
+        print(f'WARNING: {key} can not be read as {f.dtype}. Keeping the type it was stored with.')
+        return infer_array(val)
+
+def check_shape(key, val, size):
+    f = get_field(key)
+    if(f is None or not(isinstance(val, (np.ndarray, lazy_rows)))):
+        return
+    if(f.per == 'point' and (val.ndim != 2 or val.shape[0] != size)):
+        print(f'WARNING: {key} has shape {val.shape}, expected ({size}, number of points)')
+
+def apply_schema(ds, compact=False, prefix=''):
+    '''Converts every key of a data_struct (and the ones nested in it) that is in the schema to its declared dtype.
+    Arrays that already have it are not copied, lazy arrays are left alone, and shared rows stay shared.'''
+    for k in list(ds.keys()):
+        if(k == 'size'):
+            continue
+        v = ds[k]
+        key = prefix + str(k)
+        if(hasattr(v, 'keys') and not(isinstance(v, dict))):
+            apply_schema(v, compact, key+'/')
+            continue
+        dtype = get_dtype(key, compact)
+        if(isinstance(v, np.ndarray) and not(dtype is None) and v.dtype != dtype and v.dtype.kind in 'biufc'):
+            if(is_shared(v)):
+                ds[k] = np.broadcast_to(v[:1].astype(dtype), v.shape)
+            else:
+                ds[k] = v.astype(dtype)
+        check_shape(key, ds[k], ds['size'])
+    return ds
@@ -0,0 +1,158 @@
+import re
+
+import numpy as np
+
+from DNMR.fileops_loaders.data_struct import data_struct
+from DNMR.fileops_loaders.registry import loader, register
+from DNMR.fileops_loaders.lazy import lazy_rows, file_rows
+from DNMR.fileops_loaders.schema import get_dtype
+
+# Layout of a Tecmag .tnt file (see "A1 - TNMR File Format.doc" from the TNMR distribution, and pytnt):
+# an 8 byte magic string, then sections, each a (tag, bool, length) header followed by length bytes.
+magic_re = re.compile(b'^TNT1\\.[0-9]{3}$')
+section_header = np.dtype([ ('tag', 'S4'), ('bool', '<u4'), ('length', '<u4') ])
+
+# The first part of the TMAG (acquisition parameters) section, as far as we need it.
+tmag_prefix = np.dtype([
+    ('npts', '<i4', 4),
+    ('actual_npts', '<i4', 4),
+    ('acq_points', '<i4'),
+    ('npts_start', '<i4', 4),
+    ('scans', '<i4'),
+    ('actual_scans', '<i4'),
+    ('dummy_scans', '<i4'),
+    ('repeat_times', '<i4'),
+    ('sadimension', '<i4'),
+    ('samode', '<i4'),
+    ('magnet_field', '<f8'),
+    ('ob_freq', '<f8', 4), # MHz
+    ('base_freq', '<f8', 4),
+    ('offset_freq', '<f8', 4),
+    ('ref_freq', '<f8'),
+    ('NMR_frequency', '<f8'),
+    ('obs_channel', '<i2'),
+    ('space2', 'S42'),
+    ('sw', '<f8', 4),
+    ('dwell', '<f8', 4), # s
+    ('filter', '<f8'),
+    ('experiment_time', '<f8'),
+    ('acq_time', '<f8'), # s
+    ('last_delay', '<f8'), # s
+])
+
+delay_table_re = re.compile(b'de[0-9]+:[0-9]')
+si_prefixes = { 'n': 1e-9, 'u': 1e-6, 'm': 1e-3, 's': 1, 'k': 1e3 }
+
+def read_sections(f):
+    '''Returns { tag: (offset, length) } for every section of the open file f.'''
+    if not(magic_re.match(f.read(8))):
+        raise ValueError(f'{f.name} is not a TNMR file')
+    sections = {}
+    while(True):
+        raw = f.read(section_header.itemsize)
+        if(len(raw) < section_header.itemsize):
+            break
+        h = np.frombuffer(raw, section_header)[0]
+        sections[h['tag'].decode('latin1')] = (f.tell(), int(h['length']))
+        f.seek(int(h['length']), 1)
+    return sections
+
+def read_pascal_string(buf, offset):
+    length = int(np.frombuffer(buf, '<i4', count=1, offset=offset)[0])
+    if(length < 0 or offset + 4 + length > len(buf)):
+        raise IndexError('not a string')
+    return buf[offset+4:offset+4+length].decode('ascii')
+
+def parse_si(s):
+    try:
+        return float(s)
+    except:
+        return float(s[:-1]) * si_prefixes[s[-1]]
+
+def read_delay_tables(buf):
+    '''Finds the delay tables (named deN:M, values with SI suffixes) in the pulse sequence section. Returns { name: values in s }.'''
+    tables = {}
+    for m in delay_table_re.finditer(buf):
+        try:
+            name = read_pascal_string(buf, m.start() - 4)
+            values = read_pascal_string(buf, m.start() + len(name)).split()
+            if(len(values) > 1):
+                tables[name] = np.array([ parse_si(v) for v in values ])
+        except:
+            continue # a match inside something else
+    return tables
+
+def read_tnt(fn: str, lazy=False, compact=False):
+    '''Reads a Tecmag .tnt file without prompting, with the parameters and delay table taken from its header.
+
+    Every acquisition (all of dimensions 2-4 of the TNMR data) becomes one row. The data block is memory-mapped,
+    so rows are only read from disk when they are used. With lazy, reals and imags are lazy_rows instead (see lazy.py).
+    '''
+    with open(fn, 'rb') as f:
+        sections = read_sections(f)
+        f.seek(sections['TMAG'][0])
+        tmag = np.frombuffer(f.read(tmag_prefix.itemsize), tmag_prefix)[0]
+        f.seek(sections['PSEQ'][0])
+        tables = read_delay_tables(f.read())
+
+    dims = tmag['actual_npts'].astype(np.int64)
+    npts = int(dims[0])
+    n = int(np.prod(dims[1:]))
+    offset, length = sections['DATA']
+    if(length != n * npts * 8):
+        raise ValueError(f'DATA section of {fn} is {length} bytes, expected {n*npts*8} for {dims.tolist()} points')
+
+    data = data_struct()
+    data['size'] = n
+    # TNMR stores the data in Fortran order with the points first, so in C order it is (acquisitions, points) already
+    if(lazy):
+        data['reals'] = lazy_rows([ file_rows(fn, offset, '<c8', (n, npts), 'real', get_dtype('reals', compact)) ])
+        data['imags'] = lazy_rows([ file_rows(fn, offset, '<c8', (n, npts), 'imag', get_dtype('imags', compact)) ])
+    else:
+        complexes = np.memmap(fn, dtype='<c8', mode='c', offset=offset, shape=(n, npts))
+        data['reals'] = complexes.real
+        data['imags'] = complexes.imag
+    data['times'] = np.broadcast_to(np.arange(npts)[None,:] * tmag['dwell'][0] * 1e6, (n, npts)) # μs
+
+    params = data_struct()
+    params['acquisition_time'] = np.full(n, tmag['acq_time'] * 1e6) # μs
+    params['post_acquisition_time'] = np.full(n, tmag['last_delay'] * 1e3) # ms
+    params['num_scans'] = np.full(n, int(tmag['scans']))
+    params['obs_freq'] = np.full(n, tmag['ob_freq'][0]) # MHz
+    data['params'] = params
+
+    # The delay table that steps along with the acquisitions is the one with one value per row of dimension 2
+    matching = [ k for k in sorted(tables.keys()) if tables[k].shape[0] == dims[1] ]
+    if(len(matching) > 0):
+        if(len(matching) > 1):
+            print(f'WARNING: {fn} has several delay tables of length {dims[1]} ({matching}). Using {matching[0]}.')
+        delays = np.resize(tables[matching[0]] * 1e6, n) # μs. Repeats over dimensions 3 and 4.
+        data['sequence'] = data_struct({ '0': data_struct({ 'delay_time': delays }) })
+    else:
+        print(f'WARNING: {fn} has no delay table with one value per acquisition ({dims[1]}). Found: { {k: v.shape[0] for k, v in tables.items()} }')
+
+    # Not in the header. Taken from the file name, if it has them.
+    magf = re.search('.*?(?P<magfield>\\d+([.]\\d+)?)Oe.*?', fn)
+    freq = re.search('.*?(?P<freq>\\d+([.]\\d+)?)MHz.*?', fn)
+    if(magf):
+        data['ppms_mf'] = np.broadcast_to(np.array([float(magf['magfield'])]), (data['size'],))
+    if(freq):
+        data['obs_freq'] = np.broadcast_to(np.array([float(freq['freq'])]), (data['size'],))
+
+    return data
+
+class tnt_loader(loader):
+    '''Tecmag .tnt files. Needs no input, so it can run in worker processes.'''
+    name = 'tnt'
+    extensions = [ '.tnt' ]
+    hdf = False
+    capabilities = { 'lazy', 'compact', 'parallel' }
+
+    def sniff(self, fn, file):
+        with open(fn, 'rb') as f:
+            return not(magic_re.match(f.read(8)) is None)
+
+    def read(self, fn, file, lazy=False, compact=False):
+        return read_tnt(fn, lazy, compact)
+
+register(tnt_loader())
@@ -3,9 +3,12 @@ import h5py as hdf
 import traceback
 import re
 
-from DNMR.fileops_loaders.data_struct import data_struct, hdf_to_dict
+from DNMR.fileops_loaders.data_struct import data_struct, hdf_to_dict, concatenate_structs
+from DNMR.fileops_loaders.schema import to_array, apply_schema
+from DNMR.fileops_loaders.registry import loader, register
 
-def read_hdf_v100(file):
+def read_hdf_v100(file, compact=False):
+    '''Reads a version-100 file entry by entry. compact stores signal data in single precision (see schema.py).'''
     toplevel = file.keys()
     points = []
     point_indices = []
@@ -87,25 +90,14 @@ def read_hdf_v100(file):
                     parse_dataset_into_struct(ival, key, data, index, key_to_write=get_formatted_key(ikey + '/' + key))
         
     for key, val in data.items():
+        if(key == 'size'):
+            continue
         # check if we can turn it into a dict, then numpy array
         try:
-            ds = data_struct(hdf_to_dict(val[0]))
-            for i in range(1, len(val)):
-                ds += data_struct(hdf_to_dict(val[i]))
-            data[key] = ds
+            data[key] = apply_schema(concatenate_structs([ data_struct(hdf_to_dict(v)) for v in val ]), compact, key+'/')
         except:
             try:
-                arr = np.array(val)
-                try:
-                    arr_f = arr.astype(float)
-                    arr_i = arr.astype(int)
-                    if(arr_i == arr_f):
-                        arr = arr_i
-                    else:
-                        arr = arr_f
-                except:
-                    pass
-                data[key] = arr
+                data[key] = to_array(key, val, compact) # known keys get their declared type, others keep the stored one
             except:
                 pass
     
@@ -117,4 +109,16 @@ def read_hdf_v100(file):
     #print('#' * 100)
     #print(data)
     
-    return data
\ No newline at end of file
+    return data
+
+class v100_loader(loader):
+    '''Reads entries one at a time, so it copes with entries that don't share one layout.'''
+    name = 'v100'
+    versions = [ '100' ]
+    priority = 10
+    capabilities = { 'compact', 'parallel' }
+
+    def read(self, fn, file, lazy=False, compact=False):
+        return read_hdf_v100(file, compact)
+
+register(v100_loader())
@@ -0,0 +1,244 @@
+import numpy as np
+import h5py as hdf
+from h5py import h5d, h5g, h5s, h5t
+import re
+
+from DNMR.fileops_loaders.data_struct import data_struct
+from DNMR.fileops_loaders.lazy import lazy_rows, hdf_rows
+from DNMR.fileops_loaders.schema import get_dtype
+from DNMR.fileops_loaders.registry import loader, register
+
+special_group_keys = [ 'detectors', 'environment' ]
+lazy_keys = [ 'reals', 'imags' ] # read on demand with lazy=True
+
+def strip_key(k):
+    if(k[:5] == 'tnmr_'):
+        return k[5:]
+    return k
+
+def get_formatted_key(group, k):
+    '''Same naming as read_hdf_v100: children of environment/detector groups get the group name prepended, everything else is flattened.'''
+    ks = strip_key(k)
+    for i in special_group_keys:
+        if i in group:
+            return i+'_'+ks
+    return ks
+
+def get_sorted_entries(file):
+    '''Returns the names of all entryN groups in file, sorted by N.'''
+    points = []
+    point_numbers = []
+    for i in file.keys():
+        m = re.match('entry(?P<index>[0-9]+)', i)
+        if not(m is None):
+            points += [ m[0] ]
+            point_numbers += [ int(m['index']) ]
+    sorted_indices = np.argsort(point_numbers, kind='stable')
+    return [ points[i] for i in sorted_indices ], [ point_numbers[i] for i in sorted_indices ]
+
+class leaf():
+    '''A single dataset of the schema, and the preallocated array it is read into.
+
+    stacked leaves are the "top-level" keys (reals, environment_*, ...), which get one row per entry.
+    Other leaves live in nested groups (params, sequence) and are concatenated along their first axis, like hdf_to_dict + data_struct.__add__ would do.
+
+    Datasets stored contiguously are not read one by one: only their file offsets are collected, and finish() copies all of them out of a memory map of the file in one pass.
+    '''
+    def __init__(self, path, keys, shape, dtype, stacked):
+        self.path = path # relative to the entry group
+        self.parent = '/'.join(path.split('/')[:-1])
+        self.name = path.split('/')[-1].encode('utf-8')
+        self.keys = keys # where it goes in the data_struct
+        self.shape = shape
+        self.row_shape = shape if len(shape) > 0 else (1,)
+        self.file_dtype = dtype
+        self.dtype = dtype
+        self.stacked = stacked
+        self.decode = stacked and len(shape) == 0 and dtype.kind == 'S' # read_hdf_v100 turns scalar byte strings into str
+        self.lowlevel = dtype.kind in 'biufcS'
+        self.nbytes = int(np.prod(self.row_shape)) * dtype.itemsize
+        self.rows = None
+        self.lazy = False
+        self.declared = False
+
+    def declare(self, dtype):
+        '''Reads into the dtype the schema declares for this key. HDF5 (or finish()) converts, so there is no need to widen.'''
+        self.dtype = dtype
+        self.declared = True
+
+    def allocate(self, n, use_offsets):
+        self.rows = np.zeros((n,) + self.row_shape, dtype=self.dtype if self.lowlevel else object)
+        self.offsets = np.full(n, -1, dtype=np.int64)
+        self.use_offsets = use_offsets and self.lowlevel
+        self.mtype = h5t.py_create(self.dtype) if self.lowlevel else None
+        # HDF5 refuses the read if the element counts of the memory and file spaces differ, which is cheaper than checking shapes ourselves
+        self.mspace = h5s.create_simple(self.row_shape)
+
+    def widen(self, dtype):
+        '''A later entry stored this key with a wider type (int->float, longer strings, ...). Promote, so nothing is truncated.'''
+        self.dtype = np.result_type(self.dtype, dtype)
+        self.rows = self.rows.astype(self.dtype)
+        self.mtype = h5t.py_create(self.dtype)
+
+    def read(self, parent_id, entry, i):
+        dsid = h5d.open(parent_id, self.name)
+        if(self.lazy): # only check that it fits the schema; the rows are read later
+            if(dsid.shape != self.shape):
+                raise ValueError(f'Shape of {entry}/{self.path} is {dsid.shape}, expected {self.shape} from the first entry')
+            return
+        if not(self.lowlevel):
+            if(dsid.shape != self.shape):
+                raise ValueError(f'Shape of {entry}/{self.path} is {dsid.shape}, expected {self.shape} from the first entry')
+            self.rows[i] = np.reshape(hdf.Dataset(dsid)[()], self.row_shape)
+            return
+        dtype = dsid.dtype
+        if(self.use_offsets and dtype == self.file_dtype):
+            offset = dsid.get_offset() # None unless contiguous and allocated
+            if not(offset is None):
+                if(dsid.get_storage_size() != self.nbytes):
+                    raise ValueError(f'Size of {entry}/{self.path} does not match the first entry')
+                self.offsets[i] = offset
+                return
+        if(dtype != self.dtype and not(self.declared) and np.result_type(self.dtype, dtype) != self.dtype):
+            self.widen(dtype)
+        dsid.read(self.mspace, h5s.ALL, self.rows[i], mtype=self.mtype)
+
+    def finish(self, mm):
+        rows = np.nonzero(self.offsets >= 0)[0]
+        if(rows.shape[0] > 0):
+            raw = np.empty((rows.shape[0], self.nbytes), dtype=np.uint8)
+            for j, o in enumerate(self.offsets[rows]):
+                raw[j] = mm[o:o+self.nbytes]
+            self.rows[rows] = raw.view(self.file_dtype).reshape((rows.shape[0],) + self.row_shape)
+        array = self.rows if self.stacked else np.reshape(self.rows, (-1,) + self.row_shape[1:])
+        if(self.decode):
+            array = np.char.decode(array, 'utf-8')
+        return array
+
+def get_schema(entry):
+    '''Walks one entry group and returns its leaves, plus the nested groups and leaves in file order (groups as key tuples), so the output keys come out in the same order as read_hdf_v100.'''
+    leaves = []
+    order = []
+
+    def walk_nested(g, path, keys):
+        order.append(keys)
+        for key, val in g.items():
+            if(isinstance(val, hdf.Group)):
+                walk_nested(val, path+'/'+key, keys+(key,))
+            else:
+                leaves.append(leaf(path+'/'+key, keys+(key,), val.shape, val.dtype, False))
+                order.append(leaves[-1])
+
+    def add_toplevel(val, path, key):
+        if(isinstance(val, hdf.Group)):
+            walk_nested(val, path, (key,))
+        else:
+            leaves.append(leaf(path, (key,), val.shape, val.dtype, True))
+            order.append(leaves[-1])
+
+    for ikey, ival in entry.items():
+        if(isinstance(ival, hdf.Dataset)):
+            add_toplevel(ival, ikey, strip_key(ikey))
+        elif(isinstance(ival, hdf.Group)):
+            for key, val in ival.items():
+                add_toplevel(val, ikey+'/'+key, get_formatted_key(ikey, key))
+    return leaves, order
+
+def read_hdf_v100_columnar(file, entries=None, lazy=False, compact=False):
+    '''Reads a version-100 file into the same data_struct as read_hdf_v100.
+
+    The layout of the first entry is taken as the schema for the whole file. Every dataset is then read straight into its row of a preallocated array, so the cost per entry is only the HDF5 reads themselves.
+    Raises (KeyError/ValueError) if an entry does not follow the schema; get_data falls back to read_hdf_v100 in that case.
+
+    Parameters
+    ----------
+        file: an open h5py File.
+        entries: optional list of entry group names to read, in order. Defaults to all of them.
+        lazy: if True, reals and imags are not read here, but returned as lazy_rows that read acquisitions from the file when they are used.
+        compact: if True, signal data is stored in single precision (see schema.py).
+    '''
+    if(entries is None):
+        entries = get_sorted_entries(file)[0]
+    n = len(entries)
+    leaves, order = get_schema(file[entries[0]])
+
+    # Offsets are only meaningful for a plain file on disk without a user block
+    mm = None
+    if(file.driver == 'sec2' and file.userblock_size == 0):
+        mm = np.memmap(file.filename, dtype=np.uint8, mode='r')
+
+    parents = []
+    for l in leaves:
+        dtype = get_dtype('/'.join(l.keys), compact)
+        if not(dtype is None) and l.lowlevel and l.file_dtype.kind in 'biufc':
+            l.declare(dtype)
+        l.lazy = lazy and l.stacked and l.keys[0] in lazy_keys and len(l.shape) > 0 and l.dtype.kind in 'iufc'
+        l.allocate(1 if l.lazy else n, not(mm is None))
+        if not(l.parent in parents):
+            parents += [ l.parent ]
+    parent_names = [ p.encode('utf-8') for p in parents ]
+    # Opening every dataset by its full path walks the (huge) root group each time, so open each group once per entry instead
+    for i in range(n):
+        entry_id = h5g.open(file.id, entries[i].encode('utf-8'))
+        parent_ids = { p: (entry_id if p == '' else h5g.open(entry_id, pn)) for p, pn in zip(parents, parent_names) }
+        for l in leaves:
+            l.read(parent_ids[l.parent], entries[i], i)
+
+    data = data_struct()
+    for node in order:
+        keys = node if isinstance(node, tuple) else node.keys
+        ds = data
+        for k in keys[:-1]:
+            ds = ds[k]
+        if(isinstance(node, tuple)):
+            if not(keys[-1] in ds.keys()):
+                ds[keys[-1]] = data_struct()
+        elif(node.lazy):
+            ds[keys[-1]] = node
+        else:
+            ds[keys[-1]] = node.finish(mm)
+    data['size'] = n
+
+    scale = None
+    if('params' in data.keys() and 'actual_num_acqs' in data.params.keys()):
+        print('Normalising signals from number of acquisitions')
+        scale = data.params.actual_num_acqs
+    for k in lazy_keys:
+        if(k in data.keys() and isinstance(data[k], leaf)):
+            l = data[k]
+            dtype = l.dtype if (scale is None or l.declared) else (np.ones(1, l.dtype) / np.ones(1, scale.dtype)).dtype
+            data[k] = lazy_rows([ hdf_rows(file.filename, entries, l.path, l.shape, dtype, scale) ])
+        elif(k in data.keys() and not(scale is None)):
+            if(data[k].dtype.kind in 'fc'): # keep the declared precision
+                data[k] /= scale[:,None]
+            else:
+                data[k] = data[k] / scale[:,None]
+
+    return data
+
+class v100_columnar_loader(loader):
+    name = 'v100 columnar'
+    versions = [ '100' ]
+    priority = 20
+    capabilities = { 'lazy', 'compact', 'incremental', 'parallel' }
+
+    def read(self, fn, file, lazy=False, compact=False):
+        return read_hdf_v100_columnar(file, lazy=lazy, compact=compact)
+
+    def get_entry_numbers(self, file):
+        return get_sorted_entries(file)[1]
+
+    def read_new(self, file, last_entry, lazy=False, compact=False):
+        entries, numbers = get_sorted_entries(file)
+        new = [ (e, n) for e, n in zip(entries, numbers) if n > last_entry ]
+        for attempt in [ new, new[:-1] ]: # the newest entry may still be being written
+            if(len(attempt) == 0):
+                break
+            try:
+                data = read_hdf_v100_columnar(file, entries=[ e for e, n in attempt ], lazy=lazy, compact=compact)
+                return data, attempt[-1][1]
+            except:
+                continue
+        return None, last_entry
+
+register(v100_columnar_loader())
@@ -1,11 +1,14 @@
 import traceback
+import os
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import QDoubleValidator
 import numpy as np
 
 import DNMR.fileops as fileops
+import DNMR.core.precision as core_precision
+from DNMR.worker import Worker
 
 class FitParameterWidget(QWidget):
     def __init__(self, label, units, parent=None, xplot=False, yplot=False):
@@ -19,6 +22,8 @@ class FitParameterWidget(QWidget):
         
         self.checkbox_fix    = QCheckBox('Fix?')
         self.checkbox_fix.stateChanged.connect(self.update_fixed)
+        self.checkbox_share  = QCheckBox('Share?')
+        self.checkbox_share.setToolTip('Fit one value for all channels, when fitting them together')
         
         self.label_parameter = QLabel(f'{self.label}=')
         self.label_units = QLabel(f'{self.units}')
@@ -28,6 +33,7 @@ class FitParameterWidget(QWidget):
         
         li  = QHBoxLayout()
         li.addWidget(self.checkbox_fix)
+        li.addWidget(self.checkbox_share)
         li.addWidget(self.label_parameter)
         li.addWidget(self.lineedit_value)
         li.addWidget(self.label_units)
@@ -39,6 +45,9 @@ class FitParameterWidget(QWidget):
         
     def is_fixed(self):
         return self.checkbox_fix.isChecked()
+
+    def is_shared(self):
+        return self.checkbox_share.isChecked()
         
     def get_value(self, units=False):
         if(units):
@@ -93,16 +102,20 @@ class FileInfoWidget(QWidget):
         if(length is None):
             length = d['size']
         for i in list(d.keys()):
+            units = fileops.get_units(prefix+str(i))
+            units = f' [{units}]' if units else ''
             if(isinstance(d[i], fileops.data_struct)):
                 self.update_items(d[i], length=length, prefix=prefix+str(i)+'/')
             elif(isinstance(d[i], np.ndarray)):
                 if(d[i].ndim == 1):
                     s = '\n'.join([ f'\t{j}: ' + str(d[i][j]) for j in range(length) ])
-                    self.listview_docinfo.addItem(f'{prefix+i} (array, len={d[i].shape[0]})='+'{\n'+s+'\n}')
+                    self.listview_docinfo.addItem(f'{prefix+i}{units} (array, len={d[i].shape[0]})='+'{\n'+s+'\n}')
                 elif(d[i].ndim == 2):
                     # first index is scan index, second is datapoint
                     s = '\n'.join([ f'\t{j}: ' + str(d[i][j]) for j in range(length) ])
-                    self.listview_docinfo.addItem(f'{prefix+i} (array, len={d[i].shape[0]}x{d[i].shape[1]})='+'{\n'+s+'\n}')
+                    self.listview_docinfo.addItem(f'{prefix+i}{units} (array, len={d[i].shape[0]}x{d[i].shape[1]})='+'{\n'+s+'\n}')
+            elif(isinstance(d[i], fileops.lazy_rows)):
+                self.listview_docinfo.addItem(f'{prefix+i}{units} (lazy array, len={d[i].shape[0]}x{d[i].shape[1]}, read from the file when used)')
             else:
                 self.listview_docinfo.addItem(f'{prefix+i}={d[i]}')
                 
@@ -245,6 +258,29 @@ class FileSelectionWidget(QWidget):
         self.label_index = QLabel('Index:')
         self.spinbox_index = QSpinBox()
         self.checkbox_holdplots = QCheckBox('Hold plots')
+        self.label_workers = QLabel('Load workers:')
+        self.spinbox_workers = QSpinBox()
+        self.spinbox_workers.setRange(1, max(1, os.cpu_count() or 1))
+        self.spinbox_workers.setValue(1) # 1 = load in this process, one file at a time
+        self.progressbar_load = QProgressBar()
+        self.progressbar_load.setRange(0, 1)
+        self.progressbar_load.setValue(0)
+        self.checkbox_lazy = QCheckBox('Low memory (read FIDs on demand)')
+        self.checkbox_compact = QCheckBox('Single precision FIDs')
+        self.checkbox_single = QCheckBox('Single precision processing')
+        self.checkbox_single.setToolTip('Filter, phase and transform in single precision (integrals and fits stay in double)')
+        self.checkbox_single.setChecked(core_precision.get_default_precision() == 'single')
+        self.checkbox_autorefresh = QCheckBox('Auto-refresh (s):')
+        self.checkbox_autorefresh.checkStateChanged.connect(self.update_autorefresh)
+        self.spinbox_autorefresh = QSpinBox()
+        self.spinbox_autorefresh.setRange(1, 3600)
+        self.spinbox_autorefresh.setValue(60)
+        self.spinbox_autorefresh.valueChanged.connect(self.update_autorefresh)
+        self.timer_autorefresh = QTimer()
+        self.timer_autorefresh.timeout.connect(self.refresh)
+        self.worker_load = Worker(self) # reads files off the GUI thread, one read at a time (see read_files)
+        self.worker_load.progress.connect(lambda f: self.progressbar_load.setValue(round(f * self.progressbar_load.maximum())))
+        self.worker_load.busy.connect(self.set_loading)
         self.quickinfo_envinronment = QuickInfoWidget()
         self.sequence_info = SequenceWidget()
 
@@ -258,9 +294,21 @@ class FileSelectionWidget(QWidget):
         l2 = QHBoxLayout()
         l2.addWidget(self.label_channel)
         l2.addWidget(self.spinbox_channel)
+        l3 = QHBoxLayout()
+        l3.addWidget(self.label_workers)
+        l3.addWidget(self.spinbox_workers)
         l0.addLayout(l)
         l0.addLayout(l2)
+        l4 = QHBoxLayout()
+        l4.addWidget(self.checkbox_autorefresh)
+        l4.addWidget(self.spinbox_autorefresh)
+        l0.addLayout(l3)
+        l0.addLayout(l4)
         l0.addWidget(self.checkbox_holdplots)
+        l0.addWidget(self.checkbox_lazy)
+        l0.addWidget(self.checkbox_compact)
+        l0.addWidget(self.checkbox_single)
+        l0.addWidget(self.progressbar_load)
         l_info = QHBoxLayout()
         self.quickinfo_envinronment.setSizePolicy(QSizePolicy.Policy.Maximum,QSizePolicy.Policy.Maximum)
         l_info.addWidget(self.quickinfo_envinronment)
@@ -278,18 +326,35 @@ class FileSelectionWidget(QWidget):
         self._fn = [[]] # for all channels
         self.data = {}
         self._data = [{}] # for all channels
+        self._tails = [[]] # for all channels: the last entry number read from each file, or None if the file can't be read incrementally
         
         self.infodialogs = []
 
         self.callbacks = [ lambda: self.quickinfo_envinronment.update_items(self.fn, self.data, self.spinbox_index.value()) ]
         self.callbacks += [ lambda: self.sequence_info.update_items(self.data, self.spinbox_index.value()) ]
+        self.append_callbacks = [] # run instead of callbacks when acquisitions are appended to the channel on screen (see refresh)
         self.spinbox_index.valueChanged.connect(self.callback)
         self.spinbox_channel.valueChanged.connect(self.channel_callback)
+        self.checkbox_single.stateChanged.connect(self.callback)
     
+    def get_channels(self):
+        '''The data_structs of every channel with data loaded, as { channel: data }.'''
+        channels = {}
+        for ch, data in enumerate(self._data):
+            try:
+                if(data['size'] > 0):
+                    channels[ch] = data
+            except:
+                continue
+        return channels
+
     def channel_callback(self):
         while(len(self._fn) <= self.spinbox_channel.value()):
             self._fn += [[]]
             self._data += [fileops.data_struct()]
+            self._tails += [[]]
+        if(isinstance(self.data, fileops.data_struct)):
+            fileops.release_rows(self.data) # only the channel on screen keeps its FIDs in memory
         self.fn = self._fn[self.spinbox_channel.value()]
         self.data = self._data[self.spinbox_channel.value()]
         if(len(self.fn) > 0):
@@ -302,7 +367,43 @@ class FileSelectionWidget(QWidget):
         for i in self.callbacks:
             i()
 
+    def append_callback(self):
+        for i in self.append_callbacks:
+            i()
+
+    def read_files(self, fns_list, on_done):
+        '''Reads each list of files in fns_list (the files of a channel) on the load worker, then calls on_done([ (data, tails) ])
+        on the GUI thread, with one pair per list. The controls that would start another read are disabled meanwhile (see set_loading).'''
+        fns = [ fn for l in fns_list for fn in l ]
+        self.progressbar_load.setRange(0, len(fns))
+        self.progressbar_load.setValue(0)
+        self.progressbar_load.setFormat('Loaded %v/%m files')
+        self.worker_load.submit(self._read_files, fns_list, self.spinbox_workers.value(), self.checkbox_lazy.isChecked(), self.checkbox_compact.isChecked(), on_done=on_done)
+
+    def _read_files(self, progress, fns_list, workers, lazy, compact):
+        fns = [ fn for l in fns_list for fn in l ]
+        all_data = fileops.get_data_many(fns, workers=workers, progress=lambda done, total: progress(done / total), lazy=lazy, compact=compact)
+        results = []
+        for l in fns_list:
+            data, all_data = all_data[:len(l)], all_data[len(l):]
+            results += [ (fileops.concatenate_structs(data), self.get_tails(l, data)) ]
+        return results
+
+    def set_loading(self, loading):
+        '''Disables what would start another read while the load worker reads, and pauses the auto-refresh.'''
+        for w in [ self.button_load, self.spinbox_workers, self.checkbox_lazy, self.checkbox_compact, self.checkbox_autorefresh, self.spinbox_autorefresh ]:
+            w.setEnabled(not(loading))
+        if(loading):
+            self.timer_autorefresh.stop()
+        else:
+            self.update_autorefresh()
+
     def load_files(self, fns):
+        '''Reads fns in the background, into the first empty channel from the one on screen (see loaded).'''
+        if(len(fns) > 0):
+            self.read_files([ fns ], lambda results: self.loaded(fns, *results[0]))
+
+    def loaded(self, fns, big_data, tails):
         try:
             newch = self.spinbox_channel.value()
             try: # just in case the channel hasn't been made yet.
@@ -310,16 +411,12 @@ class FileSelectionWidget(QWidget):
                     newch += 1
             except:
                 pass # we found an empty spot!
-            big_data = fileops.get_data(fns[0])
-            if(len(fns) > 1):
-                for fn in fns[1:]:
-                    data = fileops.get_data(fn)
-                    big_data = big_data + data
             self.spinbox_channel.setValue(newch)
-            self.fn = fns # above lines will throw exceptions if anything bad happens, so if anything bad happens, we want to preserve the previous file being loaded
+            self.fn = fns # a read that failed never gets here, so the previous files stay loaded
             self.data = big_data
             self._fn[newch] = self.fn
             self._data[newch] = self.data
+            self._tails[newch] = tails
             self.spinbox_index.setRange(0, self.data['size']-1)
             self.label_index.setText(f'Index (/{self.data["size"]-1}, 0-indexed):')
             self.spinbox_index.setValue(0)
@@ -327,6 +424,98 @@ class FileSelectionWidget(QWidget):
         except:
             traceback.print_exc()
 
+    def get_tails(self, fns, all_data):
+        '''Finds the last entry number read from each file. New entries are always numbered higher, so the first data['size'] entries listed now are exactly the ones that were read.'''
+        tails = []
+        for fn, data in zip(fns, all_data):
+            try:
+                numbers = fileops.get_entry_numbers(fn)
+                tails += [ None if numbers is None else numbers[data['size']-1] ]
+            except:
+                tails += [ None ]
+        return tails
+
+    def refresh_channel(self, ch):
+        '''Reads the entries written to a channel's files since they were loaded, and appends them to the channel's data.
+        Only the new entries are parsed, and the usual append (to the last file) takes time proportional to them alone:
+        the rows are appended into buffers with room to grow (see fileops.extend_struct), and only the new rows are processed
+        (see pipeline.set_data). Returns True if anything was added, or None if the channel has to be read again (see refresh).'''
+        fns = self._fn[ch]
+        tails = self._tails[ch]
+        changed = []
+        for k, (fn, last) in enumerate(zip(fns, tails)):
+            if(last is None):
+                continue
+            try:
+                data, new_last = fileops.get_new_entries(fn, last, lazy=self.checkbox_lazy.isChecked(), compact=self.checkbox_compact.isChecked())
+            except:
+                traceback.print_exc()
+                continue
+            if not(data is None):
+                changed += [ (k, data, new_last) ]
+        if(len(changed) == 0):
+            return False
+
+        if(len(changed) > 1 or changed[0][0] != len(fns)-1): # new rows would land in the middle of the channel. It is read again instead.
+            return None
+        # the usual case: the last (or only) file of the channel is still being written
+        old = self._data[ch]
+        new = changed[0][1]
+        for key in ['phases', 'peak_locations']: # per-acquisition settings from the tabs. New acquisitions get the latest value.
+            if(key in old.keys()):
+                new[key] = np.full(new['size'], old[key][-1])
+        self._data[ch] = fileops.extend_struct(old, new)
+        tails[-1] = changed[0][2]
+        print(f'Channel {ch} now has {self._data[ch]["size"]} acquisitions')
+        self.show_channel_data(ch)
+        return True
+
+    def show_channel_data(self, ch):
+        '''Shows a channel's data if it is the channel on screen, after acquisitions were added to it.'''
+        if(ch == self.spinbox_channel.value()):
+            self.data = self._data[ch]
+            self.spinbox_index.setRange(0, self.data['size']-1)
+            self.label_index.setText(f'Index (/{self.data["size"]-1}, 0-indexed):')
+            if(hasattr(self.data, 'extends')):
+                self.append_callback()
+            else:
+                self.callback()
+
+    def refresh(self):
+        '''Appends new entries to every channel. Returns True if the current channel changed (its callbacks have then already been run).
+        Channels that have to be read again are read in the background, and shown when that is done. Nothing is done while files are read.'''
+        if(self.worker_load.is_busy()):
+            return False
+        current_changed = False
+        rereads = []
+        for ch in range(len(self._fn)):
+            if(len(self._fn[ch]) == 0):
+                continue
+            try:
+                changed = self.refresh_channel(ch)
+                if(changed is None):
+                    rereads += [ ch ]
+                elif(changed and ch == self.spinbox_channel.value()):
+                    current_changed = True
+            except:
+                traceback.print_exc()
+        if(len(rereads) > 0):
+            self.read_files([ self._fn[ch] for ch in rereads ], lambda results: self.reread(rereads, results))
+        return current_changed
+
+    def reread(self, chs, results):
+        for ch, (data, tails) in zip(chs, results):
+            self._data[ch] = data
+            self._tails[ch] = tails
+            print(f'Channel {ch} now has {self._data[ch]["size"]} acquisitions')
+            self.show_channel_data(ch)
+
+    def update_autorefresh(self):
+        if(self.checkbox_autorefresh.isChecked()):
+            self.timer_autorefresh.start(self.spinbox_autorefresh.value() * 1000)
+        else:
+            self.timer_autorefresh.stop()
+
     def open_file(self):
         try:
             fns = self.filedialog.getOpenFileNames()[0]
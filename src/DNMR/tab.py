@@ -3,13 +3,20 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtWidgets import *
 
 import traceback
+import numpy as np
 import pandas as pd
 
+from DNMR.worker import Worker, WorkerProgressWidget
+
 class Tab(QWidget):
+    background_points = 1 << 21 # redraw data with more points than this in the background (see prepare)
+    prepared_nodes = [] # names of the pipeline nodes plot_logic reads, upstream first
+    shows_all_acquisitions = True # False for tabs showing only the acquisition at the index, which acquisitions appended don't change
+
     def __init__(self, data_widgets, name, parent=None):
         super(Tab, self).__init__(parent)
         
@@ -21,29 +28,141 @@ class Tab(QWidget):
         self.data_widgets[name] = self
         
         self._name = name
+        self.stale = True # something it shows may have changed since it was last drawn
+        self._update_scheduled = False
+
+        self.worker = Worker(self) # for redraws; tabs can add more (e.g. for fits) with new_worker
+        self.workers = [ self.worker ]
+        self.progress = WorkerProgressWidget([self.worker])
 
         # layout stuff
         layout = QVBoxLayout()
         upper = self.generate_layout()
         if not(upper is None):
             layout.addLayout(upper)
+        layout.addWidget(self.progress)
         layout.addWidget(self.toolbar)
         layout.addWidget(self.canvas)
         self.setLayout(layout)
 
         self.ax = self.fig.add_subplot(111)
 
+        self.pipeline = data_widgets['pipeline'] # the processing shared by all tabs (core/graph.py)
         self.fileselector = data_widgets['fileselector'] # Keep at bottom - cannot be used until file is read!
         self.fileselector.callbacks += [self.update]
+        self.fileselector.append_callbacks += [self.rows_appended]
 
     def generate_layout(self):
         print(f'GENERATE_LAYOUT ({self._name})')
         return None
     
+    def new_worker(self):
+        '''A Worker for this tab's long jobs, shown in its progress bar.'''
+        worker = Worker(self)
+        self.workers += [ worker ]
+        self.progress.add_worker(worker)
+        return worker
+
+    def cancel_jobs(self):
+        '''Cancels the redraw and every other job of this tab still running: their results would be out of date.'''
+        for w in self.workers:
+            w.cancel()
+
+    def get_prepared_nodes(self):
+        '''The pipeline nodes to compute before plot_logic (by default, prepared_nodes). Called on the GUI thread.'''
+        return [ getattr(self.pipeline, n) for n in self.prepared_nodes ]
+
+    def prepare(self, progress, nodes):
+        '''Computes nodes, so that plot_logic only has to draw. Runs on a worker thread for large data, so touch no widgets here.
+        progress(fraction) raises worker.cancelled once the redraw is superseded, so the nodes left are skipped.'''
+        for i in range(len(nodes)):
+            progress(i/len(nodes))
+            nodes[i].get()
+
+    def set_parameters(self):
+        '''Passes the settings of this tab's widgets on to self.pipeline. Runs on every update(), shown or not, so compute nothing here.'''
+        pass
+
     def update(self):
+        '''Asks for a redraw. Only the tab on screen is redrawn, the others are marked stale and redrawn once they are shown (see show_tab).
+        Every request made in one turn of the event loop (the file selector's callbacks, slider drags, key repeat) gives one redraw.'''
+        self.set_pipeline()
+        for tab in self.get_tabs(): # the pipeline is shared, so what the others show (or are fitting) may have changed too
+            tab.cancel_jobs()
+            tab.stale = True
+        if(self.is_current()):
+            self.schedule_update()
+
+    def rows_appended(self):
+        '''Called when acquisitions were appended to the data on screen (FileSelectionWidget.refresh). Only tabs showing all
+        acquisitions need redrawing; the pipeline processes just the new ones when a tab next passes it the data.'''
+        if(self.shows_all_acquisitions):
+            self.cancel_jobs()
+            self.redraw()
+
+    def redraw(self):
+        '''Asks for a redraw of this tab alone, with nothing in the pipeline changed (e.g. to show a fit's result).'''
+        self.stale = True
+        if(self.is_current()):
+            self.schedule_update()
+
+    def update_now(self):
+        '''Redraws right away, e.g. before using self.data.'''
         print(f'UPDATE ({self._name})')
+        self.worker.cancel()
+        self.set_pipeline()
+        self.stale = False
         self.plot()
 
+    def update_in_background(self):
+        '''Redraws after running prepare on a worker thread, keeping the window responsive.'''
+        print(f'UPDATE IN BACKGROUND ({self._name})')
+        self.set_pipeline()
+        def done(result):
+            self.stale = False
+            self.plot()
+        self.worker.submit(self.prepare, self.get_prepared_nodes(), on_done=done)
+
+    def set_pipeline(self):
+        if not(self.fileselector.fn == ''):
+            self.pipeline.set_precision('single' if self.fileselector.checkbox_single.isChecked() else 'double')
+            self.pipeline.set_data(self.fileselector.data, self.fileselector.spinbox_index.value())
+            self.set_parameters()
+
+    def is_large(self):
+        try:
+            return int(np.prod(self.fileselector.data['reals'].shape)) > self.background_points
+        except: # nothing loaded (in this channel)
+            return False
+
+    def schedule_update(self):
+        if not(self._update_scheduled):
+            self._update_scheduled = True
+            QTimer.singleShot(0, self._run_scheduled_update)
+
+    def _run_scheduled_update(self):
+        self._update_scheduled = False
+        if(self.stale and self.is_current()):
+            if(self.is_large()):
+                self.update_in_background()
+            else:
+                self.update_now()
+
+    def show_tab(self):
+        '''Called when the tab is brought on screen: redraws it if it is stale.'''
+        if(self.stale):
+            self.schedule_update()
+
+    def is_current(self):
+        '''Whether this tab is the one on screen in its QTabWidget (or isn't in one).'''
+        stack = self.parentWidget()
+        if(isinstance(stack, QStackedWidget)):
+            return stack.currentWidget() is self
+        return True
+
+    def get_tabs(self):
+        return [ w for w in self.data_widgets.values() if isinstance(w, Tab) ]
+
     def plot_logic(self):
         print(f'UNIMPLEMENTED PLOT_LOGIC ({self._name})')
         pass
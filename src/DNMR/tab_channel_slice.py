@@ -10,11 +10,14 @@ from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as Navigation
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
+import DNMR.core as core
 from DNMR.miniwidgets import *
 from DNMR.tab import Tab
 from DNMR.fileops import data_struct
 
 class TabChannelSlice(Tab):
+    prepared_nodes = ['load', 'filter', 'window', 'phase', 'align', 'fft', 'freq', 'cumulative', 'integrate']
+
     def __init__(self, data_widgets, parent=None):
         super(TabChannelSlice, self).__init__(data_widgets, 'tab_channelslice', parent)
         
@@ -78,24 +81,13 @@ class TabChannelSlice(Tab):
             self.combobox_labelling.setCurrentLabel(current_item)
 
     def plot_logic(self):
-        freq = self.data_widgets['tab_ft'].data[0]
-        ft   = self.data_widgets['tab_ft'].data[1]
+        freq = self.pipeline.freq.get()
+        ft   = self.pipeline.fft.get()
         real = np.real(ft)
-        try:
-            del_times = self.fileselector.data.sequence['0'].delay_time
-        except:
-            del_times = self.fileselector.data.sequence['0'].relaxation_time # Legacy
-
-        integrations = np.zeros(real.shape[0])
-        start_index = np.argmin(np.abs(self.data_widgets['tab_ft'].left_pivot - freq))
-        end_index = np.argmin(np.abs(self.data_widgets['tab_ft'].right_pivot - freq))
-        if(end_index < start_index):
-            tmp = start_index
-            start_index = end_index
-            end_index = tmp
+        del_times = core.get_delay_times(self.fileselector.data)
 
-        integrations = np.sum(ft[:,start_index:end_index], axis=1)
-        integrations /= np.max(np.abs(integrations))
+        integrations = self.pipeline.integrate.get() # the Fourier transform tab's region
+        integrations = integrations / np.max(np.abs(integrations))
         integrals = integrations
         
         peaks = ft[:,len(ft)//2]
@@ -127,8 +119,8 @@ class TabChannelSlice(Tab):
 
     def get_exported_data(self):
         index = self.fileselector.spinbox_index.value()
-        return { 'frequencies (MHz)': self.data_widgets['tab_ft'].data[0][index],
-                 'fft': self.data_widgets['tab_ft'].data[1][index],
+        return { 'frequencies (MHz)': self.pipeline.freq.get()[index],
+                 'fft': self.pipeline.fft.get()[index],
                  self.combobox_labelling.currentText(): self.data[0],
                  'integrals': self.data[1],
                }
\ No newline at end of file
@@ -14,6 +14,8 @@ from DNMR.miniwidgets import *
 from DNMR.tab import Tab
 
 class TabFieldScan(Tab):
+    prepared_nodes = ['load', 'filter', 'window', 'phase']
+
     def __init__(self, data_widgets, parent=None):
         super(TabFieldScan, self).__init__(data_widgets, 'tab_fieldscan', parent)
         
@@ -27,8 +29,8 @@ class TabFieldScan(Tab):
                 
             index = self.fileselector.spinbox_index.value()
 
-            times = self.data_widgets['tab_phase'].data[0]
-            complexes = self.data_widgets['tab_phase'].data[1]
+            times = self.pipeline.load.get()[1]
+            complexes = self.pipeline.phase.get()
 
             reals = np.real(complexes)
             imags = np.imag(complexes)
@@ -76,8 +78,8 @@ class TabFieldScan(Tab):
 
     def get_exported_data(self):
         index = self.fileselector.spinbox_index.value()
-        return { 'times': self.data_widgets['tab_phase'].data[0][index],
-                 'complexes': self.data_widgets['tab_phase'].data[1][index],
+        return { 'times': self.pipeline.load.get()[1][index],
+                 'complexes': self.pipeline.phase.get()[index],
                  'fields': self.data[0],
                  'magnitudes': self.data[1],
                }
\ No newline at end of file
@@ -9,9 +9,13 @@ from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as Navigation
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
+import DNMR.core as core
 from DNMR.tab import *
 
 class TabFourierTransform(Tab):
+    prepared_nodes = ['load', 'filter', 'window', 'phase', 'align', 'fft', 'freq']
+    shows_all_acquisitions = False
+
     def __init__(self, data_widgets, parent=None):
         super(TabFourierTransform, self).__init__(data_widgets, 'tab_ft', parent)
         
@@ -41,6 +45,45 @@ class TabFourierTransform(Tab):
         self.spinbox_integration_centre.setDecimals(6)
         self.spinbox_integration_centre.valueChanged.connect(self.process_integrationcentre)
         
+        self.checkbox_subsample = QCheckBox('Sub-sample alignment?')
+        self.checkbox_subsample.setToolTip('Start every acquisition exactly at its peak location, rather than at the closest point')
+        self.checkbox_subsample.stateChanged.connect(self.update)
+        
+        self.label_zerofill = QLabel('Zero-fill (x)')
+        self.spinbox_zerofill = QSpinBox()
+        self.spinbox_zerofill.setRange(1, 16)
+        self.spinbox_zerofill.setValue(1)
+        self.spinbox_zerofill.valueChanged.connect(self.update)
+        
+        self.checkbox_apodization = QCheckBox('Apodize?')
+        self.combobox_apodization = QComboBox()
+        self.combobox_apodization.addItems(core.apodization_types)
+        self.combobox_apodization.currentTextChanged.connect(self.update)
+        self.spinbox_broadening = QDoubleSpinBox()
+        self.spinbox_broadening.setRange(0, 1e3)
+        self.spinbox_broadening.setSingleStep(1e-3)
+        self.spinbox_broadening.setDecimals(4)
+        self.spinbox_broadening.setValue(0.01)
+        self.spinbox_broadening.setSuffix(' MHz')
+        self.spinbox_broadening.valueChanged.connect(self.update)
+        self.checkbox_apodization.stateChanged.connect(self.update)
+        
+        self.checkbox_noise = QCheckBox('Noise band?')
+        self.checkbox_noise.setToolTip('Measure the noise of the integrals in a band without signal, and weigh the T1 fit with it')
+        self.checkbox_noise.stateChanged.connect(self.update)
+        self.spinbox_noise_left = QDoubleSpinBox()
+        self.spinbox_noise_left.setRange(-1e9, 1e9)
+        self.spinbox_noise_left.setDecimals(6)
+        self.spinbox_noise_left.setValue(1.0)
+        self.spinbox_noise_left.setSuffix(' MHz')
+        self.spinbox_noise_left.valueChanged.connect(self.update)
+        self.spinbox_noise_right = QDoubleSpinBox()
+        self.spinbox_noise_right.setRange(-1e9, 1e9)
+        self.spinbox_noise_right.setDecimals(6)
+        self.spinbox_noise_right.setValue(2.0)
+        self.spinbox_noise_right.setSuffix(' MHz')
+        self.spinbox_noise_right.valueChanged.connect(self.update)
+        
         #self.canvas.mpl_connect('button_press_event', self.process_button)
         
         l = QVBoxLayout()
@@ -50,8 +93,23 @@ class TabFourierTransform(Tab):
         l2 = QHBoxLayout()
         l2.addWidget(self.label_integration_centre)
         l2.addWidget(self.spinbox_integration_centre)
+        l3 = QHBoxLayout()
+        l3.addWidget(self.checkbox_subsample)
+        l3.addWidget(self.label_zerofill)
+        l3.addWidget(self.spinbox_zerofill)
+        l4 = QHBoxLayout()
+        l4.addWidget(self.checkbox_apodization)
+        l4.addWidget(self.combobox_apodization)
+        l4.addWidget(self.spinbox_broadening)
+        l5 = QHBoxLayout()
+        l5.addWidget(self.checkbox_noise)
+        l5.addWidget(self.spinbox_noise_left)
+        l5.addWidget(self.spinbox_noise_right)
         l.addLayout(l1)
         l.addLayout(l2)
+        l.addLayout(l3)
+        l.addLayout(l4)
+        l.addLayout(l5)
         return l
         
         #l = QHBoxLayout()
@@ -78,36 +136,30 @@ class TabFourierTransform(Tab):
                     self.moving_left = not(self.moving_left)
                     self.update()
 
+    def set_parameters(self):
+        self.left_pivot, self.right_pivot = core.get_pivots(self.spinbox_integration_centre.value(), self.spinbox_integration_width.value())
+        if(self.checkbox_noise.isChecked()):
+            self.pipeline.set_integration(self.left_pivot, self.right_pivot, self.spinbox_noise_left.value(), self.spinbox_noise_right.value())
+        else:
+            self.pipeline.set_integration(self.left_pivot, self.right_pivot)
+        self.pipeline.set_transform(subsample=self.checkbox_subsample.isChecked(), zero_fill=self.spinbox_zerofill.value(),
+                                    apodization=self.combobox_apodization.currentText() if self.checkbox_apodization.isChecked() else None,
+                                    broadening=self.spinbox_broadening.value())
+
     def plot_logic(self):
         index = self.fileselector.spinbox_index.value()
         
-        times = self.data_widgets['tab_phase'].data[0]
-        complexes = self.data_widgets['tab_phase'].data[1]
-
-        timespacing = (times[index][1]-times[index][0])
-    
-        time_index = np.argmin(np.abs(self.fileselector.data['peak_locations'][:,None] - times), axis=1)
-        s_complexes = np.zeros_like(complexes)
-        s_times = np.zeros_like(times)
-        for i in range(s_complexes.shape[0]):
-            s_complexes[i,:] = np.roll(complexes[i,:], -time_index[i])
-            s_times[i,:]     = np.roll(times[i,:],     -time_index[i])
-        s_reals = np.real(s_complexes)
-        s_imags = np.imag(s_complexes)
-
-        fftfreq = np.fft.fftshift(np.fft.fftfreq(s_complexes[index].shape[0], d=timespacing)) # microseconds
+        fftfreq = self.pipeline.freq.get() # MHz
+        fft = self.pipeline.fft.get()
         
         # update spinboxes.
         self.spinbox_integration_centre.setRange(np.min(fftfreq), np.max(fftfreq))
         self.spinbox_integration_centre.setSingleStep(np.max(fftfreq) * 1e-2)
         self.spinbox_integration_centre.setRange(np.min(fftfreq), np.max(fftfreq))
+        self.spinbox_noise_left.setRange(np.min(fftfreq), np.max(fftfreq))
+        self.spinbox_noise_right.setRange(np.min(fftfreq), np.max(fftfreq))
         
-        self.left_pivot = self.spinbox_integration_centre.value() - self.spinbox_integration_width.value()/2.0
-        self.right_pivot = self.spinbox_integration_centre.value() + self.spinbox_integration_width.value()/2.0
-        
-        fft = np.zeros_like(s_complexes, dtype=np.complex128)
-        for i in range(s_complexes.shape[0]):
-            fft[i] = np.fft.fftshift(np.fft.fft(s_complexes[i]))
+        self.set_parameters() # the centre and noise band may have been moved into range
         self.data = (fftfreq, fft)
         
         self.ax.plot(fftfreq, np.real(fft[index]), 'r', alpha=0.6, label='R')
@@ -121,9 +173,13 @@ class TabFourierTransform(Tab):
 
         self.ax.axvline(self.left_pivot, color='k')
         self.ax.axvline(self.right_pivot, color='k')
+        if(self.checkbox_noise.isChecked()):
+            self.ax.axvspan(self.spinbox_noise_left.value(), self.spinbox_noise_right.value(), color='k', alpha=0.1, label='noise')
 
     def fit(self):
         '''Fits a gaussian'''
+        if(self.stale):
+            self.update_now()
         def gauss(args, x):
             return args[0]*np.exp(-np.square((x-args[2])/(2*args[1]))) + args[3]
         
@@ -137,8 +193,8 @@ class TabFourierTransform(Tab):
         
     def get_exported_data(self):
         index = self.fileselector.spinbox_index.value()
-        return { 'times': self.data_widgets['tab_phase'].data[0][index],
-                 'complexes': self.data_widgets['tab_phase'].data[1][index],
+        return { 'times': self.pipeline.load.get()[1][index],
+                 'complexes': self.pipeline.phase.get()[index],
                  'frequencies (MHz)': self.data[0],
                  'fft': self.data[1][index],
                }
\ No newline at end of file
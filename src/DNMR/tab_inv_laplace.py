@@ -11,6 +11,7 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
 import DNMR.fileops as fileops
+import DNMR.core as core
 from DNMR.miniwidgets import *
 
 from DNMR.tab import Tab
@@ -22,6 +23,7 @@ class TabInvLaplace(Tab):
         super(TabInvLaplace, self).__init__(data_widgets, 'tab_inv_laplace', parent)
         
         self.plotted_data = []
+        self.fit_worker = self.new_worker()
         
     def generate_layout(self):
         l = QHBoxLayout()
@@ -36,73 +38,76 @@ class TabInvLaplace(Tab):
             self.ax.plot(i[0], i[1], label=i[2], alpha=0.5)
             
     def fit(self):
-        ts = self.data_widgets['tab_phase'].data[0]
-        freq = self.data_widgets['tab_ft'].data[0]
-        ft   = self.data_widgets['tab_ft'].data[1]
-        imag = np.imag(ft)
-        real = np.real(ft)
-        F = real + 1j*imag
-        
-        # for 7/2 spin.
-        qs = np.array([1,6,15,28])
-        ps = np.array([1/84, 3/44, 75/364, 1225/1716])
-        num_bins = 250
-        T1s = np.exp(np.linspace(np.log(4.5e5), np.log(5.5e5), num_bins))
-
-        integrations = np.zeros(real.shape[0])
-        start_index = np.argmin(np.abs(self.data_widgets['tab_ft'].left_pivot - freq))
-        end_index = np.argmin(np.abs(self.data_widgets['tab_ft'].right_pivot - freq))
-        if(end_index < start_index):
-            tmp = start_index
-            start_index = end_index
-            end_index = tmp
-
-        integrations = np.sum(F[:,start_index:end_index], axis=1)
-        integrations -= np.min(integrations)
-        integrations /= np.max(integrations)
-        integrations *= 2.0
-        integrations -= 1.0
+        '''Starts the fits in the background (pressing Fit again restarts them). A change of the data or its processing cancels them.'''
+        self.set_pipeline()
         try:
             ts = self.fileselector.data.sequence['0'].delay_time
         except:
             ts = self.fileselector.data.sequence['0'].relaxation_time # Legacy
+        integrate = self.pipeline.integrate # over the Fourier transform tab's region
+        self.fit_worker.submit(lambda progress: fit_distributions(progress, integrate.get(), ts), on_done=self.show_fit)
+
+    def show_fit(self, plotted_data):
+        self.plotted_data = plotted_data
+        self.redraw()
+
+def fit_distributions(progress, integrations, ts):
+    '''Fits T1 distributions to the integrals of the spectra, for three regularisations. Runs on a worker thread.
+
+    Returns
+    -------
+        list of (T1s, distribution, label) to plot.
+    '''
+    # for 7/2 spin.
+    qs = np.array([1,6,15,28])
+    ps = np.array([1/84, 3/44, 75/364, 1225/1716])
+    num_bins = 250
+    T1s = np.exp(np.linspace(np.log(4.5e5), np.log(5.5e5), num_bins))
+
+    integrations = np.array(integrations) # a copy: the pipeline's is cached
+    integrations -= np.min(integrations)
+    integrations /= np.max(integrations)
+    integrations *= 2.0
+    integrations -= 1.0
+    
+    inv_T1s = 1/T1s
+    
+    kernel = np.sum(1 - 2*ps[:,None,None]*np.exp(-qs[:,None,None] * ts[None,:,None]/T1s[None,None,:]), axis=0) # K[i,j]
+    kernel = np.matrix(kernel)
+    
+    kernel = np.diag(np.linalg.svd(kernel)[1])
+    kernel = np.resize(kernel, (len(ts), len(T1s)))
+    
+    def gaussian(x, sigma):
+        g = np.exp(-1/2 * np.square((T1s - x)/sigma))
+        return g/np.maximum(1e-9, np.sum(g))
+    
+    def cost_function(M, K, P, alpha):
+        P = np.abs(P)
+        return np.square(np.linalg.norm(M - K@P)) + alpha*np.square(np.linalg.norm(P))
         
-        inv_T1s = 1/T1s
-        
-        kernel = np.sum(1 - 2*ps[:,None,None]*np.exp(-qs[:,None,None] * ts[None,:,None]/T1s[None,None,:]), axis=0) # K[i,j]
-        kernel = np.matrix(kernel)
-        
-        kernel = np.diag(np.linalg.svd(kernel)[1])
-        kernel = np.resize(kernel, (len(ts), len(T1s)))
-        
-        def gaussian(x, sigma):
-            g = np.exp(-1/2 * np.square((T1s - x)/sigma))
-            return g/np.maximum(1e-9, np.sum(g))
+    bounds = [ [ 1e-9, 1.0] for i in range(num_bins) ]
+    # WAY UNDERDETERMINED
+    plotted_data = []
+    alphas = [1e-1, 1e0, 1e1]
+    for ai, a in enumerate(alphas):
+        progress(ai/len(alphas))
+        #res = sp.optimize.differential_evolution(lambda x, *args: cost_function(args[0], args[1], x, a), bounds, args=(integrations, kernel), constraints=(sp.optimize.LinearConstraint(np.identity(num_bins), 1.0, 1.01),))
+        #x0 = np.ones(num_bins)/num_bins#np.exp(-np.square(np.linspace(-10, 10, num_bins))/2)
+        #res = sp.optimize.minimize(lambda x, *args: cost_function(args[0], args[1], x, a), x0=x0, args=(integrations, kernel), method='SLSQP', constraints=({'type': 'eq', 'fun': lambda x: 1-np.sum(np.abs(x))},), options={'ftol':1e-9, 'maxiter': 2500})
+        x0 = sp.optimize.brute(lambda x, *args: cost_function(args[0], args[1], gaussian(x, 10), a), ranges=[(T1s[0], T1s[-1])], Ns=len(T1s), args=(integrations, kernel), finish=None)
+        sigma = sp.optimize.brute(lambda x, *args: cost_function(args[0], args[1], gaussian(x0, np.exp(x)), a), ranges=[(1, np.log(T1s[-1]))], Ns=len(T1s), args=(integrations, kernel), finish=None)
+        sigma = np.exp(sigma)
+        print(x0, sigma)
+        progress((ai + 0.5)/len(alphas))
         
-        def cost_function(M, K, P, alpha):
-            P = np.abs(P)
-            return np.square(np.linalg.norm(M - K@P)) + alpha*np.square(np.linalg.norm(P))
-            
-        bounds = [ [ 1e-9, 1.0] for i in range(num_bins) ]
-        # WAY UNDERDETERMINED
-        self.plotted_data = []
-        for a in [1e-1, 1e0, 1e1]:
-            #res = sp.optimize.differential_evolution(lambda x, *args: cost_function(args[0], args[1], x, a), bounds, args=(integrations, kernel), constraints=(sp.optimize.LinearConstraint(np.identity(num_bins), 1.0, 1.01),))
-            #x0 = np.ones(num_bins)/num_bins#np.exp(-np.square(np.linspace(-10, 10, num_bins))/2)
-            #res = sp.optimize.minimize(lambda x, *args: cost_function(args[0], args[1], x, a), x0=x0, args=(integrations, kernel), method='SLSQP', constraints=({'type': 'eq', 'fun': lambda x: 1-np.sum(np.abs(x))},), options={'ftol':1e-9, 'maxiter': 2500})
-            x0 = sp.optimize.brute(lambda x, *args: cost_function(args[0], args[1], gaussian(x, 10), a), ranges=[(T1s[0], T1s[-1])], Ns=len(T1s), args=(integrations, kernel), finish=None)
-            sigma = sp.optimize.brute(lambda x, *args: cost_function(args[0], args[1], gaussian(x0, np.exp(x)), a), ranges=[(1, np.log(T1s[-1]))], Ns=len(T1s), args=(integrations, kernel), finish=None)
-            sigma = np.exp(sigma)
-            print(x0, sigma)
-            
-            P0 = gaussian(x0, sigma)
-            res = sp.optimize.minimize(lambda x, *args: cost_function(args[0], args[1], x, a), x0=P0, args=(integrations, kernel), method='SLSQP', constraints=({'type': 'eq', 'fun': lambda x: 1-np.sum(np.abs(x))},))
-            print(res)
-            
-            res_x = np.abs(res.x)
-            normed = res_x / np.sum(res_x)
-            self.plotted_data += [(T1s, normed, f'alpha={a}')]
-            self.plotted_data += [(T1s, P0, f'G alpha={a}')]
+        P0 = gaussian(x0, sigma)
+        res = sp.optimize.minimize(lambda x, *args: cost_function(args[0], args[1], x, a), x0=P0, args=(integrations, kernel), method='SLSQP', constraints=({'type': 'eq', 'fun': lambda x: 1-np.sum(np.abs(x))},),
+                                   callback=lambda xk: progress((ai + 0.5)/len(alphas))) # lets a cancel stop it
+        print(res)
         
-        self.update()
-        
\ No newline at end of file
+        res_x = np.abs(res.x)
+        normed = res_x / np.sum(res_x)
+        plotted_data += [(T1s, normed, f'alpha={a}')]
+        plotted_data += [(T1s, P0, f'G alpha={a}')]
+    return plotted_data
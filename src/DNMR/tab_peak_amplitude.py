@@ -10,6 +10,7 @@ from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as Navigation
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
+import DNMR.core as core
 from DNMR.miniwidgets import *
 from DNMR.tab import Tab
 from DNMR.fileops import data_struct
@@ -81,33 +82,21 @@ class TabPeakAmplitude(Tab):
         if(current_item in ['Load Order'] + keys):
             self.combobox_labelling.setCurrentIndex((['Load Order'] + keys).index(current_item))
 
+    def get_prepared_nodes(self):
+        p = self.pipeline
+        if(self.checkbox_integrate.isChecked()):
+            return [ p.load, p.filter, p.window, p.phase, p.align, p.fft, p.freq, p.cumulative, p.integrate ]
+        return [ p.load, p.filter, p.window, p.phase ]
+
     def plot_logic(self):
-        
-        freq = self.data_widgets['tab_ft'].data[0]
-        ft   = self.data_widgets['tab_ft'].data[1]
-        real = np.real(ft)
-        try:
-            del_times = self.fileselector.data.sequence['0'].delay_time
-        except:
-            del_times = self.fileselector.data.sequence['0'].relaxation_time # Legacy
+        del_times = core.get_delay_times(self.fileselector.data)
 
+        p = self.pipeline
         values = None
         if(self.checkbox_integrate.isChecked()):
-            values = np.zeros(real.shape[0])
-            start_index = np.argmin(np.abs(self.data_widgets['tab_ft'].left_pivot - freq))
-            end_index = np.argmin(np.abs(self.data_widgets['tab_ft'].right_pivot - freq))
-            if(end_index < start_index):
-                tmp = start_index
-                start_index = end_index
-                end_index = tmp
-
-            values = np.sum(ft[:,start_index:end_index], axis=1)
+            values = p.integrate.get()
         else:
-            times = self.data_widgets['tab_phase'].data[0]
-            complexes = self.data_widgets['tab_phase'].data[1]
-            
-            time_index = np.argmin(np.abs(self.fileselector.data['peak_locations'][:,None] - times), axis=1)
-            values = complexes[:,time_index]
+            values = core.peak_values(p.load.get()[1], p.phase.get(), self.fileselector.data['peak_locations'])
             
         integrals = values
 
@@ -137,8 +126,8 @@ class TabPeakAmplitude(Tab):
 
     def get_exported_data(self):
         index = self.fileselector.spinbox_index.value()
-        return { 'frequencies (MHz)': self.data_widgets['tab_ft'].data[0][index],
-                 'fft': self.data_widgets['tab_ft'].data[1][index],
+        return { 'frequencies (MHz)': self.pipeline.freq.get()[index],
+                 'fft': self.pipeline.fft.get()[index],
                  self.combobox_labelling.currentText(): self.data[0],
                  'integrals': self.data[1],
                }
\ No newline at end of file
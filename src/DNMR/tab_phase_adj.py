@@ -10,10 +10,14 @@ from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as Navigation
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
+import DNMR.core as core
 from DNMR.miniwidgets import *
 from DNMR.tab import Tab
 
 class TabPhaseAdjustment(Tab):
+    prepared_nodes = ['load', 'filter', 'window', 'phase']
+    shows_all_acquisitions = False
+
     def __init__(self, data_widgets, parent=None):
         super(TabPhaseAdjustment, self).__init__(data_widgets, 'tab_phase', parent)
         
@@ -32,7 +36,7 @@ class TabPhaseAdjustment(Tab):
         self.checkbox_filter = QCheckBox('Filter')
         self.checkbox_filter.checkStateChanged.connect(self.update)
         self.combobox_filtertype = QComboBox()
-        self.combobox_filtertype.addItems(['Sinc','Gaussian','Half-Gaussian','Median'])
+        self.combobox_filtertype.addItems(core.filter_types)
         self.combobox_filtertype.currentTextChanged.connect(self.update)
         
         
@@ -49,7 +53,7 @@ class TabPhaseAdjustment(Tab):
         self.checkbox_multfilter = QCheckBox('Window')
         self.checkbox_multfilter.checkStateChanged.connect(self.update)
         self.combobox_multfiltertype = QComboBox()
-        self.combobox_multfiltertype.addItems(['Half-Gaussian','Sinc','Gaussian','Box'])
+        self.combobox_multfiltertype.addItems(core.window_types)
         self.combobox_multfiltertype.currentTextChanged.connect(self.update)
         
         self.pushbutton_phaseadjust = QPushButton('Autophase')
@@ -88,35 +92,23 @@ class TabPhaseAdjustment(Tab):
         return l2
 
     def locate_max(self):
+        if(self.stale):
+            self.update_now()
         if(self.data[0].shape[0] == 0):
             return
             
-        flat_index = np.argmax(np.abs(self.data[1])) # max magnitude
-        index = np.unravel_index(flat_index, self.data[1].shape)
-        
-        self.fileselector.spinbox_index.setValue(index[0])
+        self.fileselector.spinbox_index.setValue(core.locate_max(self.data[1])) # max magnitude
 
     def autophase(self):
+        if(self.stale):
+            self.update_now()
         if(self.data[0].shape[0] == 0):
             return
         
         # find peak, current phase at peak
         index = self.fileselector.spinbox_index.value()
-        times = self.data[0][index]
-        complexes = self.data[1][index]
-        mags = np.abs(complexes)
-        
-        peak_i = np.argmax(mags)
-        peak_t = times[peak_i]
-        peak_c = complexes[peak_i]
-        angle = np.arctan2(np.imag(peak_c),np.real(peak_c))
-        angle_degrees = angle * 180.0/np.pi
-        
         current_phases = self.get_global_phaseset() # degrees
-        new_phase_degrees = current_phases[index]-angle_degrees
-        # modulo 180
-        new_phase_degrees += (np.abs(new_phase_degrees - 180.0)//360)*360.0
-        new_phase_degrees -= (np.abs(new_phase_degrees + 180.0)//360)*360.0
+        new_phase_degrees, peak_t = core.autophase(self.data[0][index], self.data[1][index], current_phases[index])
         
         # now do the setting phase to zero.
         self.fileselector.data['phases'] = [ new_phase_degrees for i in range(len(self.fileselector.data['phases'])) ]
@@ -167,54 +159,27 @@ class TabPhaseAdjustment(Tab):
                     self.fileselector.data['peak_locations'][index] = event.xdata
                 self.update()
 
+    def set_parameters(self):
+        p = self.pipeline
+        p.set_peaks(self.get_global_phaseset(), self.get_global_peaklocs())
+        p.filter.set(filter_type=self.combobox_filtertype.currentText() if self.checkbox_filter.isChecked() else None,
+                     filter_size=self.spinbox_filtersize.value())
+        p.window.set(window_type=self.combobox_multfiltertype.currentText() if self.checkbox_multfilter.isChecked() else None,
+                     window_size=self.spinbox_multfiltersize.value(), window_position=self.spinbox_multfilterposition.value())
+
     def plot_logic(self):
         index = self.fileselector.spinbox_index.value()
-        reals = self.fileselector.data.reals
-        imags = self.fileselector.data.imags
-        times = self.fileselector.data.times
-        times = times[:,:reals.shape[1]]
-        
         peak_loc = self.get_global_peaklocs()[index]
         
         ps = self.get_global_phaseset()
         self.phase_adjustment.slider_phase.setValue(int(ps[index]))
 
-        complexes = reals.astype(np.complex128) + 1j*imags.astype(np.complex128)
-        
-        if(self.checkbox_filter.isChecked()):
-            for i in range(complexes.shape[0]):
-                t = self.combobox_filtertype.currentText()
-                if(t == 'Gaussian'):
-                    kernel = np.exp(-1/2 * np.square(np.linspace(-3, 3, self.spinbox_filtersize.value()*2+1)))
-                elif(t == 'Sinc'):
-                    kernel = np.sinc(np.linspace(-reals.shape[1]/(2*self.spinbox_filtersize.value() + 1), reals.shape[1]/(2*self.spinbox_filtersize.value() + 1), reals.shape[1]))
-                elif(t == 'Half-Gaussian'):
-                    i_s = np.linspace(-3, 3, self.spinbox_filtersize.value()*2+1)
-                    kernel = np.where(i_s >= 0, np.exp(-1/2 * np.square(i_s)), 0)
-                elif(t == 'Median'):
-                    complexes[i] = sp.ndimage.median_filter(reals[i], mode='wrap', size=self.spinbox_filtersize.value()) + 1j * sp.ndimage.median_filter(imags[i], mode='wrap', size=self.spinbox_filtersize.value())
-                    continue
-                kernel /= np.sum(kernel)
-                complexes[i] = np.convolve(complexes[i], kernel, mode='same')
-
-        if(self.checkbox_multfilter.isChecked()):
-            t = self.combobox_multfiltertype.currentText()
-            s = self.spinbox_multfiltersize.value()
-            
-            dt = times - self.get_global_peaklocs()[:,None] - self.spinbox_multfilterposition.value()
-            if(t == 'Gaussian'):
-                kernel = np.exp(-1/2 * np.square(dt / s))
-            elif(t == 'Sinc'):
-                kernel = np.sinc(dt / s)
-            elif(t == 'Half-Gaussian'):
-                kernel = np.where(dt >= 0, np.exp(-1/2 * np.square(dt/s)), 0)
-            elif(t == 'Box'):
-                kernel = np.where((dt >= 0) * (dt <= s), 1, 0)
-            complexes *= kernel
-            self.ax.plot(times[index], kernel[index] * np.max(np.abs(complexes[index])/np.where(kernel[index]>0, kernel[index], 1e9)), color='k', alpha=0.3)
-            
-        phases = np.exp(1j*np.array(ps)* np.pi/180.0)
-        complexes *= phases[:,None]
+        # only the stages whose settings changed are recomputed (see core/graph.py)
+        times = self.pipeline.load.get()[1] # lazy_rows are read in here, once per channel
+        complexes = self.pipeline.phase.get()
+        window = self.pipeline.window.get()[1]
+        if not(window is None):
+            self.ax.plot(times[index], window[index] * np.max(np.abs(complexes[index])/np.where(window[index]>0, window[index], 1e9)), color='k', alpha=0.3)
 
         #complexes -= np.average(complexes, axis=1)[:,None]
 
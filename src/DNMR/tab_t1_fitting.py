@@ -11,11 +11,13 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 
 import DNMR.fileops as fileops
+import DNMR.core as core
 from DNMR.miniwidgets import *
 
 from DNMR.tab import Tab
 
 class TabT1Fit(Tab):
+    prepared_nodes = ['load', 'filter', 'window', 'phase', 'align', 'fft', 'freq', 'cumulative', 'integrate', 'noise', 'points']
     output_frames = {}
 
     def __init__(self, data_widgets, parent=None):
@@ -26,6 +28,8 @@ class TabT1Fit(Tab):
         self.excluded_points_indices = []
         self.x0 = None
         self.sigmas = None
+        self.channel_fits = None # (channels, popts, sigmas) of the last fit of all channels together
+        self.fit_worker = self.new_worker()
         
     def get_current_oframe(self):
         return self.output_frames[self.combobox_fittingroutine.currentText()]
@@ -36,6 +40,9 @@ class TabT1Fit(Tab):
         
         self.pushbutton_fit = QPushButton('Fit')
         self.pushbutton_fit.clicked.connect(self.fit)
+        self.pushbutton_fit_channels = QPushButton('Fit all channels')
+        self.pushbutton_fit_channels.setToolTip('Fit every loaded channel at once, with the parameters ticked "Share?" common to all of them')
+        self.pushbutton_fit_channels.clicked.connect(self.fit_channels)
         
         self.checkbox_normalize = QCheckBox('Normalize?')
         self.checkbox_normalize.setCheckState(Qt.CheckState(2)) # checked.
@@ -45,7 +52,10 @@ class TabT1Fit(Tab):
         lv.addWidget(self.combobox_fittingroutine)
         lv.addWidget(self.checkbox_normalize)
         l.addLayout(lv)
-        l.addWidget(self.pushbutton_fit)
+        lb = QVBoxLayout()
+        lb.addWidget(self.pushbutton_fit)
+        lb.addWidget(self.pushbutton_fit_channels)
+        l.addLayout(lb)
 
         def add_fit_frame(name, *args, **kwargs):
             ''' Creates a frame widget for a new fit type and its output. args are, in order, the name of a fit variable, then unit string, then repeat.
@@ -101,37 +111,7 @@ class TabT1Fit(Tab):
                 self.update()
 
     def plot_logic(self):
-        freq = self.data_widgets['tab_ft'].data[0]
-        ft   = self.data_widgets['tab_ft'].data[1]
-        real = np.real(ft)
-        try:
-            del_times = self.fileselector.data.sequence['0'].delay_time
-        except:
-            del_times = self.fileselector.data.sequence['0'].relaxation_time # Legacy
-            print(del_times)
-
-        integrations = np.zeros(real.shape[0], dtype=np.complex128)
-        start_index = np.argmin(np.abs(self.data_widgets['tab_ft'].left_pivot - freq))
-        end_index = np.argmin(np.abs(self.data_widgets['tab_ft'].right_pivot - freq))
-        if(end_index < start_index):
-            tmp = start_index
-            start_index = end_index
-            end_index = tmp
-
-        integrations = np.sum(real[:,start_index:end_index], axis=1)
-        
-        if(self.checkbox_normalize.isChecked()):
-            integrations /= np.max(integrations)
-        rt = np.real(self.data_widgets['tab_ft'].data[1])
-        
-        uncertainties = 1e-6*np.ones_like(integrations) # TODO: Figure out real stddevs
-        #uncertainties += integrations * np.sqrt((end_index-start_index+1) / rt.shape[1])
-        #uncertainties = np.abs(uncertainties)
-            
-        sort_indices = np.argsort(del_times)
-        del_times = del_times[sort_indices]
-        integrations = integrations[sort_indices]
-        uncertainties = uncertainties[sort_indices]
+        del_times, integrations, uncertainties = self.pipeline.points.get()
         
         self.ax.set_xscale('log')
         self.ax.set_xlabel('delay time (us)')
@@ -169,6 +149,9 @@ class TabT1Fit(Tab):
             params_list = params_list[:-1]
             self.ax.plot(self.plot_data[0], self.plot_data[1], label=params_list)
         
+    def set_parameters(self):
+        self.pipeline.points.set(normalize=self.checkbox_normalize.isChecked())
+
     def update_fit_type(self):
         for key, val in self.output_frames.items():
             val['frame'].hide()
@@ -176,97 +159,75 @@ class TabT1Fit(Tab):
         out_frame['frame'].show()
         
     def fit(self):
-        self.update() # get most recent values to fit
+        '''Starts a fit in the background (pressing Fit again restarts it), of the points as the pipeline computes them
+        there. show_fit shows the result. A change of the data or its processing cancels it.'''
+        self.set_pipeline() # most recent values to fit
         self.plot_data = (np.array([]),np.array([]))
+        self.channel_fits = None
         out_frame = self.get_current_oframe()
-        bounds = None
-        try:
-            del_times = self.fileselector.data.sequence['0'].delay_time
-        except:
-            del_times = self.fileselector.data.sequence['0'].relaxation_time # Legacy, as I didn't know what this was when I wrote it. Surprise, surprise
+        # DEVELOPER NOTE: If you want to add more options for this, define the fit function in core/t1.py and add an item in the generate_layout function
+        model = self.combobox_fittingroutine.currentText()
+        fixed = {}
+        for i in range(len(out_frame['widgets'])):
+            widget = out_frame['widgets'][i]
+            if(widget.is_fixed()):
+                fixed[i] = widget.get_value()
+        excluded = list(self.excluded_points_indices)
+        points = self.pipeline.points
+        def run(progress):
+            del_times, integrations, uncertainties = points.get()
+            return core.fit_t1(del_times, integrations, uncertainties, model, fixed, excluded, callback=progress, workers=-1), np.delete(del_times, excluded)
+        self.fit_worker.submit(run, on_done=lambda result: self.show_fit(result[0], model, result[1]))
 
-        if(self.combobox_fittingroutine.currentText() == '7/2 Spin'):
-            # DEVELOPER NOTE: If you want to add more options for this, make sure to define fit_func (similarly to below) and add an item in the generate_layout function
-            
-            bounds = [ [0, np.max(np.abs(self.data[1]))*10], [-1, 10], [np.min(del_times)/10, np.max(del_times)*10], [0.99*0, 1.01*10] ]
-            def fit_func(args, x):
-                gamma_0 = args[0]
-                s = args[1] # inversion
-                T1 = args[2] # relaxation time (actual fit variable, really)
-                r = args[3] # stretched exponent (ideally 1)
-                #y = y0 (1-(1+s) ((1/84)*Exp[-(t/T1)^r]+(3/44)*Exp[-(6 t/T1)^r]+(75/364)*Exp[-(15 t/T1)^r]+(1225/1716)*Exp[-(28 t/T1)^r]))
-                fit = gamma_0 * (1-(1+s)*(
-                                            (1/84)*     np.exp(-np.pow(x/T1,    r)) + 
-                                            (3/44)*     np.exp(-np.pow(6*x/T1,  r)) +
-                                            (75/364)*   np.exp(-np.pow(15*x/T1, r)) +
-                                            (1225/1716)*np.exp(-np.pow(28*x/T1, r)) 
-                                         ))
-                return fit
-                
-        elif(self.combobox_fittingroutine.currentText() == '7/2 Spin (Sat. 1)'):
-            bounds = [ [0, np.max(np.abs(self.data[1]))*10], [-1, 10], [np.min(del_times)/10, np.max(del_times)*10], [0.99*0, 1.01*10] ]
-            
-            def fit_func(args, t):
-                gamma_0 = args[0]
-                s = args[1]
-                T1 = args[2]
-                r = args[3]
-                
-                return gamma_0 * (1 - (1+s) * (1/84*np.exp(-np.pow(t/T1, r)) + 
-                                               1/84*np.exp(-np.pow(3*t/T1, r)) + 
-                                               2/66*np.exp(-np.pow(6*t/T1, r)) + 
-                                               18/154*np.exp(-np.pow(10*t/T1, r)) + 
-                                               1/1092*np.exp(-np.pow(15*t/T1, r)) + 
-                                               49/132*np.exp(-np.pow(21*t/T1, r)) + 
-                                               392/858*np.exp(-np.pow(28*t/T1, r))))
-                
-        elif(self.combobox_fittingroutine.currentText() == '1/2 Spin'):
-            bounds = [ [0, np.max(np.abs(self.data[1]))*10], [-1, 10], [np.min(del_times)/10, np.max(del_times)*10], [0.99*0, 1.01*10] ]
-            
-            def fit_func(args, t):
-                gamma_0 = args[0]
-                s = args[1]
-                T1 = args[2]
-                r = args[3]
-                
-                return gamma_0 * (1 - (1+s) * np.exp(-np.pow(t/T1, r)))
-            
-        def cost_func(args, x, y, yerr):
-            return np.sum(np.square((fit_func(args, x) - y)/np.maximum(yerr, 0.01))) # more points is more fits
-            
+    def fit_channels(self):
+        '''Fits the curves of all loaded channels together in the background (core.fit_t1_shared), each channel processed
+        with this one's settings. Parameters ticked "Share?" are common to all channels; excluded points only apply to this one.'''
+        self.set_pipeline()
+        self.plot_data = (np.array([]),np.array([]))
+        out_frame = self.get_current_oframe()
+        model = self.combobox_fittingroutine.currentText()
+        fixed = {}
+        shared = []
         for i in range(len(out_frame['widgets'])):
             widget = out_frame['widgets'][i]
             if(widget.is_fixed()):
-                # Fix
-                fv = widget.get_value()
-                bounds[i] = [ fv, fv ]
-            
-        included_xvals = []
-        included_yvals = []
-        included_errs = []
-        for i in range(len(self.data[0])):
-            if not(i in self.excluded_points_indices):
-                included_xvals += [self.data[0][i]]
-                included_yvals += [self.data[1][i]]
-                included_errs  += [self.data[2][i]]
-        included_xvals = np.array(included_xvals)
-        included_yvals = np.array(included_yvals)
-        included_errs  = np.array(included_errs)
-        # global minimum
-        res = sp.optimize.differential_evolution(lambda x: cost_func(x, 
-                                                                     included_xvals, 
-                                                                     included_yvals,
-                                                                     included_errs), 
-                                                 bounds=bounds)
-        # get uncertainties on the fit, as I am too lazy to do the full analysis when scipy will do it for me
+                fixed[i] = widget.get_value()
+            if(widget.is_shared()):
+                shared += [ i ]
+        current = self.fileselector.spinbox_channel.value()
+        channels = self.fileselector.get_channels()
+        if not(current in channels):
+            return
+        pipelines = { ch: self.pipeline.with_data(data) for ch, data in channels.items() if not(ch == current) }
+        chs = list(channels.keys())
+        pipelines[current] = self.pipeline
+        excluded = list(self.excluded_points_indices)
+        def run(progress):
+            curves = []
+            for i, ch in enumerate(chs):
+                progress(0.5*i/len(chs))
+                curves += [ pipelines[ch].points.get() ]
+            result = core.fit_t1_shared(curves, model, shared, fixed, [ excluded if ch == current else [] for ch in chs ], callback=lambda f: progress(0.5 + 0.5*f))
+            return result, np.delete(curves[chs.index(current)][0], excluded)
+        self.fit_worker.submit(run, on_done=lambda result: self.show_channel_fits(result[0], model, chs, current, result[1]))
+
+    def show_channel_fits(self, result, model, chs, current, included_xvals):
+        popts, sigmas, res = result
+        self.channel_fits = (chs, popts, sigmas)
+        print(f'Fit of channels {chs} together, sharing {[ core.parameters[i][1] for i in res.shared ]}:')
+        for ch, popt, sigma in zip(chs, popts, sigmas):
+            print(f'  channel {ch}: ' + ', '.join([ f'{p[1]}={x:.6g}\u00b1{s:.2g}' for p, x, s in zip(core.parameters, popt, sigma) ]))
+        k = chs.index(current)
+        self.show_fit((popts[k], sigmas[k], res), model, included_xvals)
+
+    def show_fit(self, result, model, included_xvals):
+        out_frame = self.output_frames[model]
+        fit_func = core.fit_models[model]
         try:
-            picky_scipy_bounds = np.array(bounds).T 
-            picky_scipy_bounds[0,:] -= 1e-9
-            popt, pcov = sp.optimize.curve_fit(lambda xs, *args: fit_func(args, xs), included_xvals, included_yvals, p0=res.x, bounds=picky_scipy_bounds, sigma=included_errs, absolute_sigma=False)
-        
+            popt, sigmas, res = result
             print(res)
             self.x0 = popt
-            self.sigmas = np.sqrt(np.diag(pcov))
+            self.sigmas = sigmas
             x_vals = included_xvals
             if(x_vals.shape[0] < 100):
                 x_vals = np.exp(np.linspace(np.log(np.min(x_vals*1e-1)), np.log(np.max(x_vals*1e1)), 100, endpoint=True))
@@ -289,7 +250,7 @@ class TabT1Fit(Tab):
                     widget.set_value(display_x, display_sigma)
         except Exception as e:
             traceback.print_exc()
-        self.update()
+        self.redraw()
         
     def get_exported_data(self):
         out_frame = self.get_current_oframe()
@@ -303,10 +264,16 @@ class TabT1Fit(Tab):
         
         index = self.fileselector.spinbox_index.value()
         pd = {
-                 'frequencies (MHz)': self.data_widgets['tab_ft'].data[0],
-                 'fft': self.data_widgets['tab_ft'].data[1][index],
+                 'frequencies (MHz)': self.pipeline.freq.get(),
+                 'fft': self.pipeline.fft.get()[index],
                  'delays': self.data[0],
                  'integrals': self.data[1],
                 }
         pd.update(params_dict)
+        if not(self.channel_fits is None):
+            chs, popts, sigmas = self.channel_fits
+            pd['channels'] = chs
+            for i, wi in enumerate(out_frame['widgets']):
+                pd[wi.label + f' (channels)[{wi.units}]'] = popts[:,i]
+                pd[wi.label + f' error (channels)[{wi.units}]'] = sigmas[:,i]
         return pd
\ No newline at end of file
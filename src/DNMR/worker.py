@@ -0,0 +1,146 @@
+import threading
+import traceback
+
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, QCoreApplication, pyqtSignal
+from PyQt6.QtWidgets import *
+
+class cancelled(Exception):
+    '''Raised by a job's progress function once the job has been cancelled, to stop it.'''
+    pass
+
+class JobSignals(QObject):
+    # Emitted on the worker thread, received on the GUI thread (Qt queues signals across threads).
+    progress = pyqtSignal(float)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal()
+
+class Job(QRunnable):
+    '''One call of func(progress, *args, **kwargs) on a thread of the global QThreadPool.
+
+    progress(fraction) is for func to report how far it is (0 to 1). It raises cancelled once the job is cancelled,
+    so func stops at its next report: pass it on to anything long (e.g. the callback of core.fit_t1).
+    '''
+    def __init__(self, func, *args, **kwargs):
+        super(Job, self).__init__()
+        self.setAutoDelete(False) # the Worker keeps it
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self.done = threading.Event()
+        self._cancelled = threading.Event()
+
+    def progress(self, fraction):
+        if(self._cancelled.is_set()):
+            raise cancelled()
+        self.signals.progress.emit(float(fraction))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        try:
+            result = self.func(self.progress, *self.args, **self.kwargs)
+            if not(self.is_cancelled()):
+                self.signals.finished.emit(result)
+        except cancelled:
+            pass
+        except:
+            print(f'Failure in background job\n{"-"*100}')
+            traceback.print_exc()
+            print("-"*100)
+            self.signals.failed.emit()
+        finally:
+            self.done.set()
+
+class Worker(QObject):
+    '''Runs a tab's jobs off the GUI thread, one at a time: submitting a job cancels the one still running,
+    whose result is then thrown away. Results are passed to on_done on the GUI thread.'''
+    progress = pyqtSignal(float) # of the current job
+    busy = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super(Worker, self).__init__(parent)
+        self.job = None
+
+    def submit(self, func, *args, on_done=None, **kwargs):
+        '''Runs func(progress, *args, **kwargs) in the background, then on_done(result) on the GUI thread unless it was superseded.'''
+        self.cancel()
+        job = Job(func, *args, **kwargs)
+        job.signals.progress.connect(lambda f: self._progress(job, f))
+        job.signals.finished.connect(lambda result: self._finished(job, result, on_done))
+        job.signals.failed.connect(lambda: self._finished(job, None, None))
+        self.job = job
+        self.busy.emit(True)
+        self.progress.emit(0.0)
+        QThreadPool.globalInstance().start(job)
+        return job
+
+    def cancel(self):
+        '''Cancels the running job, if any. It stops at its next progress report.'''
+        if not(self.job is None):
+            self.job.cancel()
+            self.job = None
+            self.busy.emit(False)
+
+    def is_busy(self):
+        return not(self.job is None)
+
+    def wait(self):
+        '''Blocks until the current job is done and its result delivered. For scripts; the GUI never needs to.'''
+        job = self.job
+        while not(job is None) and self.job is job:
+            job.done.wait(0.05)
+            QCoreApplication.processEvents()
+
+    def _progress(self, job, fraction):
+        if(job is self.job):
+            self.progress.emit(fraction)
+
+    def _finished(self, job, result, on_done):
+        if not(job is self.job) or job.is_cancelled():
+            return # superseded
+        self.job = None
+        self.busy.emit(False)
+        if not(on_done is None):
+            try:
+                on_done(result)
+            except:
+                traceback.print_exc()
+
+class WorkerProgressWidget(QWidget):
+    '''A progress bar and a Cancel button, shown while any of the given workers is busy.'''
+    def __init__(self, workers=[], parent=None):
+        super(WorkerProgressWidget, self).__init__(parent)
+        self.workers = []
+
+        self.progressbar = QProgressBar()
+        self.progressbar.setRange(0, 1000)
+        self.progressbar.setTextVisible(False)
+        self.pushbutton_cancel = QPushButton('Cancel')
+        self.pushbutton_cancel.clicked.connect(self.cancel)
+
+        l = QHBoxLayout()
+        l.setContentsMargins(0, 0, 0, 0)
+        l.addWidget(self.progressbar)
+        l.addWidget(self.pushbutton_cancel)
+        self.setLayout(l)
+        self.hide()
+
+        for w in workers:
+            self.add_worker(w)
+
+    def add_worker(self, worker):
+        self.workers += [ worker ]
+        worker.progress.connect(lambda f: self.progressbar.setValue(int(1000*min(max(f, 0.0), 1.0))))
+        worker.busy.connect(self.update_visibility)
+
+    def update_visibility(self):
+        self.setVisible(any([ w.is_busy() for w in self.workers ]))
+
+    def cancel(self):
+        for w in self.workers:
+            w.cancel()